@@ -1,9 +1,31 @@
 from flask import Flask
 from flask_cors import CORS
-from routes import expense_bp, income_bp, wallet_bp, budget_bp, scanner_bp
+from routes import expense_bp, income_bp, wallet_bp, budget_bp, scanner_bp, events_bp, metrics_bp, health_bp, search_bp, transfer_bp, batch_bp, dashboard_bp, sync_bp
+from utils.json_provider import JSONProvider
+from utils.events import start_change_stream_source, EVENTS_SOURCE
+from utils.balance_buffer import balance_buffer, BALANCE_WRITE_BEHIND
+from utils.db import get_database
+from utils.admission import init_admission
+from utils.metrics import init_metrics
+from utils.db_accounting import init_db_accounting
+from utils.tracing import init_tracing
+from utils.routing import init_routing, READ_AFTER_HEADER
 
 app = Flask(__name__)
-CORS(app) 
+# Let the browser read the write time it has to send back to read its own writes
+CORS(app, expose_headers=[READ_AFTER_HEADER])
+# Return BSON dates as ISO strings, the same format the front-end sends
+app.json = JSONProvider(app)
+# Trace every request (TRACING_EXPORTER) and profile the ones that ask for it (PROFILE_TOKEN)
+init_tracing(app)
+# Measure every request, including the ones shed by admission control
+init_metrics(app)
+# Count the MongoDB commands of each request and log the slow ones
+init_db_accounting(app)
+# Shed load with a fast 429/503 before a request reaches MongoDB
+init_admission(app)
+# Send list and search reads to secondaries, in a causally consistent session per request
+init_routing(app)
 
 # Register Blueprints
 app.register_blueprint(expense_bp)
@@ -11,6 +33,21 @@ app.register_blueprint(income_bp)
 app.register_blueprint(wallet_bp)
 app.register_blueprint(budget_bp)
 app.register_blueprint(scanner_bp)
+app.register_blueprint(events_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(health_bp)
+app.register_blueprint(search_bp)
+app.register_blueprint(transfer_bp)
+app.register_blueprint(batch_bp)
+app.register_blueprint(dashboard_bp)
+app.register_blueprint(sync_bp)
+
+# Background workers: change streams feeding the event stream, write-behind balance flusher
+if EVENTS_SOURCE == 'change_streams' or BALANCE_WRITE_BEHIND:
+    database = get_database()
+    start_change_stream_source(database)
+    if BALANCE_WRITE_BEHIND:
+        balance_buffer.start(database)
 
 
 if __name__ == '__main__':   
@@ -0,0 +1,125 @@
+"""Generate a large synthetic dataset across several processes, for capacity planning.
+
+Budget i and everything below it are generated from their own random stream, seeded with
+(--seed, i). The data, ObjectIds included, is therefore the same whatever --workers is and
+however the budgets are split between processes, and an interrupted run can be run again:
+documents that were already loaded are skipped as duplicate keys. Each worker loads its documents with unordered insert_many
+batches. Indexes are built once, after loading, which is much faster than maintaining
+them on every insert.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.generate \
+        --budgets 10000 --wallets-per-budget 10 --transactions-per-wallet 500 \
+        [--users 1000] [--workers 8] [--batch-size 10000] [--seed 42] [--drop]
+
+Documents have the shapes the handlers read and write. Dates are stored as BSON dates,
+as the handlers have done since the date migration.
+"""
+import argparse
+import datetime
+import multiprocessing
+import os
+import random
+import time
+from pymongo.errors import BulkWriteError
+from utils.db import get_database
+from utils.indexes import ensure_indexes
+from utils.scoping import DEFAULT_USER_ID
+from benchmarks.seed import make_budget, make_wallet, make_expense, make_income, settle_opening_balances, SEED_COLLECTIONS
+
+NOW = datetime.datetime(2026, 1, 1)
+# Budgets handed to a worker at a time; small enough to spread the load evenly
+CHUNK_SIZE = 50
+
+def owner_of(index, users):
+    """Spread the budgets over `users` owners, or give them all to the default user"""
+    return DEFAULT_USER_ID if users <= 1 else f'user-{index % users}'
+
+def budget_tree(seed, index, users, wallets_per_budget, transactions_per_wallet):
+    """Return budget `index` with its wallets and transactions"""
+    rng = random.Random(f'{seed}:{index}')
+    user_id = owner_of(index, users)
+    budget = make_budget(rng, user_id, NOW)
+    wallets = [make_wallet(rng, user_id, budget["_id"], NOW) for _ in range(wallets_per_budget)]
+    documents = {"budget": [budget], "wallet": wallets, "income": [], "expense": []}
+    for wallet in wallets:
+        for _ in range(transactions_per_wallet):
+            # Roughly four expenses for every income
+            if rng.random() < 0.8:
+                documents["expense"].append(make_expense(rng, user_id, wallet["wallet_id"], NOW))
+            else:
+                documents["income"].append(make_income(rng, user_id, wallet["wallet_id"], NOW))
+    settle_opening_balances(wallets, documents["income"], documents["expense"])
+    return documents
+
+def load_chunk(job):
+    """Worker: generate and insert budgets [start, end); return the counts per collection"""
+    start, end, options = job
+    db = get_database()
+    counts = dict.fromkeys(SEED_COLLECTIONS, 0)
+    batches = {name: [] for name in SEED_COLLECTIONS}
+
+    def flush(name):
+        if batches[name]:
+            try:
+                counts[name] += len(db[name].insert_many(batches[name], ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                # Loaded by an earlier run with the same --seed; anything else is a real error
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+                counts[name] += e.details["nInserted"]
+            batches[name] = []
+
+    for index in range(start, end):
+        tree = budget_tree(options["seed"], index, options["users"],
+                           options["wallets_per_budget"], options["transactions_per_wallet"])
+        for name, documents in tree.items():
+            batches[name].extend(documents)
+            if len(batches[name]) >= options["batch_size"]:
+                flush(name)
+    for name in SEED_COLLECTIONS:
+        flush(name)
+    return counts
+
+def generate(budgets, wallets_per_budget, transactions_per_wallet, seed=42, users=1,
+             workers=None, batch_size=10000, drop=False, progress=print):
+    """Load the dataset with `workers` processes and return the counts per collection"""
+    db = get_database()
+    if drop:
+        for name in SEED_COLLECTIONS:
+            db[name].drop()
+    options = {"seed": seed, "users": users, "wallets_per_budget": wallets_per_budget,
+               "transactions_per_wallet": transactions_per_wallet, "batch_size": batch_size}
+    jobs = [(start, min(start + CHUNK_SIZE, budgets), options) for start in range(0, budgets, CHUNK_SIZE)]
+    totals = dict.fromkeys(SEED_COLLECTIONS, 0)
+    started_at = time.monotonic()
+    # Spawn rather than fork, so no worker inherits the parent's MongoDB connections
+    with multiprocessing.get_context('spawn').Pool(workers or os.cpu_count()) as pool:
+        for done, counts in enumerate(pool.imap_unordered(load_chunk, jobs), start=1):
+            for name, count in counts.items():
+                totals[name] += count
+            inserted = sum(totals.values())
+            progress(f'{done}/{len(jobs)} chunks, {inserted} documents, '
+                     f'{inserted / (time.monotonic() - started_at):.0f} documents/s')
+    progress('Building indexes')
+    ensure_indexes(db)
+    return totals
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Generate a large synthetic dataset')
+    arg_parser.add_argument('--budgets', type=int, default=10000)
+    arg_parser.add_argument('--wallets-per-budget', type=int, default=10)
+    arg_parser.add_argument('--transactions-per-wallet', type=int, default=500)
+    arg_parser.add_argument('--users', type=int, default=1, help='Number of owners to spread the budgets over')
+    arg_parser.add_argument('--workers', type=int, help='Processes to load with (default: one per CPU)')
+    arg_parser.add_argument('--batch-size', type=int, default=10000)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--drop', action='store_true', help='Drop the collections first')
+    args = arg_parser.parse_args()
+
+    totals = generate(args.budgets, args.wallets_per_budget, args.transactions_per_wallet, args.seed,
+                      args.users, args.workers, args.batch_size, args.drop)
+    print(', '.join(f'{count} {name}' for name, count in totals.items()))
+
+if __name__ == '__main__':
+    main()
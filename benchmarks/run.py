@@ -0,0 +1,334 @@
+"""Drive every route of the API at fixed concurrency levels and compare with a baseline.
+
+Each scenario prepares its requests up front, inserting fresh documents for the PUT
+and DELETE routes so every request hits a real target. A scenario whose requests do not
+succeed is not measuring the route: more than --max-error-rate non-2xx answers marks it
+FAILED, the run exits 1 and no baseline is saved. The requests are then sent
+from a thread pool, either in-process through the Flask test client (the default) or
+over HTTP to a running server with --base-url. p50/p95/p99 latency and throughput are
+recorded per scenario and concurrency level.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.seed --drop
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.run --save-baseline
+    ... make a change ...
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.run --compare
+
+Options:
+    --concurrency 1 8 32    concurrency levels to run every scenario at
+    --requests 200          requests per scenario and concurrency level
+    --scenarios a b         only run these scenarios (see --list)
+    --include-scanner       also call /scan-receipt (needs Document AI credentials)
+    --tolerance 0.10        allowed p95/throughput regression before --compare fails
+    --max-error-rate 0.01   allowed share of non-2xx answers per scenario
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmarks measure the handlers, not the per-client rate limits in front of them
+os.environ.setdefault('ADMISSION_ENABLED', '0')
+
+from utils.db import get_database
+from utils.scoping import DEFAULT_USER_ID
+from benchmarks.seed import make_budget, make_wallet, make_expense, make_income, settle_opening_balances
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+RECEIPT_PATH = os.path.join(os.path.dirname(__file__), '..', 'tests', 'receipt.jpeg')
+
+############################################################################################
+#####                         SCENARIOS                                               ######
+############################################################################################
+
+class Context:
+    """Seeded ids the scenarios build their requests from"""
+
+    def __init__(self, db, seed):
+        self.db = db
+        # Not the stream benchmarks.seed used with the same --seed, whose ids are already taken
+        self.rng = random.Random(f'{seed}:run')
+        self.now = datetime.datetime(2026, 1, 1)
+        self.budget_ids = [str(budget["_id"]) for budget in db['budget'].find({}, {"_id": 1}).limit(1000)]
+        self.wallet_ids = [wallet["wallet_id"] for wallet in
+                           db['wallet'].find({"wallet_id": {"$exists": True}}, {"wallet_id": 1}).limit(1000)]
+        self.wallet_object_ids = [str(wallet["_id"]) for wallet in db['wallet'].find({}, {"_id": 1}).limit(1000)]
+        if not self.budget_ids or not self.wallet_ids:
+            sys.exit('ERROR: The database is empty, run python -m benchmarks.seed first')
+
+    def wallet_id(self):
+        return self.rng.choice(self.wallet_ids)
+
+    def transaction_body(self, kind):
+        make = make_expense if kind == 'expense' else make_income
+        body = make(self.rng, DEFAULT_USER_ID, self.wallet_id(), self.now)
+        for field in ("_id", "user_id"):
+            body.pop(field)
+        body["date"] = body["date"].isoformat()
+        return body
+
+    def insert_transactions(self, kind, n):
+        make = make_expense if kind == 'expense' else make_income
+        documents = [make(self.rng, DEFAULT_USER_ID, self.wallet_id(), self.now) for _ in range(n)]
+        ids = [str(_id) for _id in self.db[kind].insert_many(documents).inserted_ids]
+        # Move the balances as the handlers would, so reconcile finds no drift afterwards
+        deltas = {}
+        for document in documents:
+            deltas[document["wallet_id"]] = deltas.get(document["wallet_id"], 0) + document["amount"]
+        for wallet_id, delta in deltas.items():
+            self.db['wallet'].update_one({"wallet_id": wallet_id},
+                                         {"$inc": {"balance": round(delta if kind == 'income' else -delta, 2)}})
+        return ids
+
+    def insert_budgets(self, n, with_wallets=False):
+        budgets = [make_budget(self.rng, DEFAULT_USER_ID, self.now) for _ in range(n)]
+        self.db['budget'].insert_many(budgets)
+        if with_wallets:
+            self.insert_wallets([budget["_id"] for budget in budgets])
+        return [str(budget["_id"]) for budget in budgets]
+
+    def insert_wallets(self, budget_ids):
+        """Insert one wallet with five expenses per budget and return the wallet ids"""
+        wallets = [make_wallet(self.rng, DEFAULT_USER_ID, budget_id, self.now) for budget_id in budget_ids]
+        transactions = [make_expense(self.rng, DEFAULT_USER_ID, wallet["wallet_id"], self.now)
+                        for wallet in wallets for _ in range(5)]
+        settle_opening_balances(wallets, [], transactions)
+        self.db['wallet'].insert_many(wallets)
+        self.db['expense'].insert_many(transactions)
+        return [wallet["wallet_id"] for wallet in wallets]
+
+    def budget_body(self):
+        budget = make_budget(self.rng, DEFAULT_USER_ID, self.now)
+        for field in ("_id", "user_id"):
+            budget.pop(field)
+        budget["created_at"] = budget["updated_at"] = self.now.isoformat()
+        return budget
+
+    def wallet_body(self):
+        wallet = make_wallet(self.rng, DEFAULT_USER_ID, self.rng.choice(self.budget_ids), self.now)
+        for field in ("_id", "wallet_id", "user_id", "opening_balance"):
+            wallet.pop(field)
+        wallet["created_at"] = wallet["updated_at"] = self.now.isoformat()
+        return wallet
+
+def request(method, path, body=None, files=None, stream=False):
+    return {"method": method, "path": path, "json": body, "files": files, "stream": stream}
+
+def transaction_scenarios(kind):
+    return {
+        f'{kind}.add': lambda ctx, n: [request('POST', f'/{kind}', ctx.transaction_body(kind)) for _ in range(n)],
+        f'{kind}.list': lambda ctx, n: [request('GET', f'/{kind}') for _ in range(n)],
+        f'{kind}.update': lambda ctx, n: [request('PUT', f'/{kind}/{_id}', ctx.transaction_body(kind))
+                                          for _id in ctx.insert_transactions(kind, n)],
+        f'{kind}.delete': lambda ctx, n: [request('DELETE', f'/{kind}/{_id}')
+                                          for _id in ctx.insert_transactions(kind, n)],
+    }
+
+SCENARIOS = {
+    'budget.add': lambda ctx, n: [request('POST', '/budget', ctx.budget_body()) for _ in range(n)],
+    'budget.list': lambda ctx, n: [request('GET', '/budget') for _ in range(n)],
+    'budget.get': lambda ctx, n: [request('GET', f'/budget/{ctx.rng.choice(ctx.budget_ids)}') for _ in range(n)],
+    'budget.update': lambda ctx, n: [request('PUT', f'/budget/{_id}', ctx.budget_body())
+                                     for _id in ctx.insert_budgets(n)],
+    'budget.delete': lambda ctx, n: [request('DELETE', f'/budget/{_id}')
+                                     for _id in ctx.insert_budgets(n, with_wallets=True)],
+    'wallet.add': lambda ctx, n: [request('POST', '/wallet', ctx.wallet_body()) for _ in range(n)],
+    'wallet.list': lambda ctx, n: [request('GET', '/wallet') for _ in range(n)],
+    'wallet.update': lambda ctx, n: [request('PUT', f'/wallet/{ctx.rng.choice(ctx.wallet_object_ids)}',
+                                             {"name": f'Account {i}'}) for i in range(n)],
+    'wallet.delete': lambda ctx, n: [request('DELETE', f'/wallet/{wallet_id}') for wallet_id in
+                                     ctx.insert_wallets([ctx.rng.choice(ctx.budget_ids) for _ in range(n)])],
+    **transaction_scenarios('expense'),
+    **transaction_scenarios('income'),
+    'events.stream': lambda ctx, n: [request('GET', '/events', stream=True) for _ in range(n)],
+    'metrics.get': lambda ctx, n: [request('GET', '/metrics') for _ in range(n)],
+}
+SCANNER_SCENARIO = 'scanner.scan'
+
+def scan_requests(ctx, n):
+    with open(RECEIPT_PATH, 'rb') as receipt:
+        content = receipt.read()
+    return [request('POST', '/scan-receipt', files={'receipt': (content, 'receipt.jpeg')}) for _ in range(n)]
+
+############################################################################################
+#####                         DRIVERS                                                 ######
+############################################################################################
+
+class InProcessDriver:
+    """Send requests through the Flask test client, one client per thread"""
+
+    def __init__(self):
+        from app import app
+        self.app = app
+        self.local = threading.local()
+
+    def send(self, spec):
+        import io
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        if spec["files"]:
+            data = {name: (io.BytesIO(content), filename) for name, (content, filename) in spec["files"].items()}
+            response = client.open(spec["path"], method=spec["method"], data=data,
+                                   content_type='multipart/form-data')
+        elif spec["stream"]:
+            response = client.open(spec["path"], method=spec["method"], buffered=False)
+            # Time to the first event-stream chunk
+            next(iter(response.response))
+            response.close()
+        else:
+            response = client.open(spec["path"], method=spec["method"], json=spec["json"])
+        return response.status_code
+
+class HTTPDriver:
+    """Send requests over HTTP to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, spec):
+        if spec["files"]:
+            raise SystemExit('ERROR: --include-scanner is only supported in-process')
+        data = json.dumps(spec["json"]).encode() if spec["json"] is not None else None
+        http_request = urllib.request.Request(self.base_url + spec["path"], data=data, method=spec["method"],
+                                              headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(http_request, timeout=30) as response:
+                if spec["stream"]:
+                    response.readline()
+                else:
+                    response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_scenario(driver, specs, concurrency):
+    """Send the requests at the given concurrency and summarise their latencies"""
+    latencies = []
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(spec):
+        started_at = time.perf_counter()
+        try:
+            status = driver.send(spec)
+            # A 4xx answer means the request never exercised the route
+            failed = not 200 <= status < 300
+        except Exception:
+            status, failed = 'exception', True
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            errors[0] += failed
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, specs))
+    wall_time = time.perf_counter() - started_at
+    latencies.sort()
+    return {
+        "requests": len(specs),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "throughput_rps": round(len(specs) / wall_time, 1),
+        "errors": errors[0],
+        "error_rate": round(errors[0] / len(specs), 4) if specs else 0,
+        "statuses": statuses,
+    }
+
+def compare(results, baseline, tolerance):
+    """Print the change against the baseline and return the keys that regressed"""
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f'{key:<28} new, no baseline')
+            continue
+        p95_change = (result["p95_ms"] - reference["p95_ms"]) / reference["p95_ms"] if reference["p95_ms"] else 0
+        rps_change = (result["throughput_rps"] - reference["throughput_rps"]) / reference["throughput_rps"]
+        regressed = p95_change > tolerance or rps_change < -tolerance
+        if regressed:
+            regressions.append(key)
+        print(f'{key:<28} p95 {p95_change:+7.1%}  throughput {rps_change:+7.1%}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark every route of the API')
+    arg_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    arg_parser.add_argument('--requests', type=int, default=200)
+    arg_parser.add_argument('--scenarios', nargs='+')
+    arg_parser.add_argument('--include-scanner', action='store_true')
+    arg_parser.add_argument('--base-url', help='Benchmark a running server instead of the app in-process')
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH)
+    arg_parser.add_argument('--save-baseline', action='store_true')
+    arg_parser.add_argument('--compare', action='store_true')
+    arg_parser.add_argument('--tolerance', type=float, default=0.10)
+    arg_parser.add_argument('--max-error-rate', type=float, default=0.01,
+                            help='Share of non-2xx answers that fails a scenario')
+    arg_parser.add_argument('--output', help='Also write the results to this JSON file')
+    arg_parser.add_argument('--list', action='store_true', help='List the scenarios and exit')
+    args = arg_parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    if args.include_scanner:
+        scenarios[SCANNER_SCENARIO] = scan_requests
+    if args.list:
+        print('\n'.join(scenarios))
+        return
+    if args.scenarios:
+        scenarios = {name: scenarios[name] for name in args.scenarios}
+
+    driver = HTTPDriver(args.base_url) if args.base_url else InProcessDriver()
+    context = Context(get_database(), args.seed)
+    results = {}
+    failed = []
+    for name, build in scenarios.items():
+        for concurrency in args.concurrency:
+            key = f'{name}@c{concurrency}'
+            results[key] = run_scenario(driver, build(context, args.requests), concurrency)
+            result = results[key]
+            if result["error_rate"] > args.max_error_rate:
+                failed.append(key)
+            print(f'{key:<28} p50 {result["p50_ms"]:8.2f}ms  p95 {result["p95_ms"]:8.2f}ms  '
+                  f'p99 {result["p99_ms"]:8.2f}ms  {result["throughput_rps"]:8.1f} req/s  '
+                  f'errors {result["errors"]}{"  FAILED " + str(result["statuses"]) if key in failed else ""}')
+
+    meta = {"_meta": {"recorded_at": datetime.datetime.now().isoformat(), "python": platform.python_version(),
+                      "requests": args.requests, "mode": args.base_url or 'in-process'}}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({**meta, **results}, output, indent=2)
+    if failed:
+        # Latencies of failing requests say nothing about the route, so they never become a baseline
+        sys.exit(f'ERROR: {len(failed)} scenario(s) exceeded the error rate: {", ".join(failed)}')
+    if args.compare:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({**meta, **results}, baseline_file, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+if __name__ == '__main__':
+    main()
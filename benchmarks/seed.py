@@ -0,0 +1,152 @@
+"""Seed a benchmark database with budgets, wallets, incomes and expenses.
+
+The documents have the same shapes the handlers read and write. Generation, ObjectIds
+included, is deterministic for a given --seed, so two runs measure against the same data.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python -m benchmarks.seed \
+        [--budgets 100] [--wallets-per-budget 3] [--transactions-per-wallet 200] [--seed 42] [--drop]
+"""
+import argparse
+import datetime
+import random
+from bson import ObjectId
+from utils.db import get_database
+from utils.indexes import ensure_indexes
+from utils.scoping import DEFAULT_USER_ID
+
+CATEGORIES = {
+    "needs": ["Grocery", "Health & Wellness", "Transport"],
+    "wants": ["Entertainment", "Hobbies", "Dining"],
+    "bills": ["Housing", "Utilities", "Phone"],
+}
+EXPENSE_DESCRIPTIONS = ["Lunch at McDonald's", "Paid Gas", "Eagle Gym Membership", "Tesco groceries",
+                        "Netflix subscription", "Electricity bill", "Train ticket", "Coffee"]
+INCOME_SOURCES = ["Salary", "Freelance", "Dividends", "Refund"]
+SEED_COLLECTIONS = ['budget', 'wallet', 'income', 'expense']
+
+def object_id(rng, now):
+    """An ObjectId drawn from rng, so the same seed gives the same ids"""
+    return ObjectId(int(now.timestamp()).to_bytes(4, 'big') + rng.getrandbits(64).to_bytes(8, 'big'))
+
+def make_budget(rng, user_id, now):
+    return {
+        "_id": object_id(rng, now),
+        "user_id": user_id,
+        "name": f'Budget {rng.randint(1, 10**6)}',
+        "created_at": now,
+        "updated_at": now,
+        "categories": {group: {name: rng.randint(50, 1500) for name in names}
+                       for group, names in CATEGORIES.items()},
+    }
+
+def make_wallet(rng, user_id, budget_id, now):
+    wallet_id = object_id(rng, now)
+    balance = round(rng.uniform(0, 10000), 2)
+    return {
+        "_id": wallet_id,
+        "wallet_id": str(wallet_id),
+        "user_id": user_id,
+        "budget_id": str(budget_id),
+        "name": f'Account {rng.randint(1, 10**6)}',
+        "balance": balance,
+        # Until settle_opening_balances() is given the wallet's transactions
+        "opening_balance": balance,
+        "created_at": now,
+        "updated_at": now,
+        "type": rng.choice(["Savings", "Checking", "Cash"]),
+        "target": rng.choice([5000.0, 10000.0, 20000.0]),
+    }
+
+def make_expense(rng, user_id, wallet_id, now):
+    group = rng.choice(list(CATEGORIES))
+    return {
+        "_id": object_id(rng, now),
+        "user_id": user_id,
+        "wallet_id": wallet_id,
+        "amount": round(rng.uniform(1, 300), 2),
+        "date": now - datetime.timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86399)),
+        "category": rng.choice(CATEGORIES[group]),
+        "description": rng.choice(EXPENSE_DESCRIPTIONS),
+    }
+
+def make_income(rng, user_id, wallet_id, now):
+    return {
+        "_id": object_id(rng, now),
+        "user_id": user_id,
+        "wallet_id": wallet_id,
+        "amount": round(rng.uniform(50, 5000), 2),
+        "date": now - datetime.timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86399)),
+        "source": rng.choice(INCOME_SOURCES),
+        "description": "Monthly payment",
+    }
+
+def settle_opening_balances(wallets, incomes, expenses):
+    """Set each wallet's opening balance to what its balance and transactions imply,
+    so scripts.reconcile_balances finds no drift in generated data"""
+    net = {wallet["wallet_id"]: 0 for wallet in wallets}
+    for income in incomes:
+        net[income["wallet_id"]] += income["amount"]
+    for expense in expenses:
+        net[expense["wallet_id"]] -= expense["amount"]
+    for wallet in wallets:
+        wallet["opening_balance"] = round(wallet["balance"] - net[wallet["wallet_id"]], 2)
+
+def seed(db, budgets=100, wallets_per_budget=3, transactions_per_wallet=200, seed=42,
+         user_id=DEFAULT_USER_ID, drop=False, batch_size=5000):
+    """Insert a dataset and return the number of documents per collection"""
+    rng = random.Random(seed)
+    now = datetime.datetime(2026, 1, 1)
+    if drop:
+        for name in SEED_COLLECTIONS:
+            db[name].delete_many({})
+    ensure_indexes(db)
+    counts = dict.fromkeys(SEED_COLLECTIONS, 0)
+    transactions = {"income": [], "expense": []}
+
+    def flush(name):
+        if transactions[name]:
+            db[name].insert_many(transactions[name], ordered=False)
+            counts[name] += len(transactions[name])
+            transactions[name] = []
+
+    for _ in range(budgets):
+        budget = make_budget(rng, user_id, now)
+        db['budget'].insert_one(budget)
+        counts['budget'] += 1
+        wallets = [make_wallet(rng, user_id, budget["_id"], now) for _ in range(wallets_per_budget)]
+        generated = {"income": [], "expense": []}
+        for wallet in wallets:
+            for _ in range(transactions_per_wallet):
+                # Roughly four expenses for every income
+                if rng.random() < 0.8:
+                    generated["expense"].append(make_expense(rng, user_id, wallet["wallet_id"], now))
+                else:
+                    generated["income"].append(make_income(rng, user_id, wallet["wallet_id"], now))
+        settle_opening_balances(wallets, generated["income"], generated["expense"])
+        if wallets:
+            db['wallet'].insert_many(wallets, ordered=False)
+            counts['wallet'] += len(wallets)
+        for name in transactions:
+            transactions[name].extend(generated[name])
+            if len(transactions[name]) >= batch_size:
+                flush(name)
+    for name in transactions:
+        flush(name)
+    return counts
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Seed a benchmark database')
+    arg_parser.add_argument('--budgets', type=int, default=100)
+    arg_parser.add_argument('--wallets-per-budget', type=int, default=3)
+    arg_parser.add_argument('--transactions-per-wallet', type=int, default=200)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--drop', action='store_true', help='Empty the collections first')
+    args = arg_parser.parse_args()
+
+    counts = seed(get_database(), args.budgets, args.wallets_per_budget, args.transactions_per_wallet,
+                  args.seed, drop=args.drop)
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
+
+if __name__ == '__main__':
+    main()
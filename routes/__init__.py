@@ -1,5 +1,17 @@
+# Register the pymongo monitoring listeners before the blueprints create their MongoDB clients
+import utils.metrics
+import utils.db_accounting
+import utils.tracing
 from .expense import expense_bp
 from .income import income_bp
 from .wallet import wallet_bp
 from .budget import budget_bp
-from .scanner import scanner_bp
\ No newline at end of file
+from .scanner import scanner_bp
+from .events import events_bp
+from .metrics import metrics_bp
+from .health import health_bp
+from .search import search_bp
+from .transfer import transfer_bp
+from .batch import batch_bp
+from .dashboard import dashboard_bp
+from .sync import sync_bp
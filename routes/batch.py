@@ -0,0 +1,102 @@
+from flask import Blueprint, request, jsonify, current_app
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+import json
+import os
+from utils.models import decode_body, InvalidBody, BatchRequest
+from utils.scoping import USER_HEADER
+from utils.admission import API_KEY_HEADER
+from utils.idempotency import IDEMPOTENCY_HEADER
+from utils.routing import READ_AFTER_HEADER
+
+batch_bp = Blueprint('batch', __name__)
+
+# Up to BATCH_MAX_REQUESTS sub-requests (see utils/models.py), each with its own body
+BATCH_MAX_BYTES = 512 * 1024
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '8'))
+# Identity headers of the batch that every sub-request runs with
+FORWARDED_HEADERS = (USER_HEADER, API_KEY_HEADER, 'Authorization')
+# Endpoints that do not answer with a single JSON document: the event stream never ends and
+# would hold a batch worker forever, and the metrics are Prometheus text
+UNBATCHABLE_ENDPOINTS = {'events.stream_events', 'metrics.get_metrics'}
+
+# Shared by all batches so that a burst of batches cannot start unbounded threads
+executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+def dispatch(app, sub_request, headers, remote_addr):
+    """Run one sub-request through the whole app, middleware included, and return its result"""
+    result = {"status": 400, "body": None}
+    if "id" in sub_request:
+        result["id"] = sub_request["id"]
+    # Find the endpoint the sub-request targets before running anything
+    try:
+        endpoint, _ = app.url_map.bind('').match(sub_request["path"].split('?')[0], sub_request["method"])
+    except HTTPException as e:
+        result["status"] = e.code
+        result["body"] = {"error": e.description}
+        return result, None
+    if endpoint == 'batch.run_batch':
+        result["body"] = {"error": "A batch cannot contain another batch"}
+        return result, None
+    # Only the JSON endpoints of the blueprints can be batched (not the app's static files either)
+    if endpoint in UNBATCHABLE_ENDPOINTS or '.' not in endpoint:
+        result["body"] = {"error": f'{sub_request["path"]} cannot be called in a batch'}
+        return result, None
+    headers = dict(headers)
+    if "idempotency_key" in sub_request:
+        headers[IDEMPOTENCY_HEADER] = sub_request["idempotency_key"]
+    body = sub_request.get("body")
+    response = app.test_client().open(sub_request["path"], method=sub_request["method"], headers=headers,
+                                      data=bytes(body) if body is not None else None,
+                                      content_type='application/json' if body is not None else None,
+                                      # Admission control counts the sub-requests against the batch's client
+                                      environ_base={"REMOTE_ADDR": remote_addr})
+    result["status"] = response.status_code
+    data = response.get_data(as_text=True)
+    try:
+        result["body"] = json.loads(data) if data else None
+    except ValueError:
+        result["body"] = data
+    if "Retry-After" in response.headers:
+        result["retry_after"] = response.headers["Retry-After"]
+    return result, response.headers.get(READ_AFTER_HEADER)
+
+############################################################################################
+#####                         ADD BATCH FUNCTIONS HERE                                ######
+############################################################################################
+
+@batch_bp.route('/batch', methods=['POST'])
+def run_batch():
+    """It should run a list of sub-requests and return all their responses in order"""
+    try:
+        sub_requests = decode_body(BatchRequest, BATCH_MAX_BYTES)["requests"]
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    app = current_app._get_current_object()
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    remote_addr = request.remote_addr
+    read_after = request.headers.get(READ_AFTER_HEADER)
+    results = []
+    i = 0
+    while i < len(sub_requests):
+        if read_after:
+            # Later sub-requests read the writes of earlier ones, even from a secondary
+            headers[READ_AFTER_HEADER] = read_after
+        if sub_requests[i]["method"] != 'GET':
+            # Writes run one at a time, in order, and separate the reads before them from the reads after
+            group = sub_requests[i:i + 1]
+        else:
+            # A run of consecutive reads is independent: run it concurrently
+            end = i
+            while end < len(sub_requests) and sub_requests[end]["method"] == 'GET':
+                end += 1
+            group = sub_requests[i:end]
+        outcomes = list(executor.map(lambda sub_request: dispatch(app, sub_request, headers, remote_addr), group))
+        for result, written_at in outcomes:
+            results.append(result)
+            read_after = written_at or read_after
+        i += len(group)
+    response = jsonify({"responses": results})
+    if read_after and read_after != request.headers.get(READ_AFTER_HEADER):
+        response.headers[READ_AFTER_HEADER] = read_after
+    return response, 200
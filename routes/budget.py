@@ -1,36 +1,26 @@
-from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
+from flask import Blueprint, request, jsonify, current_app
 from bson import ObjectId
 import pymongo
 from dateutil import parser
 import datetime
 import os
+from utils.dates import normalize_dates
+from utils.models import decode_body, InvalidBody, Budget, BudgetUpdate
+from utils import storage
+from utils.buckets import transactions
+from utils.scoping import scoped, owned, strip_owner
+from utils.idempotency import idempotent
+from utils.events import publish
+from utils.sync import modified_now, stamped, record_tombstones, delete_with_tombstones, delete_transactions_with_tombstones
 
 budget_bp = Blueprint('budget', __name__)
 
-# Load config from .env file
-load_dotenv()
-MONGODB_URI = os.environ['MONGODB_URI']
-
 def connect_to_db():
-    # Set up a connection to MongoDB cluster
-    try:
-        client = pymongo.MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        if client.server_info():
-            print('SUCCESS: MongoDB is connected!')
-            # Getting a database
-            db = client['myfinance']
-            return client, db
-        else:
-            print('ERROR: MongoDB is not connected!')
-    except pymongo.errors.ServerSelectionTimeoutError:
-        print('ERROR: MongoDB connection timed out!')
-    except Exception as e:
-        print('ERROR: An unexpected error occurrred: {e}')
+    return storage.connect()
     
 client, database_collection = connect_to_db()
-expense_collection = database_collection['expense']
-income_collection = database_collection['income']
+expense_collection = transactions(database_collection, 'expense')
+income_collection = transactions(database_collection, 'income')
 wallet_collection = database_collection['wallet']
 budget_collection = database_collection['budget']
 
@@ -39,12 +29,20 @@ budget_collection = database_collection['budget']
 ############################################################################################
 
 @budget_bp.route('/budget', methods=['POST'])
+@idempotent
 def add_budget():
     """It should add a budget to database"""
-    # Receive parsed data sent from the front-end (React)
-    budget = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    # Store created_at/updated_at as BSON dates rather than ISO strings
+    try:
+        budget = decode_body(Budget)
+        normalize_dates(budget, 'budget')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Insert an budget into MongoDB Atlas
-    budget_collection.insert_one(budget)
+    budget_collection.insert_one(stamped(owned(budget)))
     # Return a success message
     return jsonify({"Message": "A budget has been succesfully added"}), 201
 
@@ -52,14 +50,15 @@ def add_budget():
 def list_budgets():
     """It should return a list of all available expenses"""
     # Get a list of budgets from MongoDB
-    list_of_budgets = budget_collection.find({})
+    list_of_budgets = budget_collection.find(scoped())
     # Convert the ObjectId instances to a JSON serializable format
     budgets = [
         {
          "budget_id": str(budget["_id"]),  
          "created_at": budget["created_at"], 
          "updated_at": budget["updated_at"],
-         "wallet_id": budget["wallet_id"],
+         # A budget does not need to name a wallet
+         "wallet_id": budget.get("wallet_id"),
          "categories": {
                 "needs": budget["categories"].get("needs", {}),
                 "wants": budget["categories"].get("wants", {}),
@@ -75,7 +74,7 @@ def list_budgets():
 def get_budget(budget_id):
     """Retrieve a single budget by its budget_id."""
     # Find the budget in MongoDB by budget_id
-    budget = budget_collection.find_one({"budget_id": ObjectId(budget_id)})
+    budget = budget_collection.find_one(scoped({"budget_id": ObjectId(budget_id)}))
     
     if budget:
         # Convert the ObjectId to a JSON serializable format
@@ -83,7 +82,8 @@ def get_budget(budget_id):
             "budget_id": str(budget["_id"]),
             "created_at": budget["created_at"], 
             "updated_at": budget["updated_at"],
-            "wallet_id": budget["wallet_id"],
+            # A budget does not need to name a wallet
+            "wallet_id": budget.get("wallet_id"),
             "categories": {
                 "needs": budget["categories"].get("needs", {}),
                 "wants": budget["categories"].get("wants", {}),
@@ -99,33 +99,40 @@ def get_budget(budget_id):
 @budget_bp.route('/budget/<string:budget_id>', methods=["PUT"])
 def update_budget(budget_id):
     """It should update a budget"""
-    # Get a content of updated budget
-    updated_budget = request.json
-    # Log the received ID for debugging
-    budget_bp.logger.debug(f"Received ID: {budget_id}")
+    # Decode and validate the body from the raw bytes before any database work
+    try:
+        updated_budget = decode_body(BudgetUpdate)
+        normalize_dates(updated_budget, 'budget')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+    strip_owner(updated_budget)
+    # Log the received ID for debugging (blueprints have no logger of their own)
+    current_app.logger.debug(f"Received ID: {budget_id}")
     # Find and update the budget in MongoDB
     response = budget_collection.find_one_and_update(
-        {"_id": ObjectId(budget_id)},
-        {"$set": updated_budget} )
+        scoped({"_id": ObjectId(budget_id)}),
+        {"$set": {**updated_budget, "modified_at": modified_now()}} )
     if response is None:
         # A budget with the specified id is not found
         return jsonify({"message": f'budget with id: {budget_id} is not found'}), 404
     # Find and delete all wallets associated with this budget_id
-    wallets = wallet_collection.find({"budget_id": str(budget_id)})
+    wallets = wallet_collection.find(scoped({"budget_id": str(budget_id)}))
     wallet_ids = [str(wallet["_id"]) for wallet in wallets]  # Collect wallet IDs for deletion of incomes/expenses
-    wallet_result = wallet_collection.delete_many({"budget_id": str(budget_id)})
-    # Delete incomes and expenses for each deleted wallet
+    # Every deleted document leaves a tombstone for /sync
+    wallets_deleted = delete_with_tombstones(wallet_collection, 'wallet', scoped({"budget_id": str(budget_id)}))
+    # Delete incomes and expenses for each deleted wallet, archived ones too
     total_incomes_deleted = 0
     total_expenses_deleted = 0
     for wallet_id in wallet_ids:
-        income_result = income_collection.delete_many({"wallet_id": wallet_id})
-        expense_result = expense_collection.delete_many({"wallet_id": wallet_id})
-        total_incomes_deleted += income_result.deleted_count
-        total_expenses_deleted += expense_result.deleted_count
+        total_incomes_deleted += delete_transactions_with_tombstones(database_collection, 'income', scoped({"wallet_id": wallet_id}))
+        total_expenses_deleted += delete_transactions_with_tombstones(database_collection, 'expense', scoped({"wallet_id": wallet_id}))
+        publish('wallet.deleted', {"wallet_id": wallet_id, "budget_id": str(budget_id)})
     # Return success message, including number of related documents deleted
     return jsonify({
         "message": f'Budget with id: {budget_id} is deleted',
-        "wallets_deleted": wallet_result.deleted_count,
+        "wallets_deleted": wallets_deleted,
         "incomes_deleted": total_incomes_deleted,
         "expenses_deleted": total_expenses_deleted
     }), 200
@@ -134,26 +141,27 @@ def update_budget(budget_id):
 def delete_budget(budget_id):
     """It should delete a budget and all associated wallets, incomes, and expenses"""
     # Find and delete the budget from MongoDB
-    budget_response = budget_collection.find_one_and_delete({"_id": ObjectId(budget_id)})
+    budget_response = budget_collection.find_one_and_delete(scoped({"_id": ObjectId(budget_id)}))
     if budget_response is None:
         # Budget id is not found, unable to delete
         return jsonify({"message": f'Failed to delete budget with id: {budget_id}'}), 404
+    record_tombstones('budget', [budget_response["_id"]])
     # Find and delete all wallets associated with this budget_id
-    wallets = wallet_collection.find({"budget_id": str(budget_id)})
+    wallets = wallet_collection.find(scoped({"budget_id": str(budget_id)}))
     wallet_ids = [str(wallet["_id"]) for wallet in wallets]  # Collect wallet IDs for deletion of incomes/expenses
-    wallet_result = wallet_collection.delete_many({"budget_id": str(budget_id)})
-    # Delete incomes and expenses for each deleted wallet
+    # Every deleted document leaves a tombstone for /sync
+    wallets_deleted = delete_with_tombstones(wallet_collection, 'wallet', scoped({"budget_id": str(budget_id)}))
+    # Delete incomes and expenses for each deleted wallet, archived ones too
     total_incomes_deleted = 0
     total_expenses_deleted = 0
     for wallet_id in wallet_ids:
-        income_result = income_collection.delete_many({"wallet_id": wallet_id})
-        expense_result = expense_collection.delete_many({"wallet_id": wallet_id})
-        total_incomes_deleted += income_result.deleted_count
-        total_expenses_deleted += expense_result.deleted_count
+        total_incomes_deleted += delete_transactions_with_tombstones(database_collection, 'income', scoped({"wallet_id": wallet_id}))
+        total_expenses_deleted += delete_transactions_with_tombstones(database_collection, 'expense', scoped({"wallet_id": wallet_id}))
+        publish('wallet.deleted', {"wallet_id": wallet_id, "budget_id": str(budget_id)})
     # Return success message, including number of related documents deleted
     return jsonify({
         "message": f'Budget with id: {budget_id} is deleted',
-        "wallets_deleted": wallet_result.deleted_count,
+        "wallets_deleted": wallets_deleted,
         "incomes_deleted": total_incomes_deleted,
         "expenses_deleted": total_expenses_deleted
     }), 200
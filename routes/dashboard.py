@@ -0,0 +1,138 @@
+from flask import Blueprint, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import os
+from utils import storage
+from utils.buckets import transactions, latest_transactions
+from utils.archive import archived_rollups
+from utils.dates import utc_now
+from utils.cache import TTLCache
+from utils.db_accounting import carry_accounting
+from utils.routing import READ_AFTER_HEADER
+from utils.events import hub
+from utils.scoping import scoped, current_user_id
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+def connect_to_db():
+    return storage.connect()
+
+client, database_collection = connect_to_db()
+wallet_collection = database_collection['wallet']
+budget_collection = database_collection['budget']
+
+DASHBOARD_TTL_SECONDS = int(os.getenv('DASHBOARD_TTL_SECONDS', '15'))
+DASHBOARD_RECENT = 20
+# Bounds for unusually large households; the home screen shows far fewer
+DASHBOARD_MAX_WALLETS = 100
+DASHBOARD_MAX_BUDGETS = 100
+RECENT_PROJECTION = {"amount": 1, "date": 1, "wallet_id": 1, "description": 1, "category": 1, "source": 1}
+
+# The dashboard of each user, dropped as soon as one of their documents changes
+dashboards = TTLCache(maxsize=10000, ttl=DASHBOARD_TTL_SECONDS)
+# Shared by all requests so that concurrent dashboards cannot start unbounded threads
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('DASHBOARD_WORKERS', '6')), thread_name_prefix='dashboard')
+
+def month_bounds(now):
+    start = datetime.datetime(now.year, now.month, 1)
+    return start, datetime.datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+def load_wallets(user_id):
+    projection = {"wallet_id": 1, "name": 1, "balance": 1, "type": 1, "target": 1}
+    return [{"wallet_id": wallet.get("wallet_id") or str(wallet["_id"]), "name": wallet.get("name"),
+             "balance": wallet.get("balance"), "type": wallet.get("type"), "target": wallet.get("target")}
+            for wallet in wallet_collection.find(scoped(user_id=user_id), projection).limit(DASHBOARD_MAX_WALLETS)]
+
+def load_budgets(user_id):
+    projection = {"name": 1, "wallet_id": 1, "categories": 1}
+    return [{"budget_id": str(budget["_id"]), "name": budget.get("name"), "wallet_id": budget.get("wallet_id"),
+             # The planned amount of each group rather than every allocation
+             "planned": {group: round(sum(allocations.values()), 2)
+                         for group, allocations in (budget.get("categories") or {}).items()}}
+            for budget in budget_collection.find(scoped(user_id=user_id), projection).limit(DASHBOARD_MAX_BUDGETS)]
+
+def load_month_totals(user_id, name, field, start, end):
+    """Total this month's incomes or expenses, broken down by source or category"""
+    pipeline = [
+        # Transfers only move money between the user's own wallets
+        {"$match": scoped({"date": {"$gte": start, "$lt": end}, "transfer_id": {"$exists": False}}, user_id)},
+        {"$group": {"_id": f'${field}', "total": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+    ]
+    rows = list(transactions(database_collection, name).aggregate(pipeline))
+    total = sum(row["total"] for row in rows)
+    count = sum(row["count"] for row in rows)
+    breakdown = {}
+    for row in rows:
+        key = str(row["_id"] or 'Uncategorized')
+        breakdown[key] = breakdown.get(key, 0) + row["total"]
+    # The part of the month already moved to the archive counts through its rollups, without the transfer legs
+    for bucket in archived_rollups(database_collection, name, user_id, start, end):
+        transfers = bucket.get("transfers") or {}
+        total += (bucket.get("total") or 0) - (transfers.get("total") or 0)
+        count += (bucket.get("count") or 0) - (transfers.get("count") or 0)
+        for key, amount in (bucket.get(f'by_{field}') or {}).items():
+            breakdown[key] = breakdown.get(key, 0) + amount
+    return {
+        "total": round(total, 2),
+        "count": count,
+        f'by_{field}': {key: round(amount, 2) for key, amount in breakdown.items()},
+    }
+
+def load_recent(user_id, name):
+    return [{"_id": str(transaction["_id"]), "type": name, "amount": transaction.get("amount"),
+             "date": transaction.get("date"), "wallet_id": transaction.get("wallet_id"),
+             "description": transaction.get("description"),
+             "category": transaction.get("category") if name == 'expense' else transaction.get("source")}
+            for transaction in latest_transactions(database_collection, name, scoped(user_id=user_id),
+                                                   DASHBOARD_RECENT, RECENT_PROJECTION)]
+
+def submit(function, *args):
+    """Run a query on the executor, counted in the request's MongoDB accounting"""
+    return executor.submit(carry_accounting(function), *args)
+
+def build_dashboard(user_id, now):
+    """Run the dashboard queries in parallel and assemble the payload"""
+    start, end = month_bounds(now)
+    # The queries get the owner explicitly: the worker threads have no request to read it from
+    wallets = submit(load_wallets, user_id)
+    budgets = submit(load_budgets, user_id)
+    expenses = submit(load_month_totals, user_id, 'expense', 'category', start, end)
+    incomes = submit(load_month_totals, user_id, 'income', 'source', start, end)
+    recent_expenses = submit(load_recent, user_id, 'expense')
+    recent_incomes = submit(load_recent, user_id, 'income')
+    recent = sorted(recent_expenses.result() + recent_incomes.result(),
+                    key=lambda transaction: transaction["date"] or datetime.datetime.min, reverse=True)
+    expense_totals, income_totals = expenses.result(), incomes.result()
+    return {
+        "wallets": wallets.result(),
+        "budgets": budgets.result(),
+        "month": {
+            "start": start,
+            "expenses": expense_totals,
+            "incomes": income_totals,
+            "net": round(income_totals["total"] - expense_totals["total"], 2),
+        },
+        "recent": recent[:DASHBOARD_RECENT],
+    }
+
+def on_event(event):
+    """Drop the cached dashboard of a user whose data changed"""
+    dashboards.delete(event["user_id"])
+
+hub.listen(on_event)
+
+############################################################################################
+#####                         ADD DASHBOARD FUNCTIONS HERE                            ######
+############################################################################################
+
+@dashboard_bp.route('/dashboard', methods=['GET'])
+def get_dashboard():
+    """It should return the wallets, budgets, this month's totals and the latest transactions"""
+    user_id = current_user_id()
+    # A client reading after its own write may have written through another worker, whose
+    # change this worker's cache has not heard of
+    dashboard = None if request.headers.get(READ_AFTER_HEADER) else dashboards.get(user_id)
+    if dashboard is None:
+        dashboard = build_dashboard(user_id, utc_now())
+        dashboards.set(user_id, dashboard)
+    return jsonify(dashboard), 200
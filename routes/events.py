@@ -0,0 +1,44 @@
+from flask import Blueprint, Response, request, current_app, stream_with_context
+from utils.events import hub
+from utils.scoping import current_user_id
+import queue
+import os
+
+events_bp = Blueprint('events', __name__)
+
+# Send a comment line this often so proxies keep an idle stream open
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+
+############################################################################################
+#####                         ADD EVENT STREAM FUNCTIONS HERE                         ######
+############################################################################################
+
+def format_event(event):
+    """Format an event in the Server-Sent Events wire format"""
+    data = current_app.json.dumps(event["data"])
+    return f'id: {event["id"]}\nevent: {event["type"]}\ndata: {data}\n\n'
+
+@events_bp.route('/events', methods=['GET'])
+def stream_events():
+    """It should stream balance and transaction changes as Server-Sent Events"""
+    # EventSource sends the id of the last event it received when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    # Each client only receives the changes to its own user's data
+    subscription = hub.subscribe(last_event_id, current_user_id())
+
+    def generate():
+        try:
+            # Ask the browser to reconnect after 3 seconds if the stream drops
+            yield 'retry: 3000\n\n'
+            while not subscription.overflowed:
+                try:
+                    event = subscription.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(event)
+        finally:
+            hub.unsubscribe(subscription)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
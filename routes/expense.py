@@ -1,72 +1,123 @@
 from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
 from bson import ObjectId
 import pymongo
 from dateutil import parser
 import datetime
 import os
+from utils.dates import normalize_dates, parse_date_range, utc_now
+from utils.archive import find_transactions, is_archived
+from utils.models import decode_body, InvalidBody, Expense, ExpenseUpdate, CategorizeRequest
+from utils import storage
+from utils.buckets import transactions
+from utils.scoping import scoped, owned, strip_owner, current_user_id
+from utils.idempotency import idempotent
+from utils.sync import modified_now, stamped, record_tombstones
+from utils.events import publish, publish_balance
+from utils.balance_buffer import balance_buffer, BALANCE_WRITE_BEHIND
+from utils.routing import in_transaction, TransactionsUnavailable, WalletNotFound
+from utils import classifier
 
 expense_bp = Blueprint('expense', __name__)
 
-# Load config from .env file
-load_dotenv()
-MONGODB_URI = os.environ['MONGODB_URI']
-
 def connect_to_db():
-    # Set up a connection to MongoDB cluster
-    try:
-        client = pymongo.MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        if client.server_info():
-            print('SUCCESS: MongoDB is connected!')
-            # Getting a database
-            db = client['myfinance']
-            return client, db
-        else:
-            print('ERROR: MongoDB is not connected!')
-    except pymongo.errors.ServerSelectionTimeoutError:
-        print('ERROR: MongoDB connection timed out!')
-    except Exception as e:
-        print('ERROR: An unexpected error occurrred: {e}')
+    return storage.connect()
     
 client, database_collection = connect_to_db()
-expense_collection = database_collection['expense']
-income_collection = database_collection['income']
+expense_collection = transactions(database_collection, 'expense')
+income_collection = transactions(database_collection, 'income')
 wallet_collection = database_collection['wallet']
 
 
+def move_balance(wallet_id, delta):
+    # Update a balance of the wallet atomically (a read-then-$set loses concurrent updates)
+    return wallet_collection.find_one_and_update(
+        scoped({"wallet_id": wallet_id}),
+        {"$inc": {"balance": delta}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+        projection={"wallet_id": 1, "balance": 1},
+        return_document=pymongo.ReturnDocument.AFTER)
+
+def write_expense(expense):
+    """Insert an expense and move the balance of its wallet; run inside a transaction, so a missing wallet undoes it all"""
+    inserted_id = expense_collection.insert_one(expense).inserted_id
+    wallet = move_balance(expense["wallet_id"], - expense["amount"])
+    if wallet is None:
+        raise WalletNotFound()
+    return inserted_id, wallet
+
+def write_expense_without_transaction(expense):
+    """Write an expense where transactions are unavailable. The expense is inserted first and the
+    balance moved after, so a failed insert leaves the balance alone, and a failure in between
+    leaves an expense that scripts/reconcile_balances.py recomputes the balance from"""
+    # Check the wallet first so that nothing is written for an expense that cannot be added
+    if wallet_collection.count_documents(scoped({"wallet_id": expense["wallet_id"]}), limit=1) == 0:
+        raise WalletNotFound()
+    inserted_id = expense_collection.insert_one(expense).inserted_id
+    wallet = move_balance(expense["wallet_id"], - expense["amount"])
+    if wallet is None:
+        # The wallet was deleted in the meantime
+        expense_collection.delete_one(scoped({"_id": inserted_id}))
+        raise WalletNotFound()
+    return inserted_id, wallet
+
 ############################################################################################
 #####                         ADD EXPENSE FUNCTIONS HERE                              ######
 ############################################################################################
 
 @expense_bp.route('/expense', methods=['POST'])
+@idempotent
 def add_expense():
     """It should add an expense to database"""
-    # Receive parsed data sent from the front-end (React)
-    expense = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    # Store the date as a BSON date rather than the ISO string sent by the client
+    try:
+        expense = decode_body(Expense)
+        normalize_dates(expense, 'expense')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Get wallet_id and amount of an income
     wallet_id = expense["wallet_id"]
     amount = expense["amount"]
-    # Insert an expense into MongoDB Atlas
-    expense_collection.insert_one(expense)
-    # Find the corresponding wallet
-    wallet = wallet_collection.find_one({"wallet_id": wallet_id})
-    # Update a balance of the wallet
-    if wallet:
-            new_balance = wallet["balance"] - amount
-            wallet_collection.update_one(
-                {"wallet_id": wallet_id},
-                {"$set": {"balance": new_balance, "updated_at": datetime.datetime.now()}}
-            )
-            return jsonify({"message": "Expense added and wallet balance updated"}), 201
+    if BALANCE_WRITE_BEHIND:
+        # Write-behind mode: only check the wallet exists, the delta is flushed in bulk later
+        if wallet_collection.find_one(scoped({"wallet_id": wallet_id}), {"wallet_id": 1}) is None:
+            return jsonify({"error": "Wallet not found"}), 404
+        inserted_id = expense_collection.insert_one(stamped(owned(expense))).inserted_id
+    else:
+        expense = stamped(owned(expense))
+        try:
+            try:
+                # The expense and the balance commit together or not at all
+                inserted_id, wallet = in_transaction(client, lambda: write_expense(expense))
+            except TransactionsUnavailable:
+                inserted_id, wallet = write_expense_without_transaction(expense)
+        except WalletNotFound:
+            return jsonify({"error": "Wallet not found"}), 404
+    # Notify the event stream of the new expense and balance
+    publish('expense.created', {"_id": str(inserted_id), "wallet_id": wallet_id, "amount": amount,
+                                "description": expense.get("description"), "category": expense.get("category")})
+    if BALANCE_WRITE_BEHIND:
+        # Coalesced with the other deltas of this wallet into a single $inc
+        balance_buffer.add(wallet_id, - amount)
     else:
-        return jsonify({"error": "Wallet not found"}), 404
+        publish_balance(wallet)
+    return jsonify({"message": "Expense added and wallet balance updated"}), 201
 
 
 @expense_bp.route('/expense', methods=['GET'])
 def get_expenses():
     """It should return a list of all available expenses"""
+    # A date range (from inclusive, to exclusive) also reaches into the archive
+    try:
+        start, end = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Get a list of expenses from MongoDB
-    list_of_expenses = expense_collection.find({})
+    if start is None and end is None:
+        list_of_expenses = expense_collection.find(scoped())
+    else:
+        list_of_expenses = find_transactions(database_collection, 'expense', start, end)
     # Convert the ObjectId instances to a JSON serializable format
     expenses = [
         {
@@ -85,44 +136,95 @@ def get_expenses():
 @expense_bp.route('/expense/<string:_id>', methods=["PUT"])
 def update_expense(_id):
     """It should update an expense"""
-    # Get a content of updated expense
-    updated_expense = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    try:
+        updated_expense = decode_body(ExpenseUpdate)
+        normalize_dates(updated_expense, 'expense')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+    strip_owner(updated_expense)
     # Get the previous version of an income (outdated)
-    outdated_expense = expense_collection.find_one({"_id": ObjectId(_id)})
+    outdated_expense = expense_collection.find_one(scoped({"_id": ObjectId(_id)}))
+    if outdated_expense is None:
+        if is_archived(database_collection, 'expense', ObjectId(_id)):
+            # Archived transactions are read-only
+            return jsonify({"message": f'Expense with id: {_id} is archived and can no longer be changed'}), 410
+        # An expense with the specified id is not found (or belongs to another user)
+        return jsonify({"message": f'Expense with id: {_id} is not found'}), 404
     # Check if wallet_id and amount are modified (Skip if None are changed)
     if ((updated_expense["wallet_id"] != outdated_expense["wallet_id"]) or (updated_expense["amount"] != outdated_expense["amount"])):
         if (updated_expense["wallet_id"] != outdated_expense["wallet_id"]):
             # Scenario 1: Changes include wallet_id
-            wallet_collection.update_one({"wallet_id": outdated_expense["wallet_id"]},
-                {"$inc": {"balance": + outdated_expense["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
-            wallet_collection.update_one({"wallet_id": updated_expense["wallet_id"]},
-                {"$inc": {"balance": - updated_expense["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": outdated_expense["wallet_id"]}),
+                {"$inc": {"balance": + outdated_expense["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+                return_document=pymongo.ReturnDocument.AFTER))
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": updated_expense["wallet_id"]}),
+                {"$inc": {"balance": - updated_expense["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+                return_document=pymongo.ReturnDocument.AFTER))
         elif (updated_expense["wallet_id"] == outdated_expense["wallet_id"]) and (updated_expense["amount"] != outdated_expense["amount"]):
             # Scenario 2: Changes NOT include wallet_id
-            wallet_collection.update_one({"wallet_id": outdated_expense["wallet_id"]},
-            {"$set": {"balance": + outdated_expense["amount"] - updated_expense["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": outdated_expense["wallet_id"]}),
+            {"$inc": {"balance": + outdated_expense["amount"] - updated_expense["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+            return_document=pymongo.ReturnDocument.AFTER))
     # Find and update the expense in MongoDB
     response = expense_collection.find_one_and_update(
-        {"_id": ObjectId(_id)},
-        {"$set": updated_expense} )
+        scoped({"_id": ObjectId(_id)}),
+        {"$set": {**updated_expense, "modified_at": modified_now()}} )
     if response is None:
         # An expense with the specified id is not found
         return jsonify({"message": f'Expense with id: {_id} is not found'}), 404
     else:
         # An expense is found and updated
+        publish('expense.updated', {"_id": _id, "wallet_id": updated_expense["wallet_id"], "amount": updated_expense["amount"],
+                                    "description": updated_expense.get("description"),
+                                    "category": updated_expense.get("category"),
+                                    "previous": {"description": outdated_expense.get("description"),
+                                                 "category": outdated_expense.get("category")}})
         return jsonify({"message": f'Expense with id: {_id} is updated'}), 200
 
 @expense_bp.route('/expense/<string:_id>', methods=["DELETE"])
 def delete_expense(_id):
     """It should delete an expense"""
     # Find and delete an expense from MongoDB
-    response = expense_collection.find_one_and_delete({"_id": ObjectId(_id)})
+    response = expense_collection.find_one_and_delete(scoped({"_id": ObjectId(_id)}))
     if response is None:
+        if is_archived(database_collection, 'expense', ObjectId(_id)):
+            # Archived transactions are read-only
+            return jsonify({"message": f'Expense with id: {_id} is archived and can no longer be deleted'}), 410
         # An expense is not found hence causing failure to delete
         return jsonify({"message": f'Failed to delete expense with id: {_id}'}), 404
     else:
-        # Find and update the balance of corresponding wallet
-        wallet_collection.update_one({"wallet_id": response["wallet_id"]},
-            {"$inc": {"balance": - response["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+        # Give the amount of the deleted expense back to the corresponding wallet
+        publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": response["wallet_id"]}),
+            {"$inc": {"balance": + response["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+            return_document=pymongo.ReturnDocument.AFTER))
+        # Leave a tombstone so that /sync tells the other clients
+        record_tombstones('expense', [response["_id"]])
         # An expense is found and deleted
+        publish('expense.deleted', {"_id": _id, "wallet_id": response["wallet_id"], "amount": response["amount"],
+                                    "description": response.get("description"), "category": response.get("category")})
         return jsonify({"message": f'Expense with id: {_id} is deleted'}), 200
+
+############################################################################################
+#####                         ADD CATEGORY FUNCTIONS HERE                             ######
+############################################################################################
+
+# Batches of up to 1000 descriptions, e.g. from a bank statement import
+CATEGORIZE_MAX_BYTES = 256 * 1024
+
+@expense_bp.route('/expense/categorize', methods=['POST'])
+@idempotent
+def categorize_expenses():
+    """It should suggest a category for every description from the user's past expenses"""
+    try:
+        descriptions = decode_body(CategorizeRequest, CATEGORIZE_MAX_BYTES)["descriptions"]
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    # One vectorized prediction for the whole batch
+    predictions = classifier.predict(database_collection, current_user_id(), descriptions)
+    return jsonify({"categories": [
+        {"description": description, "category": category, "confidence": round(confidence, 3)}
+        for description, (category, confidence) in zip(descriptions, predictions)
+    ]}), 200
@@ -0,0 +1,62 @@
+from flask import Blueprint, jsonify
+from pymongo.errors import ConnectionFailure
+from utils import storage
+from utils.resilience import breaker, record_failure, DatabaseUnavailable
+import math
+import os
+
+health_bp = Blueprint('health', __name__)
+
+# Readiness probes should answer well within the probe timeout of the orchestrator
+READINESS_TIMEOUT_SECONDS = float(os.getenv('READINESS_TIMEOUT_SECONDS', '1'))
+
+############################################################################################
+#####                         ADD HEALTH FUNCTIONS HERE                               ######
+############################################################################################
+
+@health_bp.route('/healthz', methods=['GET'])
+def healthz():
+    """It should report that the process is alive, whatever the state of MongoDB"""
+    return jsonify({"status": "ok"}), 200
+
+@health_bp.route('/readyz', methods=['GET'])
+def readyz():
+    """It should report whether the app can serve requests that need MongoDB"""
+    # An instance taken out of rotation gets no traffic, so the probe's ping may be the breaker's trial call
+    try:
+        breaker.before_call()
+        trial = True
+    except DatabaseUnavailable:
+        trial = False
+    error = storage.ping(storage.get_client(), READINESS_TIMEOUT_SECONDS)
+    if trial and error is None:
+        breaker.record_success()
+    elif trial and isinstance(error, ConnectionFailure):
+        record_failure(error)
+    elif trial:
+        breaker.release_trial()
+    # A half-open circuit is still failing calls, so it is not ready either
+    ready = error is None and breaker.state == breaker.CLOSED
+    body = {
+        "status": "ready" if ready else "unavailable",
+        "database": "up" if error is None else "down",
+        "circuit": breaker.state,
+    }
+    if error is not None:
+        body["error"] = str(error)
+    return jsonify(body), 200 if ready else 503
+
+@health_bp.app_errorhandler(DatabaseUnavailable)
+def database_unavailable(e):
+    """It should fail fast with a 503 while the circuit breaker is open"""
+    response = jsonify({"error": "Database is unavailable, please retry"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+    return response
+
+@health_bp.app_errorhandler(ConnectionFailure)
+def database_connection_failure(e):
+    """It should answer a 503 rather than a 500 when MongoDB cannot be reached"""
+    # Errors raised while iterating a cursor never went through the breaker
+    record_failure(e)
+    return jsonify({"error": "Database is unavailable, please retry"}), 503
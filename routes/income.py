@@ -1,69 +1,119 @@
 from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
 from bson import ObjectId
 import pymongo
 from dateutil import parser
 import datetime
 import os
+from utils.dates import normalize_dates, parse_date_range, utc_now
+from utils.archive import find_transactions, is_archived
+from utils.models import decode_body, InvalidBody, Income, IncomeUpdate
+from utils import storage
+from utils.buckets import transactions
+from utils.scoping import scoped, owned, strip_owner
+from utils.idempotency import idempotent
+from utils.sync import modified_now, stamped, record_tombstones
+from utils.events import publish, publish_balance
+from utils.balance_buffer import balance_buffer, BALANCE_WRITE_BEHIND
+from utils.routing import in_transaction, TransactionsUnavailable, WalletNotFound
 
 income_bp = Blueprint('income', __name__)
 
-# Load config from .env file
-load_dotenv()
-MONGODB_URI = os.environ['MONGODB_URI']
-
 def connect_to_db():
-    # Set up a connection to MongoDB cluster
-    try:
-        client = pymongo.MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        if client.server_info():
-            print('SUCCESS: MongoDB is connected!')
-            # Getting a database
-            db = client['myfinance']
-            return client, db
-        else:
-            print('ERROR: MongoDB is not connected!')
-    except pymongo.errors.ServerSelectionTimeoutError:
-        print('ERROR: MongoDB connection timed out!')
-    except Exception as e:
-        print('ERROR: An unexpected error occurrred: {e}')
+    return storage.connect()
     
 client, database_collection = connect_to_db()
-expense_collection = database_collection['expense']
-income_collection = database_collection['income']
+expense_collection = transactions(database_collection, 'expense')
+income_collection = transactions(database_collection, 'income')
 wallet_collection = database_collection['wallet']
 
+def move_balance(wallet_id, delta):
+    # Update a balance of the wallet atomically (a read-then-$set loses concurrent updates)
+    return wallet_collection.find_one_and_update(
+        scoped({"wallet_id": wallet_id}),
+        {"$inc": {"balance": delta}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+        projection={"wallet_id": 1, "balance": 1},
+        return_document=pymongo.ReturnDocument.AFTER)
+
+def write_income(income):
+    """Insert an income and move the balance of its wallet; run inside a transaction, so a missing wallet undoes it all"""
+    inserted_id = income_collection.insert_one(income).inserted_id
+    wallet = move_balance(income["wallet_id"], + income["amount"])
+    if wallet is None:
+        raise WalletNotFound()
+    return inserted_id, wallet
+
+def write_income_without_transaction(income):
+    """Write an income where transactions are unavailable. The income is inserted first and the
+    balance moved after, so a failed insert leaves the balance alone, and a failure in between
+    leaves an income that scripts/reconcile_balances.py recomputes the balance from"""
+    # Check the wallet first so that nothing is written for an income that cannot be added
+    if wallet_collection.count_documents(scoped({"wallet_id": income["wallet_id"]}), limit=1) == 0:
+        raise WalletNotFound()
+    inserted_id = income_collection.insert_one(income).inserted_id
+    wallet = move_balance(income["wallet_id"], + income["amount"])
+    if wallet is None:
+        # The wallet was deleted in the meantime
+        income_collection.delete_one(scoped({"_id": inserted_id}))
+        raise WalletNotFound()
+    return inserted_id, wallet
+
 ############################################################################################
 #####                         ADD INCOME HERE                                         ######
 ############################################################################################
 
 @income_bp.route('/income', methods=['POST'])
+@idempotent
 def add_income():
-    # Receive parsed data sent from the front-end (React)
-    income = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    # Store the date as a BSON date rather than the ISO string sent by the client
+    try:
+        income = decode_body(Income)
+        normalize_dates(income, 'income')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Get wallet_id and amount of an income
     wallet_id = income["wallet_id"]
     amount = income["amount"]
-    # Insert income into database
-    income_collection.insert_one(income)
-    # Find the corresponding wallet
-    wallet = wallet_collection.find_one({"wallet_id": wallet_id})
-    # Update a balance of the wallet
-    if wallet:
-            new_balance = wallet["balance"] + amount
-            wallet_collection.update_one(
-                {"wallet_id": wallet_id},
-                {"$set": {"balance": new_balance, "updated_at": datetime.datetime.now()}}
-            )
-            return jsonify({"message": "Income added and wallet balance updated"}), 201
+    if BALANCE_WRITE_BEHIND:
+        # Write-behind mode: only check the wallet exists, the delta is flushed in bulk later
+        if wallet_collection.find_one(scoped({"wallet_id": wallet_id}), {"wallet_id": 1}) is None:
+            return jsonify({"error": "Wallet not found"}), 404
+        inserted_id = income_collection.insert_one(stamped(owned(income))).inserted_id
+    else:
+        income = stamped(owned(income))
+        try:
+            try:
+                # The income and the balance commit together or not at all
+                inserted_id, wallet = in_transaction(client, lambda: write_income(income))
+            except TransactionsUnavailable:
+                inserted_id, wallet = write_income_without_transaction(income)
+        except WalletNotFound:
+            return jsonify({"error": "Wallet not found"}), 404
+    # Notify the event stream of the new income and balance
+    publish('income.created', {"_id": str(inserted_id), "wallet_id": wallet_id, "amount": amount,
+                               "description": income.get("description")})
+    if BALANCE_WRITE_BEHIND:
+        # Coalesced with the other deltas of this wallet into a single $inc
+        balance_buffer.add(wallet_id, + amount)
     else:
-        return jsonify({"error": "Wallet not found"}), 404
+        publish_balance(wallet)
+    return jsonify({"message": "Income added and wallet balance updated"}), 201
     
 @income_bp.route('/income', methods=['GET'])
 def get_incomes():
     """It should return a list of all existing incomes"""
+    # A date range (from inclusive, to exclusive) also reaches into the archive
+    try:
+        start, end = parse_date_range(request.args)
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Get a list of incomes from MongoDB
-    list_of_incomes = income_collection.find({})
+    if start is None and end is None:
+        list_of_incomes = income_collection.find(scoped())
+    else:
+        list_of_incomes = find_transactions(database_collection, 'income', start, end)
     # Convert the ObjectId instances to a JSON serializable format
     incomes = [
             {
@@ -82,45 +132,72 @@ def get_incomes():
 @income_bp.route('/income/<string:_id>', methods=['PUT'])
 def update_income(_id):
     """It should update an income"""
-    # Get a content of updated income
-    updated_income = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    try:
+        updated_income = decode_body(IncomeUpdate)
+        normalize_dates(updated_income, 'income')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+    strip_owner(updated_income)
     # Get the previous version of an income (outdated)
-    outdated_income = income_collection.find_one({"_id": ObjectId(_id)})
+    outdated_income = income_collection.find_one(scoped({"_id": ObjectId(_id)}))
+    if outdated_income is None:
+        if is_archived(database_collection, 'income', ObjectId(_id)):
+            # Archived transactions are read-only
+            return jsonify({"message": f'Income with id: {_id} is archived and can no longer be changed'}), 410
+        # An income with the specified id is not found (or belongs to another user)
+        return jsonify({"message": f'Income with id: {_id} is not found'}), 404
     # Check if wallet_id and amount are modified (Skip if None are changed)
     if ((updated_income["wallet_id"] != outdated_income["wallet_id"]) or (updated_income["amount"] != outdated_income["amount"])):
         if (updated_income["wallet_id"] != outdated_income["wallet_id"]):
             # Scenario 1: Changes include wallet_id
-            wallet_collection.update_one({"wallet_id": outdated_income["wallet_id"]},
-                {"$inc": {"balance": - outdated_income["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
-            wallet_collection.update_one({"wallet_id": updated_income["wallet_id"]},
-                {"$inc": {"balance": + updated_income["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": outdated_income["wallet_id"]}),
+                {"$inc": {"balance": - outdated_income["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+                return_document=pymongo.ReturnDocument.AFTER))
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": updated_income["wallet_id"]}),
+                {"$inc": {"balance": + updated_income["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+                return_document=pymongo.ReturnDocument.AFTER))
         elif (updated_income["wallet_id"] == outdated_income["wallet_id"]) and (updated_income["amount"] != outdated_income["amount"]):
             # Scenario 2: Changes NOT include wallet_id
-            wallet_collection.update_one({"wallet_id": outdated_income["wallet_id"]},
-            {"$inc": {"balance": - outdated_income["amount"] + updated_income["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+            publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": outdated_income["wallet_id"]}),
+            {"$inc": {"balance": - outdated_income["amount"] + updated_income["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+            return_document=pymongo.ReturnDocument.AFTER))
     # Find and update the income in MongoDB
     response = income_collection.find_one_and_update(
-        {"_id": ObjectId(_id)},
-        {"$set": updated_income} )
+        scoped({"_id": ObjectId(_id)}),
+        {"$set": {**updated_income, "modified_at": modified_now()}} )
     if response is None:
         # An income with the specified id is not found
         return jsonify({"message": f'income with id: {_id} is not found'}), 404
     else:
         # An income is found and updated
+        publish('income.updated', {"_id": _id, "wallet_id": updated_income["wallet_id"], "amount": updated_income["amount"],
+                                   "description": updated_income.get("description"),
+                                   "previous": {"description": outdated_income.get("description")}})
         return jsonify({"message": f'income with id: {_id} is updated'}), 200
 
 @income_bp.route('/income/<string:_id>', methods=['DELETE'])
 def delete_income(_id):
     """It should delete an income"""
     # Find and delete an income from MongoDB
-    response = income_collection.find_one_and_delete({"_id": ObjectId(_id)})
+    response = income_collection.find_one_and_delete(scoped({"_id": ObjectId(_id)}))
     if response is None:
+        if is_archived(database_collection, 'income', ObjectId(_id)):
+            # Archived transactions are read-only
+            return jsonify({"message": f'Income with id: {_id} is archived and can no longer be deleted'}), 410
         # An income is not found hence is unable to delete
         return jsonify({"message": f'Failed to delete income with id: {_id}'}), 404
     else:
         # Find and update the balance of corresponding wallet
-        wallet_collection.update_one({"wallet_id": response["wallet_id"]},
-            {"$inc": {"balance": - response["amount"]}, "$set": {"updated_at": datetime.datetime.now()}})
+        publish_balance(wallet_collection.find_one_and_update(scoped({"wallet_id": response["wallet_id"]}),
+            {"$inc": {"balance": - response["amount"]}, "$set": {"updated_at": utc_now(), "modified_at": modified_now()}},
+            return_document=pymongo.ReturnDocument.AFTER))
+        # Leave a tombstone so that /sync tells the other clients
+        record_tombstones('income', [response["_id"]])
         # An income is deleted and the corresponding wallet has been updated
+        publish('income.deleted', {"_id": _id, "wallet_id": response["wallet_id"], "amount": response["amount"],
+                                   "description": response.get("description")})
         return jsonify({"message": f'income with id: {_id} is deleted'}), 200
 
@@ -0,0 +1,24 @@
+from flask import Blueprint, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, REGISTRY
+from prometheus_client import multiprocess
+import os
+from utils.metrics import AdmissionCollector
+
+metrics_bp = Blueprint('metrics', __name__)
+
+############################################################################################
+#####                         ADD METRICS FUNCTIONS HERE                              ######
+############################################################################################
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """It should expose the metrics in the Prometheus text format"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Several worker processes (e.g. gunicorn): aggregate the metrics of all of them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Not a file-backed metric: these are the admission counters of the worker serving the scrape
+        registry.register(AdmissionCollector())
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
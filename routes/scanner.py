@@ -1,8 +1,12 @@
 from flask import Blueprint, request, jsonify
 from dateutil import parser
-from google.cloud import documentai_v1beta3 as documentai
-from google.oauth2 import service_account
 import os
+from utils.idempotency import idempotent
+from utils.metrics import DOCUMENT_AI_LATENCY, DOCUMENT_AI_ERRORS
+from utils.tracing import span
+from utils.scoping import current_user_id
+from utils.db import get_database
+from utils import classifier
 
 scanner_bp = Blueprint('scanner', __name__)
 
@@ -10,16 +14,25 @@ scanner_bp = Blueprint('scanner', __name__)
 #####                         ADD SCAN RECEIPT FUNCTIONS HERE                         ######
 ############################################################################################
 
-# Load your Google Cloud service account credentials from the environment variable
-credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-credentials = service_account.Credentials.from_service_account_file(credentials_path)
-
 # Set Document AI processor details
 project_id = 'apt-reality-433311-j4'
 location = 'us'
 processor_id = 'b348edb6e0374f40'  # This is your processor ID
 
+credentials = None
+
+def get_credentials():
+    """Load the Google Cloud credentials on first scan, so the app starts without them"""
+    global credentials
+    if credentials is None:
+        from google.oauth2 import service_account
+        # Load your Google Cloud service account credentials from the environment variable
+        credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+        credentials = service_account.Credentials.from_service_account_file(credentials_path)
+    return credentials
+
 @scanner_bp.route('/scan-receipt', methods=['POST'])
+@idempotent
 def scan_receipt():
     try:
         # Check if a file was uploaded
@@ -30,7 +43,8 @@ def scan_receipt():
         image_content = file.read()
 
         # Initialize the Document AI client
-        client = documentai.DocumentProcessorServiceClient(credentials=credentials)
+        from google.cloud import documentai_v1beta3 as documentai
+        client = documentai.DocumentProcessorServiceClient(credentials=get_credentials())
 
         # Configure the request to Document AI
         name = f"projects/{project_id}/locations/{location}/processors/{processor_id}"
@@ -38,7 +52,9 @@ def scan_receipt():
         doc_request = documentai.types.ProcessRequest(name=name, raw_document=documentai.types.RawDocument(content=image_content, mime_type='image/jpeg'))
 
         # Process the document
-        result = client.process_document(request=doc_request)
+        with DOCUMENT_AI_LATENCY.time(), DOCUMENT_AI_ERRORS.count_exceptions(), \
+                span('documentai.process_document', processor_id=processor_id):
+            result = client.process_document(request=doc_request)
 
         # Extract relevant information from the result
         document = result.document
@@ -72,15 +88,18 @@ def scan_receipt():
                 print(f"Error parsing date: {e}")
                 iso_date = None
                 
-        # Print extracted information for debugging
-        print("Total Amount:", int_amount)
-        print("Description:", description)
-        print("Receipt Date:", iso_date)
+        # Suggest a category from the user's own past expenses
+        category, category_confidence = None, 0.0
+        if description:
+            [(category, category_confidence)] = classifier.predict(get_database(), current_user_id(), [description])
+
         # Return the extracted data as a JSON response
         return jsonify({
             "amount": int_amount,
             "description": description,
             "date": iso_date,
+            "category": category,
+            "category_confidence": round(category_confidence, 3),
             "message": "Expense created. Please confirm to add it."
         })
     except Exception as e:
@@ -0,0 +1,102 @@
+from flask import Blueprint, request, jsonify
+from utils import storage
+from utils.scoping import current_user_id
+from utils import autocomplete
+from utils import buckets
+from utils.indexes import TEXT_INDEXES
+import os
+import re
+
+search_bp = Blueprint('search', __name__)
+
+def connect_to_db():
+    return storage.connect()
+
+client, database_collection = connect_to_db()
+
+SEARCH_MAX_QUERY_LENGTH = 200
+SEARCH_MAX_PER_PAGE = int(os.getenv('SEARCH_MAX_PER_PAGE', '100'))
+AUTOCOMPLETE_MAX_LIMIT = 25
+
+def page_arguments():
+    """Read page and per_page from the query string; return (page, per_page) or raise ValueError"""
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', 20))
+    if page < 1 or not 1 <= per_page <= SEARCH_MAX_PER_PAGE:
+        raise ValueError
+    return page, per_page
+
+def text_query(q):
+    """A $text match on the caller's documents; the compound text index needs user_id to be an equality"""
+    return {"user_id": current_user_id(), "$text": {"$search": q}}
+
+def bucket_text_match(collection_name, q):
+    """The first stages of a text search over bucketed transactions (TRANSACTION_LAYOUT=bucket)"""
+    bucket_collection = buckets.BUCKET_COLLECTIONS[collection_name]
+    fields = [field.split('.', 1)[1] for field, kind in TEXT_INDEXES[bucket_collection][0] if kind == 'text']
+    terms = '|'.join(re.escape(term) for term in q.split())
+    # The text index finds the buckets and scores them; only the transactions of a bucket
+    # that contain a term are kept, and they share the score of their bucket
+    return [
+        {"$match": text_query(q)},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+        *buckets.flatten_stages(carry=("score",)),
+        {"$match": {"$or": [{field: {"$regex": terms, "$options": "i"}} for field in fields]}},
+        {"$addFields": {"type": collection_name}},
+    ]
+
+def text_match(collection_name, q):
+    """The first stages of a ranked text search over one collection"""
+    if buckets.TRANSACTION_LAYOUT == 'bucket':
+        return bucket_text_match(collection_name, q)
+    return [
+        {"$match": text_query(q)},
+        {"$addFields": {"type": collection_name, "score": {"$meta": "textScore"}}},
+    ]
+
+############################################################################################
+#####                         ADD SEARCH FUNCTIONS HERE                               ######
+############################################################################################
+
+@search_bp.route('/search', methods=['GET'])
+def search():
+    """It should return the incomes and expenses matching q, best matches first"""
+    q = request.args.get('q', '').strip()
+    if not q or len(q) > SEARCH_MAX_QUERY_LENGTH:
+        return jsonify({"error": f'q must be between 1 and {SEARCH_MAX_QUERY_LENGTH} characters'}), 400
+    try:
+        page, per_page = page_arguments()
+    except ValueError:
+        return jsonify({"error": f'page must be positive and per_page between 1 and {SEARCH_MAX_PER_PAGE}'}), 400
+    # Rank both collections together on the server; fetch one extra result to know if there is a next page
+    pipeline = text_match('expense', q) + [
+        {"$unionWith": {"coll": buckets.collection_name('income'), "pipeline": text_match('income', q)}},
+        {"$sort": {"score": -1, "date": -1, "_id": 1}},
+        {"$skip": (page - 1) * per_page},
+        {"$limit": per_page + 1},
+        {"$project": {"user_id": 0}},
+    ]
+    results = list(database_collection[buckets.collection_name('expense')].aggregate(pipeline))
+    for result in results:
+        result["_id"] = str(result["_id"])
+    return jsonify({
+        "results": results[:per_page],
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(results) > per_page,
+    }), 200
+
+@search_bp.route('/search/autocomplete', methods=['GET'])
+def search_autocomplete():
+    """It should return the user's most used descriptions starting with prefix"""
+    prefix = request.args.get('prefix', '')
+    if len(prefix) > SEARCH_MAX_QUERY_LENGTH:
+        return jsonify({"error": f'prefix must be at most {SEARCH_MAX_QUERY_LENGTH} characters'}), 400
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= AUTOCOMPLETE_MAX_LIMIT:
+        return jsonify({"error": f'limit must be between 1 and {AUTOCOMPLETE_MAX_LIMIT}'}), 400
+    suggestions = autocomplete.complete(database_collection, current_user_id(), prefix, limit)
+    return jsonify({"suggestions": suggestions}), 200
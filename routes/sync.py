@@ -0,0 +1,92 @@
+from flask import Blueprint, request, jsonify
+from bson import ObjectId
+import datetime
+import os
+from utils import storage
+from utils.buckets import transactions
+from utils.archive import find_transactions
+from utils.scoping import scoped
+from utils.sync import (modified_now, make_token, parse_token, get_collection as tombstone_collection,
+                        SYNC_OVERLAP_SECONDS, SYNC_TOMBSTONE_DAYS)
+
+sync_bp = Blueprint('sync', __name__)
+
+def connect_to_db():
+    return storage.connect()
+
+client, database_collection = connect_to_db()
+
+# A client this far behind gets a full snapshot instead of a change list
+SYNC_MAX_CHANGES = int(os.getenv('SYNC_MAX_CHANGES', '5000'))
+SYNC_COLLECTIONS = ('budget', 'wallet', 'income', 'expense')
+
+def collection(name):
+    return transactions(database_collection, name) if name in ('income', 'expense') else database_collection[name]
+
+def serialize(value):
+    """Make a document JSON serializable: ObjectIds become strings, the owner is left out"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {field: serialize(item) for field, item in value.items() if field != "user_id"}
+    if isinstance(value, list):
+        return [serialize(item) for item in value]
+    return value
+
+def load_changes(since):
+    """Return the documents of each collection modified after `since`, or None if there are too many"""
+    changes = {}
+    for name in SYNC_COLLECTIONS:
+        if since is None:
+            # A snapshot also holds the transactions moved to the archive (they never change again)
+            if name in ('income', 'expense'):
+                documents = find_transactions(database_collection, name)
+            else:
+                documents = list(collection(name).find(scoped()))
+        else:
+            # Reading one document past the limit is enough to know a snapshot is cheaper
+            documents = list(collection(name).find(scoped({"modified_at": {"$gt": since}}),
+                                                   limit=SYNC_MAX_CHANGES + 1))
+            if len(documents) > SYNC_MAX_CHANGES:
+                return None
+        changes[name] = [serialize(document) for document in documents]
+    return changes
+
+def load_tombstones(since):
+    """Return the ids deleted from each collection after `since`"""
+    deleted = {name: [] for name in SYNC_COLLECTIONS}
+    for tombstone in tombstone_collection().find(scoped({"deleted_at": {"$gt": since}}), {"collection": 1, "doc_id": 1}):
+        deleted.setdefault(tombstone["collection"], []).append(tombstone["doc_id"])
+    return deleted
+
+############################################################################################
+#####                         ADD SYNC FUNCTIONS HERE                                 ######
+############################################################################################
+
+@sync_bp.route('/sync', methods=['GET'])
+def sync():
+    """It should return the budgets, wallets, incomes and expenses changed or deleted since a token"""
+    since = None
+    if request.args.get('since'):
+        try:
+            since = parse_token(request.args['since'])
+        except ValueError:
+            return jsonify({"error": "Invalid sync token"}), 400
+    # Taken before reading, so a write made during this sync is in the next one
+    now = modified_now()
+    # Tombstones older than the retention are gone, so an old token cannot be answered with changes
+    if since is not None and since < now - datetime.timedelta(days=SYNC_TOMBSTONE_DAYS):
+        since = None
+    changes = load_changes(since)
+    if changes is None:
+        # Listing the changes would cost more than a snapshot
+        since = None
+        changes = load_changes(since)
+    reset = since is None
+    return jsonify({
+        "changes": changes,
+        # A snapshot replaces the client's copy, so it has nothing to delete
+        "deleted": {name: [] for name in SYNC_COLLECTIONS} if reset else load_tombstones(since),
+        "token": make_token(now - datetime.timedelta(seconds=SYNC_OVERLAP_SECONDS)),
+        "reset": reset,
+    }), 200
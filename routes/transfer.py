@@ -0,0 +1,116 @@
+from flask import Blueprint, jsonify
+from bson import ObjectId
+import pymongo
+import datetime
+from utils.dates import normalize_dates, utc_now
+from utils.models import decode_body, InvalidBody, Transfer
+from utils import storage
+from utils.buckets import transactions
+from utils.scoping import scoped, owned
+from utils.idempotency import idempotent
+from utils.events import publish, publish_balance
+from utils.routing import in_transaction, TransactionsUnavailable, WalletNotFound
+from utils.sync import modified_now, stamped
+
+transfer_bp = Blueprint('transfer', __name__)
+
+def connect_to_db():
+    return storage.connect()
+
+client, database_collection = connect_to_db()
+expense_collection = transactions(database_collection, 'expense')
+income_collection = transactions(database_collection, 'income')
+wallet_collection = database_collection['wallet']
+
+# The category and source of the two legs, so reports can leave transfers out
+TRANSFER_CATEGORY = 'Transfer'
+
+def transfer_legs(transfer):
+    """Return the expense and income that record a transfer, linked by a shared transfer_id"""
+    transfer_id = ObjectId()
+    date = transfer.get("date") or utc_now()
+    expense = {"_id": ObjectId(), "transfer_id": transfer_id, "wallet_id": transfer["from_wallet_id"],
+               "amount": transfer["amount"], "date": date, "category": TRANSFER_CATEGORY,
+               "description": transfer.get("description") or f'Transfer to {transfer["to_wallet_id"]}'}
+    income = {"_id": ObjectId(), "transfer_id": transfer_id, "wallet_id": transfer["to_wallet_id"],
+              "amount": transfer["amount"], "date": date, "source": TRANSFER_CATEGORY,
+              "description": transfer.get("description") or f'Transfer from {transfer["from_wallet_id"]}'}
+    return transfer_id, stamped(owned(expense)), stamped(owned(income))
+
+def move_balance(wallet_id, delta, now):
+    return wallet_collection.find_one_and_update(
+        scoped({"wallet_id": wallet_id}),
+        {"$inc": {"balance": delta}, "$set": {"updated_at": now, "modified_at": modified_now()}},
+        projection={"wallet_id": 1, "balance": 1},
+        return_document=pymongo.ReturnDocument.AFTER)
+
+def write_transfer(transfer, expense, income):
+    """Write both legs and both balances; run inside a transaction, so a missing wallet undoes it all"""
+    now = utc_now()
+    source = move_balance(transfer["from_wallet_id"], - transfer["amount"], now)
+    target = move_balance(transfer["to_wallet_id"], + transfer["amount"], now)
+    if source is None or target is None:
+        raise WalletNotFound()
+    expense_collection.insert_one(expense)
+    income_collection.insert_one(income)
+    return source, target
+
+def write_transfer_without_transaction(transfer, expense, income):
+    """Write a transfer where transactions are unavailable. This is NOT atomic: the legs are
+    written first and the balances after, so a failure in between leaves balances that
+    scripts/reconcile_balances.py recomputes from the legs (never money without a record)"""
+    wallet_ids = [transfer["from_wallet_id"], transfer["to_wallet_id"]]
+    # Check both wallets first so that nothing is written for a transfer that cannot happen
+    if wallet_collection.count_documents(scoped({"wallet_id": {"$in": wallet_ids}})) < 2:
+        raise WalletNotFound()
+    expense_collection.insert_one(expense)
+    income_collection.insert_one(income)
+    now = utc_now()
+    storage.update_each(wallet_collection, [
+        (scoped({"wallet_id": transfer["from_wallet_id"]}), {"$inc": {"balance": - transfer["amount"]}, "$set": {"updated_at": now, "modified_at": modified_now()}}),
+        (scoped({"wallet_id": transfer["to_wallet_id"]}), {"$inc": {"balance": + transfer["amount"]}, "$set": {"updated_at": now, "modified_at": modified_now()}}),
+    ])
+    wallets = {wallet["wallet_id"]: wallet for wallet in
+               wallet_collection.find(scoped({"wallet_id": {"$in": wallet_ids}}), {"wallet_id": 1, "balance": 1})}
+    return wallets[transfer["from_wallet_id"]], wallets[transfer["to_wallet_id"]]
+
+############################################################################################
+#####                         ADD TRANSFER FUNCTIONS HERE                             ######
+############################################################################################
+
+@transfer_bp.route('/transfer', methods=['POST'])
+@idempotent
+def add_transfer():
+    """It should move an amount between two wallets and return both balances"""
+    # Decode and validate the body from the raw bytes before any database work
+    try:
+        transfer = decode_body(Transfer)
+        normalize_dates(transfer, 'transfer')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+    if transfer["from_wallet_id"] == transfer["to_wallet_id"]:
+        return jsonify({"error": "A transfer needs two different wallets"}), 400
+    transfer_id, expense, income = transfer_legs(transfer)
+    try:
+        try:
+            # Both legs and both balances commit together or not at all
+            source, target = in_transaction(client, lambda: write_transfer(transfer, expense, income))
+        except TransactionsUnavailable:
+            source, target = write_transfer_without_transaction(transfer, expense, income)
+    except WalletNotFound:
+        return jsonify({"error": "Wallet not found"}), 404
+    # Notify the event stream of the two legs and the new balances
+    publish('expense.created', {"_id": str(expense["_id"]), "wallet_id": expense["wallet_id"], "amount": expense["amount"],
+                                "description": expense["description"], "category": expense["category"]})
+    publish('income.created', {"_id": str(income["_id"]), "wallet_id": income["wallet_id"], "amount": income["amount"],
+                               "description": income["description"]})
+    publish_balance(source)
+    publish_balance(target)
+    return jsonify({
+        "transfer_id": str(transfer_id),
+        "expense_id": str(expense["_id"]),
+        "income_id": str(income["_id"]),
+        "balances": {source["wallet_id"]: source["balance"], target["wallet_id"]: target["balance"]},
+    }), 201
@@ -1,35 +1,27 @@
 from flask import Blueprint, request, jsonify
-from dotenv import load_dotenv
 from bson import ObjectId
 import pymongo
 from dateutil import parser
+import datetime
 import os
+from utils.dates import normalize_dates, utc_now
+from utils.models import decode_body, InvalidBody, Wallet, WalletUpdate
+from utils import storage
+from utils.buckets import transactions
+from utils.scoping import scoped, owned, strip_owner, current_user_id
+from utils.forecast import forecast, FORECAST_HISTORY_MONTHS, FORECAST_HORIZON_MONTHS
+from utils.idempotency import idempotent
+from utils.events import publish, publish_balance
+from utils.sync import modified_now, stamped, record_tombstones, delete_transactions_with_tombstones
 
 wallet_bp = Blueprint('wallet', __name__)
 
-# Load config from .env file
-load_dotenv()
-MONGODB_URI = os.environ['MONGODB_URI']
-
 def connect_to_db():
-    # Set up a connection to MongoDB cluster
-    try:
-        client = pymongo.MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        if client.server_info():
-            print('SUCCESS: MongoDB is connected!')
-            # Getting a database
-            db = client['myfinance']
-            return client, db
-        else:
-            print('ERROR: MongoDB is not connected!')
-    except pymongo.errors.ServerSelectionTimeoutError:
-        print('ERROR: MongoDB connection timed out!')
-    except Exception as e:
-        print(f'ERROR: An unexpected error occurred: {e}')
+    return storage.connect()
     
 client, database_collection = connect_to_db()
-expense_collection = database_collection['expense']
-income_collection = database_collection['income']
+expense_collection = transactions(database_collection, 'expense')
+income_collection = transactions(database_collection, 'income')
 wallet_collection = database_collection['wallet']
 budget_collection = database_collection['budget']
 
@@ -38,17 +30,32 @@ budget_collection = database_collection['budget']
 ############################################################################################
 
 @wallet_bp.route('/wallet', methods=['POST'])
+@idempotent
 def add_wallet():
     """It should add a wallet to database"""
-    # Receive parsed data sent from the front-end (React)
-    wallet = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    # Store created_at/updated_at as BSON dates rather than ISO strings
+    try:
+        wallet = decode_body(Wallet)
+        normalize_dates(wallet, 'wallet')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
     # Verify if the provided budget_id exists in the budget collection
     budget_id = wallet.get("budget_id")
-    budget = budget_collection.find_one({"_id": ObjectId(budget_id)})
+    budget = budget_collection.find_one(scoped({"_id": ObjectId(budget_id)}))
     if not budget:
         return jsonify({"error": "Invalid budget_id, no matching budget found"}), 404
+    # Incomes and expenses refer to a wallet by its "wallet_id" field, so keep it equal to _id
+    wallet["_id"] = ObjectId()
+    wallet["wallet_id"] = str(wallet["_id"])
+    # Remember the starting balance so the balance can be recomputed from transactions
+    wallet["opening_balance"] = wallet["balance"]
     # Insert a wallet into MongoDB Atlas
-    wallet_collection.insert_one(wallet)
+    wallet_collection.insert_one(stamped(owned(wallet)))
+    publish('wallet.created', {"wallet_id": wallet["wallet_id"], "budget_id": budget_id})
+    publish_balance(wallet)
     # Return a success message
     return jsonify({"Message": "A wallet has been succesfully added"}), 201
 
@@ -56,7 +63,7 @@ def add_wallet():
 def list_wallets():
     """It should return a list of all available expenses"""
     # Get a list of wallets from MongoDB
-    list_of_wallets = wallet_collection.find({})
+    list_of_wallets = wallet_collection.find(scoped())
     # Convert the ObjectId instances to a JSON serializable format
     wallets = [
         {
@@ -76,34 +83,72 @@ def list_wallets():
 @wallet_bp.route('/wallet/<string:wallet_id>', methods=["PUT"])
 def update_wallet(wallet_id):
     """It should update a wallet"""
-    # Get a content of updated wallet
-    updated_wallet = request.json
+    # Decode and validate the body from the raw bytes before any database work
+    try:
+        updated_wallet = decode_body(WalletUpdate)
+        normalize_dates(updated_wallet, 'wallet')
+    except InvalidBody as e:
+        return jsonify({"error": e.message}), e.status
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+    strip_owner(updated_wallet)
     # Find and update the wallet in MongoDB
     response = wallet_collection.find_one_and_update(
-        {"_id": ObjectId(wallet_id)},
-        {"$set": updated_wallet} )
+        scoped({"_id": ObjectId(wallet_id)}),
+        {"$set": {**updated_wallet, "modified_at": modified_now()}} )
     if response is None:
         # A wallet with the specified id is not found
         return jsonify({"message": f'Wallet with id: {wallet_id} is not found'}), 404
-    else:
-        # A wallet is found and updated
-        return jsonify({"message": f'Wallet with id: {wallet_id} is updated'}), 200
+    if "balance" in updated_wallet and "opening_balance" in response:
+        # A manual balance change is an adjustment, so move the opening balance with it
+        wallet_collection.update_one(scoped({"_id": ObjectId(wallet_id)}),
+            {"$inc": {"opening_balance": updated_wallet["balance"] - response["balance"]}})
+    # A wallet is found and updated
+    publish('wallet.updated', {"wallet_id": response.get("wallet_id") or wallet_id})
+    if "balance" in updated_wallet:
+        publish_balance({**response, "balance": updated_wallet["balance"]})
+    return jsonify({"message": f'Wallet with id: {wallet_id} is updated'}), 200
 
 @wallet_bp.route('/wallet/<string:wallet_id>', methods=["DELETE"])
 def delete_wallet(wallet_id):
     """It should delete a wallet"""
-    # Find and delete a wallet from MongoDB
-    response = wallet_collection.find_one_and_delete({"wallet_id": ObjectId(wallet_id)})
+    # Find and delete a wallet from MongoDB; wallet_id is the string form of its _id
+    response = wallet_collection.find_one_and_delete(scoped({"wallet_id": wallet_id}))
     if response is None:
         # A wallet id is not found, unable to delete
         return jsonify({"message": f'Failed to delete expense with id: {wallet_id}'}), 404
-    # Wallet is deleted, now delete associated incomes and expenses
-    income_result = income_collection.delete_many({"wallet_id": str(wallet_id)})
-    expense_result = expense_collection.delete_many({"wallet_id": str(wallet_id)})
+    record_tombstones('wallet', [response["_id"]])
+    # Wallet is deleted, now delete associated incomes and expenses, archived ones too, leaving tombstones for /sync
+    incomes_deleted = delete_transactions_with_tombstones(database_collection, 'income', scoped({"wallet_id": str(wallet_id)}))
+    expenses_deleted = delete_transactions_with_tombstones(database_collection, 'expense', scoped({"wallet_id": str(wallet_id)}))
+    publish('wallet.deleted', {"wallet_id": str(wallet_id)})
     # Return success message, including number of related documents deleted
     return jsonify({
         "message": f'Wallet with id: {wallet_id} is deleted',
-        "incomes_deleted": income_result.deleted_count,
-        "expenses_deleted": expense_result.deleted_count
+        "incomes_deleted": incomes_deleted,
+        "expenses_deleted": expenses_deleted
     }), 200
 
+
+############################################################################################
+#####                         ADD FORECAST FUNCTIONS HERE                             ######
+############################################################################################
+
+FORECAST_MAX_HISTORY_MONTHS = 24
+FORECAST_MAX_HORIZON_MONTHS = 60
+
+@wallet_bp.route('/wallet/forecast', methods=['GET'])
+def forecast_wallets():
+    """It should project every wallet's balance and the date its target is reached"""
+    try:
+        history = int(request.args.get('history', FORECAST_HISTORY_MONTHS))
+        horizon = int(request.args.get('horizon', FORECAST_HORIZON_MONTHS))
+    except ValueError:
+        history = horizon = 0
+    if not 1 <= history <= FORECAST_MAX_HISTORY_MONTHS or not 1 <= horizon <= FORECAST_MAX_HORIZON_MONTHS:
+        return jsonify({"error": f'history must be between 1 and {FORECAST_MAX_HISTORY_MONTHS} '
+                                 f'and horizon between 1 and {FORECAST_MAX_HORIZON_MONTHS} months'}), 400
+    wallets = list(wallet_collection.find(scoped(), {"wallet_id": 1, "name": 1, "balance": 1, "target": 1, "created_at": 1}))
+    # One vectorized computation over all the wallets
+    forecasts = forecast(database_collection, current_user_id(), wallets, utc_now(), history, horizon)
+    return jsonify({"forecasts": forecasts}), 200
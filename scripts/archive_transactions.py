@@ -0,0 +1,45 @@
+"""Move incomes and expenses older than a cut-off into the compressed monthly archive.
+
+Every (user, wallet, month) before the cut-off becomes one document in
+`expense_archive`/`income_archive`, holding the compressed transactions and their
+rollup totals. The transactions are then deleted from the hot collection. Runs are
+idempotent, so an interrupted run can simply be started again. Schedule it daily or
+monthly.
+
+Usage:
+    python -m scripts.archive_transactions [--older-than-days 365] [--collections expense income]
+                                           [--pause 0.05] [--dry-run]
+"""
+import argparse
+import datetime
+import time
+from utils.db import connect_to_db
+from utils.dates import utc_now
+from utils.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_COLLECTIONS, archive_collection, month_start
+from utils.indexes import ensure_indexes
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Archive old incomes and expenses')
+    arg_parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    arg_parser.add_argument('--collections', nargs='+', default=list(ARCHIVE_COLLECTIONS),
+                            choices=list(ARCHIVE_COLLECTIONS))
+    arg_parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between months')
+    arg_parser.add_argument('--dry-run', action='store_true', help='Report what would move without writing')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    ensure_indexes(db)
+    # Cut at a month boundary so a month is archived whole rather than a few days at a time
+    cutoff = month_start(utc_now() - datetime.timedelta(days=args.older_than_days))
+
+    def progress(name, key, month, moved):
+        print(f'{name} {key.get("wallet_id")} {month:%Y-%m}: {moved} transactions')
+        # Throttle so archiving does not compete with live traffic
+        time.sleep(args.pause)
+
+    for name in args.collections:
+        summary = archive_collection(db, name, cutoff, args.dry_run, progress)
+        print(f'{name}: {summary["moved"]} transactions in {summary["buckets"]} months archived before {cutoff:%Y-%m-%d}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Stamp documents written before per-user scoping with the default owner.
+
+The query only matches documents without a user_id, so the job is naturally resumable:
+rerunning it continues with whatever is left. Once it has finished, set
+SCOPE_INCLUDE_UNOWNED=0 so queries no longer have to match missing owners.
+
+Usage:
+    python -m scripts.backfill_owner [--user-id default] [--batch-size 1000] [--pause 0.2]
+"""
+import argparse
+import time
+from utils.db import connect_to_db
+from utils.indexes import SCOPED_COLLECTIONS
+from utils.scoping import DEFAULT_USER_ID
+
+def backfill_collection(db, name, user_id, batch_size=1000, pause=0.2):
+    """Give every unowned document of a collection to user_id and return how many were updated"""
+    collection = db[name]
+    updated = 0
+    while True:
+        batch = [document["_id"] for document in
+                 collection.find({"user_id": {"$exists": False}}, {"_id": 1}).limit(batch_size)]
+        if not batch:
+            return updated
+        result = collection.update_many({"_id": {"$in": batch}, "user_id": {"$exists": False}},
+                                        {"$set": {"user_id": user_id}})
+        updated += result.modified_count
+        # Throttle so the backfill does not compete with live traffic
+        time.sleep(pause)
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Give unowned documents to a user')
+    arg_parser.add_argument('--user-id', default=DEFAULT_USER_ID)
+    arg_parser.add_argument('--batch-size', type=int, default=1000)
+    arg_parser.add_argument('--pause', type=float, default=0.2, help='Seconds to sleep between batches')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    for name in SCOPED_COLLECTIONS:
+        updated = backfill_collection(db, name, args.user_id, args.batch_size, args.pause)
+        print(f'{name}: {updated} documents given to {args.user_id}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Move incomes and expenses from one document each into per-wallet, per-month buckets.
+
+Run this before switching the API to TRANSACTION_LAYOUT=bucket (see utils/buckets.py).
+Transactions are moved one user, wallet and month at a time: they are written as full
+buckets and only then deleted from `expense`/`income`. Transactions already present in
+a bucket are skipped, so an interrupted run can simply be started again.
+
+Usage:
+    python -m scripts.bucket_transactions [--collections expense income] [--pause 0.05] [--dry-run]
+"""
+import argparse
+import datetime
+import time
+from utils.db import connect_to_db
+from utils.buckets import BUCKET_COLLECTIONS, BucketCollection
+from utils.indexes import ensure_indexes
+
+def bucket_month(db, name, user_id, wallet_id, year, month):
+    """Move the transactions of one user, wallet and month; return how many moved"""
+    start = datetime.datetime(year, month, 1)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    query = {"user_id": user_id, "wallet_id": wallet_id, "date": {"$gte": start, "$lt": end}}
+    moving = list(db[name].find(query))
+    if not moving:
+        return 0
+    bucketed = BucketCollection(db, name)
+    ids = [transaction["_id"] for transaction in moving]
+    # Skip what an interrupted run already bucketed
+    done = {transaction["_id"] for transaction in bucketed.find({"user_id": user_id, "_id": {"$in": ids}})}
+    bucketed.insert_many([transaction for transaction in moving if transaction["_id"] not in done])
+    db[name].delete_many({"_id": {"$in": ids}})
+    return len(moving)
+
+def bucket_collection(db, name, dry_run=False, progress=None):
+    """Move every dated transaction of a collection into buckets; return a summary"""
+    pipeline = [
+        {"$match": {"date": {"$type": "date"}}},
+        {"$group": {"_id": {"user_id": "$user_id", "wallet_id": "$wallet_id",
+                            "year": {"$year": "$date"}, "month": {"$month": "$date"}},
+                    "count": {"$sum": 1}}},
+    ]
+    summary = {"months": 0, "moved": 0}
+    for row in db[name].aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        if dry_run:
+            moved = row["count"]
+        else:
+            moved = bucket_month(db, name, key.get("user_id"), key.get("wallet_id"), key["year"], key["month"])
+        summary["months"] += 1
+        summary["moved"] += moved
+        if progress is not None:
+            progress(name, key, moved)
+    return summary
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Pack incomes and expenses into monthly buckets')
+    arg_parser.add_argument('--collections', nargs='+', default=list(BUCKET_COLLECTIONS),
+                            choices=list(BUCKET_COLLECTIONS))
+    arg_parser.add_argument('--pause', type=float, default=0.05, help='Seconds to sleep between months')
+    arg_parser.add_argument('--dry-run', action='store_true', help='Report what would move without writing')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    ensure_indexes(db)
+
+    def progress(name, key, moved):
+        print(f'{name} {key.get("wallet_id")} {key["year"]}-{key["month"]:02d}: {moved} transactions')
+        # Throttle so the move does not compete with live traffic
+        time.sleep(args.pause)
+
+    for name in args.collections:
+        summary = bucket_collection(db, name, args.dry_run, progress)
+        print(f'{name}: {summary["moved"]} transactions in {summary["months"]} months moved to {BUCKET_COLLECTIONS[name]}')
+    print('Undated transactions were left in place; give them a date with scripts.migrate_dates first')
+
+if __name__ == '__main__':
+    main()
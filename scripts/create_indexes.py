@@ -0,0 +1,24 @@
+"""Create the user-scoped indexes and, optionally, shard the collections on the hashed user_id.
+
+Usage:
+    python -m scripts.create_indexes [--shard]
+"""
+import argparse
+from utils.db import connect_to_db
+from utils.indexes import ensure_indexes, shard_collections
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Create the user-scoped indexes')
+    arg_parser.add_argument('--shard', action='store_true',
+                            help='Also shard the collections on {user_id: hashed, _id: 1}')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    ensure_indexes(db)
+    print('SUCCESS: Indexes are created')
+    if args.shard:
+        shard_collections(client, db)
+        print('SUCCESS: Collections are sharded on the hashed user_id')
+
+if __name__ == '__main__':
+    main()
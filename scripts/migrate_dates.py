@@ -0,0 +1,79 @@
+"""Backfill ISO date strings into BSON dates, in place and without downtime.
+
+Documents are visited in `_id` order in small batches. After each batch the last
+visited `_id` is saved to the checkpoint collection, so an interrupted run resumes
+where it stopped. Every update is guarded by the original string value, so a
+document that a handler rewrote in the meantime is left untouched.
+
+Usage:
+    python -m scripts.migrate_dates [--collections expense income] [--batch-size 500]
+                                    [--pause 0.2] [--dry-run] [--restart]
+"""
+import argparse
+import time
+from pymongo import UpdateOne
+from utils.db import connect_to_db
+from utils.dates import DATE_FIELDS, parse_date
+from utils.checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint
+
+def migrate_collection(db, name, batch_size=500, pause=0.2, dry_run=False, restart=False):
+    """Convert the string date fields of one collection and return a summary of the run"""
+    job = f'migrate_dates:{name}'
+    if restart:
+        clear_checkpoint(db, job)
+    state = load_checkpoint(db, job) or {"last_id": None, "converted": 0, "skipped": 0}
+    collection = db[name]
+    fields = DATE_FIELDS[name]
+    projection = {field: 1 for field in fields}
+    while True:
+        # Only documents that still hold at least one string date are fetched
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        if state["last_id"] is not None:
+            query["_id"] = {"$gt": state["last_id"]}
+        batch = list(collection.find(query, projection).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for document in batch:
+            guard = {"_id": document["_id"]}
+            changes = {}
+            for field in fields:
+                value = document.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    changes[field] = parse_date(value)
+                    guard[field] = value
+                except (ValueError, OverflowError):
+                    print(f'WARNING: {name} {document["_id"]} has an unparseable {field}: {value!r}')
+                    state["skipped"] += 1
+            if changes:
+                operations.append(UpdateOne(guard, {"$set": changes}))
+        if operations and not dry_run:
+            result = collection.bulk_write(operations, ordered=False)
+            state["converted"] += result.modified_count
+        elif dry_run:
+            state["converted"] += len(operations)
+        state["last_id"] = batch[-1]["_id"]
+        if not dry_run:
+            save_checkpoint(db, job, state)
+        # Throttle so the migration does not compete with live traffic
+        time.sleep(pause)
+    return state
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Convert ISO date strings into BSON dates')
+    arg_parser.add_argument('--collections', nargs='+', default=list(DATE_FIELDS), choices=list(DATE_FIELDS))
+    arg_parser.add_argument('--batch-size', type=int, default=500)
+    arg_parser.add_argument('--pause', type=float, default=0.2, help='Seconds to sleep between batches')
+    arg_parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    arg_parser.add_argument('--restart', action='store_true', help='Ignore saved checkpoints')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    for name in args.collections:
+        state = migrate_collection(db, name, args.batch_size, args.pause, args.dry_run, args.restart)
+        print(f'{name}: {state["converted"]} documents converted, {state["skipped"]} values skipped')
+
+if __name__ == '__main__':
+    main()
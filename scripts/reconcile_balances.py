@@ -0,0 +1,189 @@
+"""Recompute every wallet balance from its incomes and expenses and report or fix drift.
+
+The expected balance of a wallet is `opening_balance + sum(incomes) - sum(expenses)`,
+with archived months and bucketed transactions (TRANSACTION_LAYOUT=bucket) counted
+through their pre-computed totals.
+Wallets are read in `_id` order and split into chunks; the chunks of a wave run in
+parallel, each as ONE grouped aggregation over both transaction collections
+(`$unionWith`, MongoDB 4.4+). The last `_id` of every finished wave is checkpointed,
+so an interrupted run resumes where it stopped.
+
+Wallets created before `opening_balance` was recorded cannot be recomputed and are
+reported as unanchored, unless `--assume-zero-opening` is given.
+
+`--fix` runs against live traffic. A handler writes a transaction and moves the balance
+in two steps, so a drift can just be a write in progress. A drifted wallet is therefore
+only fixed if it shows the same drift again after `--settle-seconds`, with a balance and
+`modified_at` that have not moved; the update is guarded on both. Balance deltas held
+by the write-behind buffer (BALANCE_WRITE_BEHIND) are invisible here, so `--fix` refuses
+to run while it is enabled or while its journal holds deltas that were not applied yet.
+
+Usage:
+    python -m scripts.reconcile_balances [--fix] [--chunk-size 1000] [--workers 8]
+                                         [--tolerance 0.005] [--settle-seconds 5]
+                                         [--report drift.json] [--restart]
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.db import connect_to_db
+from utils import storage
+from utils.balance_buffer import BALANCE_WRITE_BEHIND, JOURNAL_COLLECTION
+from utils.checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint
+from utils.indexes import ensure_indexes
+from utils.archive import ARCHIVE_COLLECTIONS
+from utils.sync import modified_now
+from utils.buckets import BUCKET_COLLECTIONS
+
+JOB = 'reconcile_balances'
+
+def wallet_key(wallet):
+    """Return the key that incomes and expenses use to refer to a wallet"""
+    return wallet.get("wallet_id") or str(wallet["_id"])
+
+def transaction_totals(db, wallet_keys, user_ids):
+    """Return {wallet_id: incomes - expenses} for the given wallets in a single aggregation"""
+    # Matching on the owners too uses the user-scoped indexes and targets their shards
+    match = {"$match": {"user_id": {"$in": user_ids}, "wallet_id": {"$in": wallet_keys}}}
+    pipeline = [
+        match,
+        {"$group": {"_id": "$wallet_id", "net": {"$sum": {"$multiply": ["$amount", -1]}}}},
+        {"$unionWith": {"coll": "income", "pipeline": [
+            match,
+            {"$group": {"_id": "$wallet_id", "net": {"$sum": "$amount"}}}]}},
+        # Archived months count through their rollup totals
+        {"$unionWith": {"coll": ARCHIVE_COLLECTIONS["expense"], "pipeline": [
+            match,
+            {"$group": {"_id": "$wallet_id", "net": {"$sum": {"$multiply": ["$total", -1]}}}}]}},
+        {"$unionWith": {"coll": ARCHIVE_COLLECTIONS["income"], "pipeline": [
+            match,
+            {"$group": {"_id": "$wallet_id", "net": {"$sum": "$total"}}}]}},
+        # So do buckets; both layouts are counted, so a half-finished move to buckets still adds up
+        {"$unionWith": {"coll": BUCKET_COLLECTIONS["expense"], "pipeline": [
+            match,
+            {"$group": {"_id": "$wallet_id", "net": {"$sum": {"$multiply": ["$total", -1]}}}}]}},
+        {"$unionWith": {"coll": BUCKET_COLLECTIONS["income"], "pipeline": [
+            match,
+            {"$group": {"_id": "$wallet_id", "net": {"$sum": "$total"}}}]}},
+        {"$group": {"_id": "$_id", "net": {"$sum": "$net"}}},
+    ]
+    return {row["_id"]: row["net"] for row in db['expense'].aggregate(pipeline, allowDiskUse=True)}
+
+def find_drift(db, wallets, tolerance, assume_zero_opening):
+    """Return (drifted, unanchored) for a chunk of wallets"""
+    user_ids = list({wallet.get("user_id") for wallet in wallets})
+    totals = transaction_totals(db, [wallet_key(wallet) for wallet in wallets], user_ids)
+    drifted, unanchored = [], []
+    for wallet in wallets:
+        opening_balance = wallet.get("opening_balance")
+        if opening_balance is None:
+            if not assume_zero_opening:
+                unanchored.append(str(wallet["_id"]))
+                continue
+            opening_balance = 0
+        expected = round(opening_balance + totals.get(wallet_key(wallet), 0), 2)
+        stored = wallet.get("balance", 0)
+        if abs(expected - stored) > tolerance:
+            drifted.append({"_id": wallet["_id"], "wallet_id": wallet_key(wallet), "stored": stored,
+                            "expected": expected, "drift": round(stored - expected, 2),
+                            "modified_at": wallet.get("modified_at")})
+    return drifted, unanchored
+
+def reconcile_chunk(db, wallets, tolerance, assume_zero_opening, fix, settle_seconds=5):
+    """Compare the stored and recomputed balances of a chunk of wallets, fixing the drift that persists"""
+    drifted, unanchored = find_drift(db, wallets, tolerance, assume_zero_opening)
+    fixed = 0
+    if fix and drifted:
+        # Let the writes in progress finish, then look at the drifted wallets again
+        time.sleep(settle_seconds)
+        projection = {"user_id": 1, "wallet_id": 1, "balance": 1, "opening_balance": 1, "modified_at": 1}
+        again = list(db['wallet'].find({"_id": {"$in": [wallet["_id"] for wallet in drifted]}}, projection))
+        confirmed = {wallet["_id"]: wallet for wallet in find_drift(db, again, tolerance, assume_zero_opening)[0]}
+        updates = []
+        for wallet in drifted:
+            latest = confirmed.get(wallet["_id"])
+            if latest is None or (latest["stored"], latest["expected"], latest["modified_at"]) != \
+                    (wallet["stored"], wallet["expected"], wallet["modified_at"]):
+                # The wallet moved in the meantime; a later run will look at it again
+                continue
+            # Guard on the balance and modified_at so a concurrent update is never overwritten
+            updates.append(({"_id": wallet["_id"], "balance": wallet["stored"], "modified_at": wallet["modified_at"]},
+                            {"$set": {"balance": wallet["expected"], "modified_at": modified_now()}}))
+        fixed = storage.update_each(db['wallet'], updates, ordered=False)
+    return [{field: value for field, value in wallet.items() if field not in ("_id", "modified_at")}
+            for wallet in drifted], unanchored, fixed
+
+def check_fix_allowed(db):
+    """Raise RuntimeError if --fix could undo balance deltas that are not written yet"""
+    if BALANCE_WRITE_BEHIND:
+        raise RuntimeError('--fix cannot run while BALANCE_WRITE_BEHIND=1: pending deltas are not in the wallets yet')
+    if db[JOURNAL_COLLECTION].count_documents({}, limit=1):
+        raise RuntimeError(f'--fix cannot run while {JOURNAL_COLLECTION} holds deltas; let the app replay them first')
+
+def reconcile(db, chunk_size=1000, workers=8, tolerance=0.005, assume_zero_opening=False,
+              fix=False, restart=False, settle_seconds=5):
+    """Reconcile all wallets and return (summary, drifted wallets found in this run)"""
+    if fix:
+        check_fix_allowed(db)
+    if restart:
+        clear_checkpoint(db, JOB)
+    # Only counters are checkpointed; the drift list could outgrow a single document
+    summary = load_checkpoint(db, JOB) or {
+        "last_id": None, "checked": 0, "drifted": 0, "unanchored": 0, "fixed": 0}
+    drifted_wallets = []
+    # The aggregation matches on user_id and wallet_id, so both collections need that index
+    ensure_indexes(db)
+    projection = {"user_id": 1, "wallet_id": 1, "balance": 1, "opening_balance": 1, "modified_at": 1}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            query = {} if summary["last_id"] is None else {"_id": {"$gt": summary["last_id"]}}
+            wave = list(db['wallet'].find(query, projection).sort("_id", 1).limit(chunk_size * workers))
+            if not wave:
+                break
+            chunks = [wave[i:i + chunk_size] for i in range(0, len(wave), chunk_size)]
+            results = executor.map(
+                lambda chunk: reconcile_chunk(db, chunk, tolerance, assume_zero_opening, fix, settle_seconds), chunks)
+            for drifted, unanchored, fixed in results:
+                drifted_wallets.extend(drifted)
+                summary["drifted"] += len(drifted)
+                summary["unanchored"] += len(unanchored)
+                summary["fixed"] += fixed
+            summary["checked"] += len(wave)
+            summary["last_id"] = wave[-1]["_id"]
+            save_checkpoint(db, JOB, summary)
+    clear_checkpoint(db, JOB)
+    return summary, drifted_wallets
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Recompute wallet balances from incomes and expenses')
+    arg_parser.add_argument('--fix', action='store_true', help='Overwrite drifted balances')
+    arg_parser.add_argument('--chunk-size', type=int, default=1000, help='Wallets per aggregation')
+    arg_parser.add_argument('--workers', type=int, default=8, help='Chunks aggregated in parallel')
+    arg_parser.add_argument('--tolerance', type=float, default=0.005)
+    arg_parser.add_argument('--settle-seconds', type=float, default=5,
+                            help='Wait before confirming a drift that --fix would correct')
+    arg_parser.add_argument('--assume-zero-opening', action='store_true',
+                            help='Treat wallets without opening_balance as starting from 0')
+    arg_parser.add_argument('--report', help='Write the drifted wallets to this JSON file')
+    arg_parser.add_argument('--restart', action='store_true', help='Ignore a saved checkpoint')
+    args = arg_parser.parse_args()
+
+    client, db = connect_to_db()
+    try:
+        summary, drifted_wallets = reconcile(db, args.chunk_size, args.workers, args.tolerance,
+                                             args.assume_zero_opening, args.fix, args.restart, args.settle_seconds)
+    except RuntimeError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    for wallet in drifted_wallets:
+        print(f'DRIFT: wallet {wallet["wallet_id"]} stored {wallet["stored"]} expected {wallet["expected"]}')
+    print(f'{summary["checked"]} wallets checked, {summary["drifted"]} drifted, '
+          f'{summary["fixed"]} fixed, {summary["unanchored"]} without an opening balance')
+    if args.report:
+        with open(args.report, 'w') as report:
+            json.dump(drifted_wallets, report, indent=2)
+
+if __name__ == '__main__':
+    main()
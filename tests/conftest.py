@@ -0,0 +1,2 @@
+# Select the test backend before any test module imports the app (see support.py)
+import support
@@ -0,0 +1,32 @@
+"""Test settings shared by pytest and `python -m unittest discover tests`.
+
+Every test module imports this before the app, so both runners use the in-memory
+backend (unless STORAGE_BACKEND=mongodb is set) and run each test against its own
+empty database.
+"""
+import os
+import sys
+import unittest
+
+# Run the suite against the in-memory backend unless STORAGE_BACKEND=mongodb is set
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+# Every test client shares one address, which would exhaust its token buckets
+os.environ.setdefault('ADMISSION_ENABLED', '0')
+# Add parent directory to Python path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import storage
+
+class StorageTestCase(unittest.TestCase):
+    """A test case that runs every test against its own empty database"""
+
+    def run(self, result=None):
+        from utils.idempotency import response_cache
+        from utils.autocomplete import indexes
+        from utils.classifier import models
+        from routes.dashboard import dashboards
+        response_cache.clear()
+        indexes.clear()
+        models.clear()
+        dashboards.clear()
+        with storage.isolated(self.id()):
+            return super().run(result)
@@ -0,0 +1,64 @@
+import unittest
+import sys
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from utils.admission import AdmissionController, TokenBucket, route_class_of, client_of
+
+class TestAdmission(StorageTestCase):
+    """Test cases for admission control and load shedding"""
+    def setUp(self):
+        limits = {
+            "read": {"rate": 1, "burst": 2, "concurrency": 10},
+            "expensive": {"rate": 100, "burst": 100, "concurrency": 1},
+        }
+        self.controller = AdmissionController(limits)
+
+    def test_route_classes(self):
+        """It should give scans and cascade deletes their own budget"""
+        self.assertEqual(route_class_of('expense.get_expenses', 'GET'), "read")
+        self.assertEqual(route_class_of('expense.add_expense', 'POST'), "write")
+        self.assertEqual(route_class_of('scanner.scan_receipt', 'POST'), "expensive")
+        self.assertEqual(route_class_of('budget.delete_budget', 'DELETE'), "expensive")
+
+    def test_token_bucket_refill(self):
+        """It should allow a burst and then ask the client to wait"""
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+    def test_throttle_per_client(self):
+        """It should throttle a runaway client without affecting others"""
+        self.assertIsNone(self.controller.acquire('client-a', "read", count_in_flight=False))
+        self.assertIsNone(self.controller.acquire('client-a', "read", count_in_flight=False))
+        status, wait = self.controller.acquire('client-a', "read", count_in_flight=False)
+        self.assertEqual(status, 429)
+        self.assertGreater(wait, 0)
+        # Another client still has its full budget
+        self.assertIsNone(self.controller.acquire('client-b', "read", count_in_flight=False))
+
+    def test_shed_when_saturated(self):
+        """It should shed load with a 503 once a class has too many requests in flight"""
+        self.assertIsNone(self.controller.acquire('client-a', "expensive"))
+        status, _ = self.controller.acquire('client-b', "expensive")
+        self.assertEqual(status, 503)
+        # Once the first request finishes the next one is admitted
+        self.controller.release("expensive")
+        self.assertIsNone(self.controller.acquire('client-b', "expensive"))
+
+    def test_client_identity(self):
+        """It should tell users apart even when they all come through the gateway's address"""
+        gateway = {"REMOTE_ADDR": "10.0.0.1"}
+        with app.test_request_context('/expense', headers={"X-User-Id": "alice", "X-API-Key": "k1"}, environ_base=gateway):
+            alice = client_of()
+        with app.test_request_context('/expense', headers={"X-User-Id": "bob"}, environ_base=gateway):
+            bob = client_of()
+        with app.test_request_context('/expense', headers={"X-API-Key": "k1"}, environ_base=gateway):
+            key = client_of()
+        with app.test_request_context('/expense', environ_base=gateway):
+            address = client_of()
+        self.assertEqual(len({alice, bob, key, address}), 4)
+        self.assertEqual(address, 'address:10.0.0.1')
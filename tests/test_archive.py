@@ -0,0 +1,81 @@
+import unittest
+import sys
+from datetime import datetime
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.expense import connect_to_db
+from utils.archive import archive_collection, ARCHIVE_COLLECTIONS
+from utils.scoping import DEFAULT_USER_ID
+
+class TestArchive(StorageTestCase):
+    """Test cases for the cold-data archive"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_expense = self.db['expense']
+        self.collection_archive = self.db[ARCHIVE_COLLECTIONS['expense']]
+        self.wallet_id = str(ObjectId())
+        self.collection_expense.insert_many([
+            {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": amount, "date": date,
+             "category": category, "description": "Test"}
+            for amount, date, category in [
+                (10.00, datetime(2024, 1, 5), "Dining"),
+                (20.00, datetime(2024, 1, 20), "Grocery"),
+                (30.00, datetime(2024, 2, 1), "Dining"),
+                (40.00, datetime(2026, 1, 1), "Dining"),
+            ]])
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_expense.delete_many({})
+        self.collection_archive.delete_many({})
+
+    def test_archive_old_months(self):
+        """It should move old transactions into monthly archive documents with rollups"""
+        summary = archive_collection(self.db, 'expense', datetime(2025, 1, 1))
+        self.assertEqual(summary, {"buckets": 2, "moved": 3})
+        self.assertEqual(self.collection_expense.count_documents({}), 1)
+        january = self.collection_archive.find_one({"month": datetime(2024, 1, 1)})
+        self.assertEqual(january["count"], 2)
+        self.assertEqual(january["total"], 30.00)
+        self.assertEqual(january["by_category"], {"Dining": 10.00, "Grocery": 20.00})
+        # Running it again moves nothing and loses nothing
+        self.assertEqual(archive_collection(self.db, 'expense', datetime(2025, 1, 1))["moved"], 0)
+        self.assertEqual(self.collection_archive.find_one({"month": datetime(2024, 1, 1)})["count"], 2)
+
+    def test_list_reaches_into_archive(self):
+        """It should include archived transactions when a date range asks for them"""
+        archive_collection(self.db, 'expense', datetime(2025, 1, 1))
+        # Without a range only the hot collection is listed
+        self.assertEqual(len(self.app.get('/expense').get_json()["expenses"]), 1)
+        response = self.app.get('/expense?from=2024-01-10&to=2024-02-15')
+        self.assertEqual(response.status_code, 200)
+        amounts = sorted(expense["amount"] for expense in response.get_json()["expenses"])
+        self.assertEqual(amounts, [20.00, 30.00])
+        self.assertEqual(self.app.get('/expense?from=yesterday-ish').status_code, 400)
+
+    def test_archived_transactions_are_read_only(self):
+        """It should answer 410 Gone to updates and deletes of an archived transaction"""
+        archived_id = str(self.collection_expense.find_one({"amount": 10.00})["_id"])
+        archive_collection(self.db, 'expense', datetime(2025, 1, 1))
+        body = {"wallet_id": self.wallet_id, "amount": 15.00, "date": "2024-01-05", "category": "Dining", "description": "Test"}
+        self.assertEqual(self.app.put(f'/expense/{archived_id}', json=body).status_code, 410)
+        self.assertEqual(self.app.delete(f'/expense/{archived_id}').status_code, 410)
+        # An id that was never stored is still not found
+        self.assertEqual(self.app.delete(f'/expense/{ObjectId()}').status_code, 404)
+
+    def test_delete_wallet_deletes_archive(self):
+        """It should delete the archived transactions of a deleted wallet"""
+        self.db['wallet'].insert_one({"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "balance": 0.00})
+        archive_collection(self.db, 'expense', datetime(2025, 1, 1))
+        response = self.app.delete(f'/wallet/{self.wallet_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["expenses_deleted"], 4)
+        self.assertEqual(self.collection_archive.count_documents({}), 0)
+        self.assertEqual(self.app.get('/expense?from=2024-01-01&to=2024-03-01').get_json()["expenses"], [])
@@ -0,0 +1,89 @@
+import unittest
+import sys
+from datetime import datetime
+from bson import ObjectId
+from unittest import mock
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from utils.db import connect_to_db
+from utils.balance_buffer import BalanceBuffer, JOURNAL_COLLECTION
+from utils.scoping import DEFAULT_USER_ID
+from utils import storage
+
+class TestBalanceBuffer(StorageTestCase):
+    """Test cases for coalesced write-behind balance updates"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_wallet = self.db['wallet']
+        self.buffer = BalanceBuffer()
+        self.buffer.db = self.db
+        # Create a wallet with a known balance
+        self.wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({
+            "wallet_id": self.wallet_id,
+            "user_id": DEFAULT_USER_ID,
+            "balance": 1000.00,
+            "updated_at": datetime.now()
+        })
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_wallet.delete_many({})
+        self.db[JOURNAL_COLLECTION].delete_many({})
+
+    def test_coalesce_deltas(self):
+        """It should apply many deltas to a wallet as a single $inc"""
+        for amount in (100.00, -20.00, -30.00):
+            self.buffer.add(self.wallet_id, amount, DEFAULT_USER_ID)
+        # All three deltas are flushed as one update of one wallet
+        self.assertEqual(self.buffer.flush(), 1)
+        wallet = self.collection_wallet.find_one({"wallet_id": self.wallet_id})
+        self.assertEqual(wallet["balance"], 1050.00)
+        # Nothing is left to flush
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_replay_journal_once(self):
+        """It should apply a journaled delta exactly once"""
+        self.buffer._journal({(DEFAULT_USER_ID, self.wallet_id): -200.00})
+        self.buffer.flush()
+        # Replaying again (e.g. after a crash before the journal entry was removed) is a no-op
+        entry_id = self.collection_wallet.find_one({"wallet_id": self.wallet_id})["applied_journal"][0]
+        self.db[JOURNAL_COLLECTION].insert_one({"_id": entry_id, "user_id": DEFAULT_USER_ID,
+                                                "wallet_id": self.wallet_id, "delta": -200.00})
+        self.buffer._journal_dirty = True
+        self.buffer.flush()
+        wallet = self.collection_wallet.find_one({"wallet_id": self.wallet_id})
+        self.assertEqual(wallet["balance"], 800.00)
+        self.assertEqual(self.db[JOURNAL_COLLECTION].count_documents({}), 0)
+
+    def test_failure_after_write(self):
+        """It should apply a delta once when a flush fails after the server applied it"""
+        update_each = storage.update_each
+
+        def written_then_lost(collection, updates, ordered=True):
+            # The updates reach the server, but the answer is lost (e.g. the connection drops)
+            update_each(collection, updates, ordered)
+            raise RuntimeError("connection reset")
+
+        self.buffer.add(self.wallet_id, -200.00, DEFAULT_USER_ID)
+        with mock.patch('utils.balance_buffer.storage.update_each', written_then_lost):
+            self.assertEqual(self.buffer.flush(), 0)
+        # The delta stays journaled, and the replay of the next flush skips it
+        self.assertEqual(self.db[JOURNAL_COLLECTION].count_documents({}), 1)
+        self.buffer.flush()
+        wallet = self.collection_wallet.find_one({"wallet_id": self.wallet_id})
+        self.assertEqual(wallet["balance"], 800.00)
+        self.assertEqual(self.db[JOURNAL_COLLECTION].count_documents({}), 0)
+
+    def test_failure_to_publish(self):
+        """It should not journal deltas again when publishing the new balances fails"""
+        self.buffer.add(self.wallet_id, 50.00, DEFAULT_USER_ID)
+        with mock.patch.object(self.buffer, '_publish_balances', side_effect=RuntimeError("hub down")):
+            self.assertRaises(RuntimeError, self.buffer.flush)
+        self.assertEqual(self.db[JOURNAL_COLLECTION].count_documents({}), 0)
+        self.buffer.flush()
+        wallet = self.collection_wallet.find_one({"wallet_id": self.wallet_id})
+        self.assertEqual(wallet["balance"], 1050.00)
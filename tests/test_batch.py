@@ -0,0 +1,73 @@
+import unittest
+import sys
+import time
+from datetime import datetime
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.expense import connect_to_db
+from utils.idempotency import response_cache, IDEMPOTENCY_COLLECTION
+
+class TestBatch(StorageTestCase):
+    """Test cases for the batch endpoint"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_wallet = self.db['wallet']
+        self.collection_expense = self.db['expense']
+        self.wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": self.wallet_id, "budget_id": ObjectId(), "name": "Account 1",
+                                           "balance": 100.00, "created_at": datetime.now(), "updated_at": datetime.now(),
+                                           "type": "Savings", "target": 1000.00, "user_id": "alice"})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_wallet.delete_many({})
+        self.collection_expense.delete_many({})
+        self.db[IDEMPOTENCY_COLLECTION].delete_many({})
+        response_cache.clear()
+
+    def test_batch(self):
+        """It should run reads and writes in order as the calling user and return every response"""
+        expense = {"wallet_id": self.wallet_id, "amount": 30.00, "date": datetime(2026, 10, 1).isoformat(),
+                   "category": "Dining", "description": "Dinner"}
+        response = self.app.post('/batch', headers={"X-User-Id": "alice"}, json={"requests": [
+            {"id": "before", "method": "GET", "path": "/expense"},
+            {"id": "wallets", "method": "GET", "path": "/wallet"},
+            {"id": "add", "method": "POST", "path": "/expense", "body": expense},
+            {"id": "after", "method": "GET", "path": "/expense"},
+            {"id": "missing", "method": "DELETE", "path": f'/expense/{ObjectId()}'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()["responses"]
+        self.assertEqual([result["id"] for result in results], ["before", "wallets", "add", "after", "missing"])
+        self.assertEqual([result["status"] for result in results], [200, 200, 201, 200, 404])
+        self.assertEqual(results[0]["body"]["expenses"], [])
+        self.assertEqual([expense["description"] for expense in results[3]["body"]["expenses"]], ["Dinner"])
+        self.assertEqual(self.collection_wallet.find_one()["balance"], 70.00)
+        self.assertEqual(self.collection_expense.find_one()["user_id"], "alice")
+
+    def test_invalid_batch(self):
+        """It should reject malformed batches and nested batches"""
+        self.assertEqual(self.app.post('/batch', json={"requests": []}).status_code, 400)
+        self.assertEqual(self.app.post('/batch', json={"requests": [{"method": "PATCH", "path": "/wallet"}]}).status_code, 400)
+        self.assertEqual(self.app.post('/batch', json={"requests": [{"method": "GET", "path": "//example.com"}]}).status_code, 400)
+        response = self.app.post('/batch', json={"requests": [{"method": "POST", "path": "/batch", "body": {"requests": []}}]})
+        self.assertEqual(response.get_json()["responses"][0]["status"], 400)
+
+    def test_streaming_sub_request(self):
+        """It should reject a sub-request to the event stream instead of waiting for it to end"""
+        started_at = time.monotonic()
+        response = self.app.post('/batch', headers={"X-User-Id": "alice"}, json={"requests": [
+            {"method": "GET", "path": "/events"},
+            {"method": "GET", "path": "/metrics"},
+            {"method": "GET", "path": "/nowhere"},
+            {"method": "GET", "path": "/wallet"}]})
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in response.get_json()["responses"]], [400, 400, 404, 200])
@@ -0,0 +1,97 @@
+import unittest
+import sys
+from datetime import datetime
+from unittest.mock import patch
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.expense import connect_to_db
+from utils.buckets import BucketCollection, BUCKET_COLLECTIONS
+from utils.scoping import DEFAULT_USER_ID
+from scripts.bucket_transactions import bucket_collection
+
+class TestBuckets(StorageTestCase):
+    """Test cases for the bucket storage layout of transactions"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_buckets = self.db[BUCKET_COLLECTIONS['expense']]
+        self.collection_wallet = self.db['wallet']
+        self.expenses = BucketCollection(self.db, 'expense')
+        self.wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": self.wallet_id, "user_id": DEFAULT_USER_ID, "balance": 1000.00})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_buckets.delete_many({})
+        self.collection_wallet.delete_many({})
+        self.db['expense'].delete_many({})
+
+    def expense(self, amount, date, category="Dining"):
+        return {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": amount, "date": date,
+                "category": category, "description": "Test"}
+
+    def test_insert_packs_month_into_bucket(self):
+        """It should pack the transactions of a wallet and month into one bucket with totals"""
+        for amount in (10.00, 20.00):
+            self.expenses.insert_one(self.expense(amount, datetime(2024, 1, 5)))
+        self.expenses.insert_one(self.expense(30.00, datetime(2024, 2, 5)))
+        self.assertEqual(self.collection_buckets.count_documents({}), 2)
+        january = self.collection_buckets.find_one({"month": datetime(2024, 1, 1)})
+        self.assertEqual((january["count"], january["total"]), (2, 30.00))
+        found = self.expenses.find({"user_id": DEFAULT_USER_ID, "date": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)}})
+        self.assertEqual(sorted(expense["amount"] for expense in found), [10.00, 20.00])
+        self.assertEqual(found[0]["wallet_id"], self.wallet_id)
+
+    def test_full_bucket_starts_a_new_one(self):
+        """It should start a second bucket when the open one is full"""
+        with patch('utils.buckets.BUCKET_MAX_TRANSACTIONS', 2):
+            for amount in (1.00, 2.00, 3.00):
+                self.expenses.insert_one(self.expense(amount, datetime(2024, 1, 5)))
+        self.assertEqual(sorted(bucket["count"] for bucket in self.collection_buckets.find()), [1, 2])
+        self.assertEqual(self.expenses.count_documents({}), 3)
+
+    def test_update_and_delete(self):
+        """It should update in place, move between months and delete with the totals kept right"""
+        _id = self.expenses.insert_one(self.expense(10.00, datetime(2024, 1, 5))).inserted_id
+        old = self.expenses.find_one_and_update({"_id": _id}, {"$set": {"amount": 15.00}})
+        self.assertEqual(old["amount"], 10.00)
+        self.assertEqual(self.collection_buckets.find_one()["total"], 15.00)
+        self.expenses.find_one_and_update({"_id": _id}, {"$set": {"date": datetime(2024, 3, 1)}})
+        bucket = self.collection_buckets.find_one()
+        self.assertEqual((bucket["month"], bucket["count"], bucket["total"]), (datetime(2024, 3, 1), 1, 15.00))
+        deleted = self.expenses.find_one_and_delete({"_id": _id})
+        self.assertEqual(deleted["amount"], 15.00)
+        self.assertEqual(self.collection_buckets.count_documents({}), 0)
+        self.assertIsNone(self.expenses.find_one_and_delete({"_id": _id}))
+
+    def test_routes_in_bucket_layout(self):
+        """It should serve the expense routes unchanged from buckets"""
+        with patch('routes.expense.expense_collection', self.expenses), patch('utils.buckets.TRANSACTION_LAYOUT', 'bucket'):
+            response = self.app.post('/expense', json={"wallet_id": self.wallet_id, "amount": 25.00, "date": "2024-01-05",
+                                                       "category": "Dining", "description": "Lunch"})
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(self.db['expense'].count_documents({}), 0)
+            expenses = self.app.get('/expense').get_json()["expenses"]
+            self.assertEqual([expense["description"] for expense in expenses], ["Lunch"])
+            self.assertEqual(len(self.app.get('/expense?from=2024-01-01&to=2024-02-01').get_json()["expenses"]), 1)
+            _id = expenses[0]["_id"]
+            response = self.app.put(f'/expense/{_id}', json={"wallet_id": self.wallet_id, "amount": 30.00})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.collection_wallet.find_one()["balance"], 970.00)
+            self.assertEqual(self.app.delete(f'/expense/{_id}').status_code, 200)
+            self.assertEqual(self.collection_wallet.find_one()["balance"], 1000.00)
+            self.assertEqual(self.app.get('/expense').get_json()["expenses"], [])
+
+    def test_migrate_to_buckets(self):
+        """It should move existing expenses into buckets, and do nothing when run again"""
+        self.db['expense'].insert_many([self.expense(amount, datetime(2024, 1, day)) for day, amount in ((1, 5.00), (2, 7.00))])
+        self.assertEqual(bucket_collection(self.db, 'expense'), {"months": 1, "moved": 2})
+        self.assertEqual(self.db['expense'].count_documents({}), 0)
+        self.assertEqual(self.collection_buckets.find_one()["total"], 12.00)
+        self.assertEqual(bucket_collection(self.db, 'expense')["moved"], 0)
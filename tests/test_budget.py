@@ -8,10 +8,11 @@ from datetime import datetime, timedelta
 
 # Add parent directory to Python path
 sys.path.append('../')
+from support import StorageTestCase
 from app import app
 from routes.budget import connect_to_db, add_budget, get_budget, list_budgets, update_budget, delete_budget
 
-class TestBudget(unittest.TestCase):
+class TestBudget(StorageTestCase):
     """Test case for handling budget"""
     def setUp(self):
         # Create a connection to MongoDB atlas
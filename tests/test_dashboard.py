@@ -0,0 +1,85 @@
+import unittest
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.dashboard import connect_to_db
+from utils.dates import utc_now
+from utils.archive import archive_collection
+
+class TestDashboard(StorageTestCase):
+    """Test cases for the dashboard"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.wallet_id = str(ObjectId())
+        now = utc_now()
+        self.db['wallet'].insert_one({"wallet_id": self.wallet_id, "name": "Account 1", "balance": 500.00,
+                                      "type": "Savings", "target": 1000.00, "user_id": "alice"})
+        self.db['budget'].insert_one({"name": "Home", "wallet_id": self.wallet_id, "user_id": "alice",
+                                      "categories": {"needs": {"Rent": 800.00, "Food": 200.00}, "wants": {}, "bills": {"Power": 50.00}}})
+        self.db['expense'].insert_many([
+            {"wallet_id": self.wallet_id, "amount": float(i), "date": now - timedelta(minutes=i), "category": "Dining",
+             "description": f'Lunch {i}', "user_id": "alice"} for i in range(1, 26)])
+        self.db['expense'].insert_one({"wallet_id": self.wallet_id, "amount": 100.00, "date": now, "category": "Transfer",
+                                       "description": "Transfer", "transfer_id": ObjectId(), "user_id": "alice"})
+        self.db['income'].insert_one({"wallet_id": self.wallet_id, "amount": 1000.00, "date": now, "source": "Salary",
+                                      "description": "Pay", "user_id": "alice"})
+        self.db['expense'].insert_one({"wallet_id": "other", "amount": 9.00, "date": now, "category": "Dining",
+                                       "description": "Not mine", "user_id": "bob"})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def test_dashboard(self):
+        """It should return the user's wallets, budgets, month totals and 20 latest transactions"""
+        response = self.app.get('/dashboard', headers={"X-User-Id": "alice"})
+        self.assertEqual(response.status_code, 200)
+        dashboard = response.get_json()
+        self.assertEqual([wallet["balance"] for wallet in dashboard["wallets"]], [500.00])
+        self.assertEqual(dashboard["budgets"][0]["planned"], {"needs": 1000.00, "wants": 0, "bills": 50.00})
+        # The transfer leg is left out of the totals; the expenses of 1..25 add up to 325
+        if utc_now().day > 1:
+            self.assertEqual(dashboard["month"]["expenses"]["total"], 325.00)
+            self.assertEqual(dashboard["month"]["incomes"]["by_source"], {"Salary": 1000.00})
+            self.assertEqual(dashboard["month"]["net"], 675.00)
+        self.assertEqual(len(dashboard["recent"]), 20)
+        self.assertNotIn("Not mine", [transaction["description"] for transaction in dashboard["recent"]])
+        dates = [transaction["date"] for transaction in dashboard["recent"]]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_dashboard_is_refreshed_after_a_write(self):
+        """It should serve a cached dashboard until the user changes something"""
+        self.app.get('/dashboard', headers={"X-User-Id": "alice"})
+        self.db['wallet'].update_one({"wallet_id": self.wallet_id}, {"$set": {"balance": 1.00}})
+        cached = self.app.get('/dashboard', headers={"X-User-Id": "alice"}).get_json()
+        self.assertEqual(cached["wallets"][0]["balance"], 500.00)
+        response = self.app.post('/income', headers={"X-User-Id": "alice"},
+                                 json={"wallet_id": self.wallet_id, "amount": 10.00, "date": datetime.now().isoformat(),
+                                       "source": "Salary", "description": "Pay"})
+        self.assertEqual(response.status_code, 201)
+        refreshed = self.app.get('/dashboard', headers={"X-User-Id": "alice"}).get_json()
+        self.assertEqual(refreshed["wallets"][0]["balance"], 11.00)
+
+    def test_read_after_skips_cache(self):
+        """It should not serve a cached dashboard to a client reading after its own write"""
+        self.app.get('/dashboard', headers={"X-User-Id": "alice"})
+        # A write made through another worker, whose events this worker does not see
+        self.db['wallet'].update_one({"wallet_id": self.wallet_id}, {"$set": {"balance": 1.00}})
+        response = self.app.get('/dashboard', headers={"X-User-Id": "alice", "X-Read-After": "1700000000.1"})
+        self.assertEqual(response.get_json()["wallets"][0]["balance"], 1.00)
+
+    def test_dashboard_reads_archive(self):
+        """It should count this month's transactions from the archive rollups, still without transfers"""
+        if utc_now().day == 1:
+            self.skipTest("The setUp transactions may fall in the previous month")
+        for name in ('expense', 'income'):
+            archive_collection(self.db, name, utc_now() + timedelta(minutes=1))
+        self.assertEqual(self.db['expense'].count_documents({"user_id": "alice"}), 0)
+        dashboard = self.app.get('/dashboard', headers={"X-User-Id": "alice"}).get_json()
+        self.assertEqual(dashboard["month"]["expenses"], {"total": 325.00, "count": 25, "by_category": {"Dining": 325.00}})
+        self.assertEqual(dashboard["month"]["incomes"]["by_source"], {"Salary": 1000.00})
+        self.assertEqual(dashboard["month"]["net"], 675.00)
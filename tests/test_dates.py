@@ -0,0 +1,47 @@
+import unittest
+import sys
+from datetime import datetime, date, timedelta, timezone
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from utils.dates import parse_date, normalize_dates, utc_now
+
+class TestDates(StorageTestCase):
+    """Test cases for converting client dates into BSON dates"""
+
+    def test_parse_iso_string(self):
+        """It should parse an ISO string sent by the front-end"""
+        self.assertEqual(parse_date("2024-08-21T10:30:00"), datetime(2024, 8, 21, 10, 30))
+        self.assertEqual(parse_date("2024-08-21"), datetime(2024, 8, 21))
+
+    def test_parse_aware_string(self):
+        """It should convert a timezone-aware string into naive UTC"""
+        self.assertEqual(parse_date("2024-08-21T10:30:00+02:00"), datetime(2024, 8, 21, 8, 30))
+
+    def test_parse_passthrough(self):
+        """It should keep datetimes and None as they are, and widen dates"""
+        now = datetime.now()
+        self.assertIs(parse_date(now), now)
+        self.assertIsNone(parse_date(None))
+        self.assertEqual(parse_date(date(2024, 8, 21)), datetime(2024, 8, 21))
+
+    def test_parse_invalid(self):
+        """It should raise a ValueError for a value that is not a date"""
+        self.assertRaises(ValueError, parse_date, "not a date")
+        self.assertRaises(ValueError, parse_date, 42)
+
+    def test_utc_now(self):
+        """It should return the current time as naive UTC, like the stored dates"""
+        now = utc_now()
+        self.assertIsNone(now.tzinfo)
+        expected = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.assertLess(abs(now - expected), timedelta(seconds=5))
+
+    def test_normalize_dates(self):
+        """It should only convert the date fields of the given collection"""
+        budget = {"name": "Budget 1", "created_at": "2024-08-21T10:30:00", "updated_at": "2024-08-22"}
+        normalize_dates(budget, 'budget')
+        self.assertEqual(budget["created_at"], datetime(2024, 8, 21, 10, 30))
+        self.assertEqual(budget["updated_at"], datetime(2024, 8, 22))
+        self.assertEqual(budget["name"], "Budget 1")
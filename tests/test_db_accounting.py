@@ -0,0 +1,83 @@
+import unittest
+import sys
+from types import SimpleNamespace
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from flask import has_request_context
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+import utils.db_accounting
+from utils.db_accounting import (command_shape, CommandAccounting, start_accounting, finish_accounting, stop_accounting,
+                                 carry_accounting, current_stats)
+
+class TestDBAccounting(StorageTestCase):
+    """Test cases for per-request MongoDB call accounting"""
+    def setUp(self):
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def test_command_shape(self):
+        """It should describe a command without any of its values"""
+        shape = command_shape('find', {"find": "expense", "filter": {"wallet_id": "A1", "amount": {"$gt": 10}}})
+        self.assertEqual(shape, {"command": "find", "collection": "expense",
+                                 "filter": {"wallet_id": "str", "amount": {"$gt": "int"}}})
+        shape = command_shape('delete', {"delete": "income", "deletes": [{"q": {"wallet_id": "A1"}, "limit": 0}]})
+        self.assertEqual(shape["filter"], [{"wallet_id": "str"}])
+        self.assertEqual(shape["batch"], 1)
+
+    def run_request(self, commands):
+        """Account a request that runs the given commands, as pymongo reports them to the listener"""
+        # The in-memory backend emits no pymongo command events, so they are sent to the listener here
+        listener = CommandAccounting()
+        with app.test_request_context('/expense'):
+            start_accounting()
+            for request_id, command in enumerate(commands):
+                listener.started(SimpleNamespace(request_id=request_id, command_name=next(iter(command)),
+                                                 command=command, database_name='myfinance'))
+                listener.succeeded(SimpleNamespace(request_id=request_id, duration_micros=1500))
+            response = finish_accounting(app.response_class('[]'))
+            stop_accounting()
+        return response
+
+    def test_stats_header(self):
+        """It should return the number of MongoDB commands and their time in a debug header"""
+        with mock.patch.object(utils.db_accounting, 'DB_STATS_HEADER', True):
+            response = self.run_request([{"find": "expense", "filter": {}}])
+        self.assertEqual(response.headers['X-DB-Stats'], 'commands=1; time_ms=1.5')
+
+    def test_slow_request_log(self):
+        """It should log a request that runs more commands than the threshold"""
+        with mock.patch.object(utils.db_accounting, 'DB_SLOW_COMMAND_COUNT', 0):
+            with self.assertLogs('slow_requests', level='WARNING') as logs:
+                self.run_request([{"find": "expense", "filter": {"wallet_id": "A1"}}])
+        self.assertIn("'command': 'find', 'collection': 'expense'", logs.output[0])
+
+    def test_request_without_commands(self):
+        """It should count nothing for a request that does not reach MongoDB"""
+        with mock.patch.object(utils.db_accounting, 'DB_STATS_HEADER', True):
+            response = self.app.get('/healthz')
+        self.assertEqual(response.headers['X-DB-Stats'], 'commands=0; time_ms=0.0')
+
+    def test_commands_on_worker_threads(self):
+        """It should count the commands a request runs on a thread pool, without sharing the request"""
+        listener = CommandAccounting()
+
+        def query(request_id):
+            listener.started(SimpleNamespace(request_id=request_id, command_name='find',
+                                             command={"find": "wallet", "filter": {}}, database_name='myfinance'))
+            listener.succeeded(SimpleNamespace(request_id=request_id, duration_micros=1000))
+            return has_request_context()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            with app.test_request_context('/dashboard'):
+                start_accounting()
+                in_request = [executor.submit(carry_accounting(query), i).result() for i in range(3)]
+                stats = current_stats.get()
+                stop_accounting()
+            self.assertEqual(stats.count, 3)
+            self.assertEqual(in_request, [False] * 3)
+            # The pooled threads do not keep the request's stats
+            self.assertIsNone(executor.submit(current_stats.get).result())
@@ -0,0 +1,66 @@
+import unittest
+import sys
+import json
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from utils.events import EventHub, hub
+from utils.scoping import DEFAULT_USER_ID
+
+class TestEvents(StorageTestCase):
+    """Test cases for the balance and transaction event stream"""
+    def setUp(self):
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def test_publish_to_subscribers(self):
+        """It should deliver a published event to every subscriber"""
+        test_hub = EventHub()
+        first, second = test_hub.subscribe(), test_hub.subscribe()
+        event = test_hub.publish('balance', {"wallet_id": "A1", "balance": 100})
+        self.assertEqual(first.get(timeout=1), event)
+        self.assertEqual(second.get(timeout=1), event)
+
+    def test_replay_missed_events(self):
+        """It should replay the events a reconnecting client missed"""
+        test_hub = EventHub()
+        first = test_hub.publish('expense.created', {"_id": "1"})
+        second = test_hub.publish('expense.created', {"_id": "2"})
+        subscription = test_hub.subscribe(last_event_id=first["id"])
+        self.assertEqual(subscription.get(timeout=1), second)
+        self.assertTrue(subscription.queue.empty())
+
+    def test_filter_by_user(self):
+        """It should only deliver events to subscribers of the same user"""
+        test_hub = EventHub()
+        subscription = test_hub.subscribe(user_id="user-1")
+        test_hub.publish('balance', {"wallet_id": "A2", "balance": 1}, "user-2")
+        event = test_hub.publish('balance', {"wallet_id": "A1", "balance": 2}, "user-1")
+        self.assertEqual(subscription.get(timeout=1), event)
+        self.assertTrue(subscription.queue.empty())
+
+    def test_drop_slow_subscriber(self):
+        """It should disconnect a subscriber whose queue is full"""
+        test_hub = EventHub(queue_size=1)
+        subscription = test_hub.subscribe()
+        test_hub.publish('balance', {"wallet_id": "A1", "balance": 1})
+        test_hub.publish('balance', {"wallet_id": "A1", "balance": 2})
+        self.assertTrue(subscription.overflowed)
+
+    def test_stream_events(self):
+        """It should stream events in the Server-Sent Events format"""
+        event = hub.publish('balance', {"wallet_id": "A1", "balance": 250.0}, DEFAULT_USER_ID)
+        # Ask for everything after the previous event so the stream starts with this one
+        response = self.app.get('/events', headers={'Last-Event-ID': str(event["id"] - 1)}, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/event-stream'))
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 3000\n\n')
+        message = next(chunks).decode()
+        response.close()
+        self.assertIn(f'id: {event["id"]}\n', message)
+        self.assertIn('event: balance\n', message)
+        data = json.loads(message.split('data: ')[1])
+        self.assertEqual(data, {"wallet_id": "A1", "balance": 250.0})
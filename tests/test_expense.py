@@ -1,16 +1,24 @@
 import unittest
 import sys
-from datetime import datetime
+from datetime import datetime, timedelta
+import hashlib
 import json
 import dotenv
 from bson import ObjectId
+from unittest import mock
 
 # Add parent directory to Python path
 sys.path.append('../')
+from support import StorageTestCase
 from app import app
 from routes.expense import add_expense, get_expenses, update_expense, delete_expense, connect_to_db
+from routes import expense
+from utils.idempotency import response_cache, IDEMPOTENCY_COLLECTION, get_collection
+from utils import storage
+from utils.dates import utc_now
+from utils.scoping import DEFAULT_USER_ID
 
-class TestExpenses(unittest.TestCase):
+class TestExpenses(StorageTestCase):
     """Test cases for handling expenses"""
     def setUp(self):
         # Create a connection to MongoDB Atlas 
@@ -26,6 +34,8 @@ class TestExpenses(unittest.TestCase):
         # Clean up all resources in database
         self.collection_expense.delete_many({})
         self.collection_wallet.delete_many({})
+        self.db[IDEMPOTENCY_COLLECTION].delete_many({})
+        response_cache.clear()
          
     def test_add_expense(self):
         """It should add an expense and assert that it exists"""
@@ -68,6 +78,23 @@ class TestExpenses(unittest.TestCase):
         # Assert that the balance of wallet is updated
         self.assertEqual(wallet_from_database["balance"], expected_balance)
         
+    def test_add_expense_failed_insert(self):
+        """It should leave the wallet balance alone when the expense cannot be inserted"""
+        wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": wallet_id, "name": "Account 1", "balance": 6000.00,
+                                           "type": "Savings", "target": 10000.00})
+        expense_to_be_added = {"amount": 70.00, "date": datetime.now().isoformat(), "category": "Fitness",
+                               "description": "Gym", "wallet_id": wallet_id}
+        with mock.patch.object(expense.expense_collection, 'insert_one', side_effect=RuntimeError('connection lost')), \
+                mock.patch.dict(app.config, {"PROPAGATE_EXCEPTIONS": True}):
+            with self.assertRaises(RuntimeError):
+                self.app.post('/expense', json=expense_to_be_added)
+        self.assertEqual(self.collection_wallet.find_one({"wallet_id": wallet_id})["balance"], 6000.00)
+        # An unknown wallet writes nothing at all
+        response = self.app.post('/expense', json={**expense_to_be_added, "wallet_id": str(ObjectId())})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.collection_expense.count_documents({}), 0)
+
     def test_list_expense(self):
         """It should get all expenses from database"""
         # Create a list of THREE expenses
@@ -235,8 +262,188 @@ class TestExpenses(unittest.TestCase):
         deleted_expense = self.collection_expense.find_one({"_id": test_expense_id})
         # Assert that the expense is not found
         self.assertIsNone(deleted_expense)
-        # Assert that the balance of corresponding wallet is updated
-        expected_balance = test_wallet["balance"] - expense_to_be_deleted["amount"]
+        # Assert that the amount of the deleted expense is given back to the wallet
+        expected_balance = test_wallet["balance"] + expense_to_be_deleted["amount"]
         # Fetch the corresponding wallet from database
         wallet_from_database = self.collection_wallet.find_one({"wallet_id": wallet_id})
         self.assertEqual(wallet_from_database["balance"], expected_balance)
+
+    def test_list_expense_scoped_to_user(self):
+        """It should only return the expenses of the requesting user"""
+        expenses_to_be_added = [{
+            "amount": 70.00,
+            "date": datetime.now(),
+            "category": "Fitness",
+            "description": "A Monthly Payment for Eagle Gym Membership",
+            "wallet_id": "A1",
+            "user_id": "user-a"
+        },
+        {
+            "amount": 50.00,
+            "date": datetime.now(),
+            "category": "Meals",
+            "description": "Lunch at McDonald's",
+            "wallet_id": "B1",
+            "user_id": "user-b"
+        }]
+        self.collection_expense.insert_many(expenses_to_be_added)
+        # Make a GET request on behalf of user-a
+        response = self.app.get('/expense', headers={'X-User-Id': 'user-a'})
+        self.assertEqual(response.status_code, 200)
+        response_dict = json.loads(response.data)
+        # Assert that only the expense of user-a is returned
+        self.assertEqual(len(response_dict['expenses']), 1)
+        self.assertEqual(response_dict['expenses'][0]["description"], expenses_to_be_added[0]["description"])
+
+    def test_add_expense_idempotent(self):
+        """It should add an expense only once when a request is retried with the same Idempotency-Key"""
+        wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({
+            "wallet_id": wallet_id,
+            "name": "Account 1",
+            "balance": 6000.00,
+            "created_at": datetime.now(),
+            "updated_at": datetime.now(),
+            "type": "Savings",
+            "target": 10000.00
+        })
+        expense_to_be_added = {
+            "amount": 70.00,
+            "date": datetime.now().isoformat(),
+            "category": "Fitness",
+            "description": "A Monthly Payment for Eagle Gym Membership",
+            "wallet_id": wallet_id
+        }
+        headers = {'Idempotency-Key': 'retry-test-1'}
+        # Send the same request twice, as a client retrying after a timeout would
+        first_response = self.app.post('/expense', json=expense_to_be_added, headers=headers)
+        second_response = self.app.post('/expense', json=expense_to_be_added, headers=headers)
+        self.assertEqual(first_response.status_code, 201)
+        self.assertEqual(second_response.status_code, 201)
+        self.assertEqual(second_response.get_json(), first_response.get_json())
+        self.assertEqual(second_response.headers.get('Idempotent-Replayed'), 'true')
+        # Assert that the expense was written and the balance updated only once
+        self.assertEqual(self.collection_expense.count_documents({"wallet_id": wallet_id}), 1)
+        wallet_from_database = self.collection_wallet.find_one({"wallet_id": wallet_id})
+        self.assertEqual(wallet_from_database["balance"], 6000.00 - expense_to_be_added["amount"])
+        # Reusing the key for a different request is rejected
+        expense_to_be_added["amount"] = 80.00
+        response = self.app.post('/expense', json=expense_to_be_added, headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_update_missing_expense(self):
+        """It should return 404 when updating an expense that does not exist or belongs to another user"""
+        other = self.collection_expense.insert_one({"wallet_id": "W1", "amount": 5.00, "user_id": "someone-else"})
+        for expense_id in (str(ObjectId()), str(other.inserted_id)):
+            response = self.app.put(f'/expense/{expense_id}', json={"wallet_id": "W1", "amount": 10.00})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.collection_expense.find_one({"_id": other.inserted_id})["amount"], 5.00)
+
+    def test_idempotency_ttl_index_per_namespace(self):
+        """It should create the TTL index of the idempotency claims in every database it writes to"""
+        for namespace in ('first', 'second'):
+            with storage.isolated(f'{self.id()}.{namespace}') as db:
+                get_collection()
+                ttl = [index for index in db[IDEMPOTENCY_COLLECTION].index_information().values()
+                       if "expireAfterSeconds" in index]
+                self.assertEqual([index["key"] for index in ttl], [[("created_at", 1)]])
+
+    def test_idempotency_claim_lease(self):
+        """It should take over the claim of a crashed request once its lease has run out"""
+        wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": wallet_id, "balance": 100.00})
+        expense_to_be_added = {
+            "amount": 10.00,
+            "date": datetime.now().isoformat(),
+            "category": "Food",
+            "description": "Lunch",
+            "wallet_id": wallet_id
+        }
+        headers = {'Idempotency-Key': 'crashed-1'}
+        # A worker claimed the key and died before completing the request
+        record_id = f'{DEFAULT_USER_ID}:POST:/expense:crashed-1'
+        fingerprint = hashlib.sha256(json.dumps(expense_to_be_added).encode()).hexdigest()
+        self.db[IDEMPOTENCY_COLLECTION].insert_one({"_id": record_id, "state": "in_progress", "fingerprint": fingerprint,
+                                                    "lease_until": utc_now() + timedelta(seconds=30),
+                                                    "created_at": utc_now()})
+        # The retry is turned away while the lease lasts
+        response = self.app.post('/expense', data=json.dumps(expense_to_be_added), content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 409)
+        # ... and runs once it has run out
+        self.db[IDEMPOTENCY_COLLECTION].update_one({"_id": record_id}, {"$set": {"lease_until": utc_now() - timedelta(seconds=1)}})
+        response = self.app.post('/expense', data=json.dumps(expense_to_be_added), content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.collection_expense.count_documents({"wallet_id": wallet_id}), 1)
+        self.assertEqual(self.db[IDEMPOTENCY_COLLECTION].find_one({"_id": record_id})["state"], "completed")
+
+    def test_add_expense_invalid_body(self):
+        """It should reject a malformed expense before writing anything"""
+        wallet_id = str(ObjectId())
+        expense_to_be_added = {
+            "amount": 70.00,
+            "date": datetime.now().isoformat(),
+            "category": "Fitness",
+            "description": "A Monthly Payment for Eagle Gym Membership",
+            "wallet_id": wallet_id
+        }
+        # Missing amount
+        response = self.app.post('/expense', json={k: v for k, v in expense_to_be_added.items() if k != "amount"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("amount", response.get_json()["error"])
+        # Wrong type
+        response = self.app.post('/expense', json={**expense_to_be_added, "amount": "seventy"})
+        self.assertEqual(response.status_code, 400)
+        # Unknown field
+        response = self.app.post('/expense', json={**expense_to_be_added, "balance": 1000000})
+        self.assertEqual(response.status_code, 400)
+        # Oversized body
+        response = self.app.post('/expense', json={**expense_to_be_added, "description": "x" * 20000})
+        self.assertEqual(response.status_code, 413)
+        # Assert that nothing was written
+        self.assertEqual(self.collection_expense.count_documents({}), 0)
+
+    def test_categorize_expenses(self):
+        """It should suggest categories for a batch of descriptions from past expenses"""
+        wallet_id = str(ObjectId())
+        past_expenses = [("Tesco Extra", "Grocery"), ("Tesco Express", "Grocery"), ("Lidl", "Grocery"),
+                         ("Shell Petrol Station", "Transport"), ("Shell", "Transport"), ("Uber trip", "Transport")]
+        self.collection_expense.insert_many([
+            {"amount": 10.00, "date": datetime.now(), "category": category, "description": description,
+             "wallet_id": wallet_id}
+            for description, category in past_expenses])
+        response = self.app.post('/expense/categorize', json={"descriptions": ["TESCO STORES 2041", "Shell Oil 12", ""]})
+        self.assertEqual(response.status_code, 200)
+        categories = [item["category"] for item in response.get_json()["categories"]]
+        self.assertEqual(categories, ["Grocery", "Transport", None])
+        # The model learns from new expenses without being retrained
+        self.collection_wallet.insert_one({"wallet_id": wallet_id, "balance": 100.00})
+        self.app.post('/expense', json={"amount": 5.00, "date": "2026-01-01", "category": "Coffee",
+                                        "description": "Starbucks", "wallet_id": wallet_id})
+        self.app.post('/expense', json={"amount": 5.00, "date": "2026-01-02", "category": "Coffee",
+                                        "description": "Starbucks Reserve", "wallet_id": wallet_id})
+        response = self.app.post('/expense/categorize', json={"descriptions": ["STARBUCKS 112"]})
+        self.assertEqual(response.get_json()["categories"][0]["category"], "Coffee")
+
+    def test_categorize_learns_corrections(self):
+        """It should move an edited expense from its old category to the new one"""
+        wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": wallet_id, "balance": 100.00})
+        self.collection_expense.insert_one({"amount": 1.00, "date": datetime.now(), "category": "Dining",
+                                            "description": "Lidl", "wallet_id": wallet_id})
+        # Load the model before the expense is written, so it learns from the events
+        self.app.post('/expense/categorize', json={"descriptions": ["Lidl"]})
+        expense = {"amount": 5.00, "date": "2026-01-01", "category": "Dining", "description": "Pret A Manger",
+                   "wallet_id": wallet_id}
+        self.app.post('/expense', json=expense)
+        response = self.app.post('/expense/categorize', json={"descriptions": ["PRET A MANGER 12"]})
+        self.assertEqual(response.get_json()["categories"][0]["category"], "Dining")
+        # The user corrects the category
+        expense_id = str(self.collection_expense.find_one({"description": "Pret A Manger"})["_id"])
+        response = self.app.put(f'/expense/{expense_id}', json={**expense, "category": "Coffee"})
+        self.assertEqual(response.status_code, 200)
+        response = self.app.post('/expense/categorize', json={"descriptions": ["PRET A MANGER 12"]})
+        self.assertEqual(response.get_json()["categories"][0]["category"], "Coffee")
+        # Deleting it forgets it altogether
+        self.app.delete(f'/expense/{expense_id}')
+        response = self.app.post('/expense/categorize', json={"descriptions": ["PRET A MANGER 12"]})
+        self.assertEqual(response.get_json()["categories"][0]["category"], "Dining")
@@ -0,0 +1,84 @@
+import unittest
+import sys
+import numpy as np
+from datetime import datetime
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.wallet import connect_to_db
+from utils.forecast import project, forecast
+from utils.archive import archive_collection
+
+class TestForecast(StorageTestCase):
+    """Test cases for savings-target forecasts"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def test_project(self):
+        """It should compute rates, trajectories and months to target for all wallets at once"""
+        balances = np.array([100.0, 100.0, 100.0, 500.0])
+        targets = np.array([400.0, 400.0, 400.0, 400.0])
+        income = np.array([[200.0, 200.0], [100.0, 100.0], [0.0, 0.0], [0.0, 0.0]])
+        expense = np.array([[100.0, 100.0], [150.0, 150.0], [0.0, 0.0], [0.0, 0.0]])
+        active = np.array([[True, True], [True, True], [False, False], [True, True]])
+        result = project(balances, targets, income, expense, active, horizon=3)
+        np.testing.assert_allclose(result["monthly_net"][:2], [100.0, -50.0])
+        self.assertTrue(np.isnan(result["monthly_net"][2]))
+        np.testing.assert_allclose(result["months_to_target"][[0, 3]], [3.0, 0.0])
+        self.assertEqual(result["months_to_target"][1], np.inf)
+        self.assertTrue(np.isnan(result["months_to_target"][2]))
+        np.testing.assert_allclose(result["trajectory"][0], [200.0, 300.0, 400.0])
+        np.testing.assert_allclose(result["trajectory"][2], [100.0, 100.0, 100.0])
+
+    def test_recent_months_weigh_more(self):
+        """It should weigh recent months more than older ones"""
+        result = project(np.array([0.0]), np.array([1000.0]), np.array([[0.0, 300.0]]), np.array([[0.0, 0.0]]),
+                         np.array([[True, True]]), horizon=1, half_life=1)
+        np.testing.assert_allclose(result["monthly_income"], [200.0])
+
+    def test_forecast_endpoint(self):
+        """It should forecast the caller's wallets from their past incomes and expenses"""
+        wallet_id = str(ObjectId())
+        self.db['wallet'].insert_one({"wallet_id": wallet_id, "name": "Holiday", "balance": 1000.00, "target": 2000.00,
+                                      "created_at": datetime(2026, 1, 1), "user_id": "alice"})
+        for month in range(4, 10):
+            self.db['income'].insert_one({"wallet_id": wallet_id, "amount": 300.00, "date": datetime(2026, month, 15), "user_id": "alice"})
+            self.db['expense'].insert_one({"wallet_id": wallet_id, "amount": 100.00, "date": datetime(2026, month, 20), "user_id": "alice"})
+        wallets = list(self.db['wallet'].find())
+        [result] = forecast(self.db, "alice", wallets, datetime(2026, 10, 19), history=6, horizon=12)
+        self.assertEqual((result["monthly_income"], result["monthly_expense"], result["monthly_net"]), (300.00, 100.00, 200.00))
+        self.assertEqual(result["status"], "on_track")
+        self.assertEqual(result["months_to_target"], 5.0)
+        self.assertEqual(result["target_date"], "2027-03-20")
+        self.assertEqual(result["trajectory"][0], {"month": "2026-11", "balance": 1200.00})
+        response = self.app.get('/wallet/forecast?horizon=6', headers={"X-User-Id": "alice"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()["forecasts"][0]["trajectory"]), 6)
+        self.assertEqual(self.app.get('/wallet/forecast?horizon=0').status_code, 400)
+        self.assertEqual(self.app.get('/wallet/forecast', headers={"X-User-Id": "bob"}).get_json(), {"forecasts": []})
+
+    def test_forecast_reads_archive(self):
+        """It should count the months moved to the archive through their rollups"""
+        wallet_id = str(ObjectId())
+        self.db['wallet'].insert_one({"wallet_id": wallet_id, "name": "Holiday", "balance": 1000.00, "target": 2000.00,
+                                      "created_at": datetime(2026, 1, 1), "user_id": "alice"})
+        for month in range(4, 10):
+            self.db['income'].insert_one({"wallet_id": wallet_id, "amount": 300.00, "date": datetime(2026, month, 15), "user_id": "alice"})
+            self.db['expense'].insert_one({"wallet_id": wallet_id, "amount": 100.00, "date": datetime(2026, month, 20), "user_id": "alice"})
+        # April and May move to the archive, halfway through the forecast history
+        for name in ('income', 'expense'):
+            self.assertEqual(archive_collection(self.db, name, datetime(2026, 6, 1))["moved"], 2)
+        wallets = list(self.db['wallet'].find())
+        [result] = forecast(self.db, "alice", wallets, datetime(2026, 10, 19), history=6, horizon=12)
+        self.assertEqual((result["monthly_income"], result["monthly_expense"], result["monthly_net"]), (300.00, 100.00, 200.00))
+        # Another user's forecast does not see them
+        self.db['wallet'].insert_one({"wallet_id": wallet_id, "name": "Mine", "balance": 0.00, "target": 100.00,
+                                      "created_at": datetime(2026, 1, 1), "user_id": "bob"})
+        [other] = forecast(self.db, "bob", list(self.db['wallet'].find({"user_id": "bob"})), datetime(2026, 10, 19), history=6)
+        self.assertEqual(other["monthly_net"], 0.00)
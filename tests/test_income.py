@@ -8,10 +8,11 @@ from bson import ObjectId
 
 # Add parent directory to Python path
 sys.path.append('../')
+from support import StorageTestCase
 from app import app
 from routes.income import add_income, get_incomes, update_income, delete_income, connect_to_db
 
-class TestIncome(unittest.TestCase):
+class TestIncome(StorageTestCase):
     """Test cases for handling income"""
     def setUp(self):
         # Create a connection to MongoDB Atlas
@@ -69,6 +70,15 @@ class TestIncome(unittest.TestCase):
         # Assert that the balance of wallet is updated
         self.assertEqual(wallet_from_database["balance"], expected_balance)
     
+    def test_add_income_requires_fields(self):
+        """It should reject an income without a date, source or description, as it does an expense"""
+        test_income = {"source": "Salary", "amount": 10.00, "description": "Pay",
+                       "date": datetime.now().isoformat(), "wallet_id": "A1"}
+        for field in ("date", "source", "description"):
+            body = {key: value for key, value in test_income.items() if key != field}
+            self.assertEqual(self.app.post('/income', json=body).status_code, 400)
+        self.assertEqual(self.collection_income.count_documents({}), 0)
+
     def test_list_income(self):
         """It should get a list of all existing incomes"""
         test_incomes = [{
@@ -0,0 +1,43 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from utils.storage import STORAGE_BACKEND
+
+class TestMetrics(StorageTestCase):
+    """Test cases for the Prometheus metrics endpoint"""
+    def setUp(self):
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def test_metrics(self):
+        """It should expose request, MongoDB and pool metrics in the Prometheus format"""
+        # Make a request that runs a MongoDB command
+        self.app.get('/expense')
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        body = response.get_data(as_text=True)
+        # Latency is labelled with the route pattern of the blueprint
+        self.assertIn('http_request_duration_seconds_bucket{le="0.001",method="GET",route="/expense",status="200"}', body)
+        self.assertIn('http_requests_in_flight{method="GET",route="/metrics"} 1.0', body)
+        self.assertIn('document_ai_request_duration_seconds_count', body)
+        self.assertIn('admission_in_flight{route_class="read"}', body)
+        # The in-memory backend emits no pymongo command or pool events
+        if STORAGE_BACKEND != 'memory':
+            self.assertIn('mongodb_command_duration_seconds_count{command="find",outcome="succeeded"}', body)
+            self.assertIn('mongodb_pool_checkout_wait_seconds_count{outcome="succeeded"}', body)
+
+    def test_multiprocess_metrics(self):
+        """It should include the admission counters when aggregating several worker processes"""
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": directory}):
+                response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('admission_in_flight{route_class="read"}', response.get_data(as_text=True))
@@ -0,0 +1,121 @@
+import unittest
+import sys
+from unittest import mock
+from pymongo.errors import AutoReconnect, ServerSelectionTimeoutError
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from utils import resilience
+from utils.resilience import CircuitBreaker, DatabaseUnavailable, call
+
+class TestResilience(StorageTestCase):
+    """Test cases for retries, the circuit breaker and the health probes"""
+    def setUp(self):
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+        # Do not actually sleep between retries
+        self.sleep = mock.patch.object(resilience.time, 'sleep').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        resilience.breaker.record_success()
+
+    def test_retry_reads(self):
+        """It should retry a read that fails with a connection error"""
+        method = mock.Mock(side_effect=[AutoReconnect('down'), AutoReconnect('down'), 'found'])
+        self.assertEqual(call(method, (), {}, True, CircuitBreaker(), attempts=3), 'found')
+        self.assertEqual(method.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_no_retry_server_selection_timeout(self):
+        """It should not retry a read that already waited for the server selection timeout"""
+        method = mock.Mock(side_effect=ServerSelectionTimeoutError('no primary'))
+        with self.assertRaises(ServerSelectionTimeoutError):
+            call(method, (), {}, True, CircuitBreaker(), attempts=3)
+        self.assertEqual(method.call_count, 1)
+
+    def test_no_retry_writes(self):
+        """It should leave retrying writes to pymongo"""
+        method = mock.Mock(side_effect=AutoReconnect('down'))
+        with self.assertRaises(AutoReconnect):
+            call(method, (), {}, False, CircuitBreaker(), attempts=3)
+        self.assertEqual(method.call_count, 1)
+
+    def test_circuit_breaker(self):
+        """It should fail fast once open and close again after a successful trial call"""
+        circuit = CircuitBreaker(failures=2, reset_seconds=10)
+        failing = mock.Mock(side_effect=[AutoReconnect('down'), AutoReconnect('down')])
+        for _ in range(2):
+            with self.assertRaises(AutoReconnect):
+                call(failing, (), {}, False, circuit)
+        self.assertEqual(circuit.state, circuit.OPEN)
+        # The call is not attempted while the circuit is open
+        with self.assertRaises(DatabaseUnavailable):
+            call(failing, (), {}, False, circuit)
+        self.assertEqual(failing.call_count, 2)
+        # After the reset period one trial call goes through
+        circuit.opened_at -= 10
+        self.assertEqual(call(mock.Mock(return_value='ok'), (), {}, False, circuit), 'ok')
+        self.assertEqual(circuit.state, circuit.CLOSED)
+
+    def test_cursor_trial_closes_circuit(self):
+        """It should close the circuit when a trial cursor returns its first batch"""
+        for _ in range(resilience.breaker.failure_threshold):
+            resilience.breaker.record_failure()
+        resilience.breaker.opened_at -= resilience.breaker.reset_seconds
+        # GET /expense reads through a find() cursor
+        self.assertEqual(self.app.get('/expense').status_code, 200)
+        self.assertEqual(resilience.breaker.state, resilience.breaker.CLOSED)
+        self.assertEqual(self.app.get('/expense').status_code, 200)
+
+    def test_failed_cursor_reopens_circuit(self):
+        """It should reopen the circuit when a trial cursor fails"""
+        circuit = CircuitBreaker(failures=1, reset_seconds=10)
+        circuit.record_failure()
+        circuit.opened_at -= 10
+        cursor = call(mock.Mock(return_value=mock.Mock(__next__=mock.Mock(side_effect=AutoReconnect('down')))),
+                      (), {}, True, circuit, lazy=True)
+        self.assertEqual(circuit.state, circuit.HALF_OPEN)
+        with self.assertRaises(AutoReconnect):
+            next(cursor)
+        self.assertEqual(circuit.state, circuit.OPEN)
+
+    def test_unreported_trial_is_replaced(self):
+        """It should let another trial through when a trial never reports back"""
+        circuit = CircuitBreaker(failures=1, reset_seconds=10)
+        circuit.record_failure()
+        circuit.opened_at -= 10
+        call(mock.Mock(return_value=iter([])), (), {}, True, circuit, lazy=True)
+        self.assertEqual(circuit.state, circuit.HALF_OPEN)
+        with self.assertRaises(DatabaseUnavailable):
+            call(mock.Mock(), (), {}, False, circuit)
+        circuit.opened_at -= 10
+        self.assertEqual(call(mock.Mock(return_value='ok'), (), {}, False, circuit), 'ok')
+        self.assertEqual(circuit.state, circuit.CLOSED)
+
+    def test_half_open_circuit_is_not_ready(self):
+        """It should not report ready while a trial call is in flight"""
+        for _ in range(resilience.breaker.failure_threshold):
+            resilience.breaker.record_failure()
+        resilience.breaker.opened_at -= resilience.breaker.reset_seconds
+        resilience.breaker.before_call()
+        self.assertEqual(self.app.get('/readyz').status_code, 503)
+
+    def test_open_circuit_returns_503(self):
+        """It should answer 503 with Retry-After while the circuit is open"""
+        for _ in range(resilience.breaker.failure_threshold):
+            resilience.breaker.record_failure()
+        response = self.app.get('/expense')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(self.app.get('/readyz').status_code, 503)
+        # Liveness does not depend on MongoDB
+        self.assertEqual(self.app.get('/healthz').status_code, 200)
+
+    def test_readyz(self):
+        """It should be ready when MongoDB answers a ping"""
+        response = self.app.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["database"], "up")
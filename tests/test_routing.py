@@ -0,0 +1,70 @@
+import unittest
+import sys
+import pymongo
+from unittest.mock import patch
+from bson.timestamp import Timestamp
+from pymongo.read_preferences import SecondaryPreferred
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from utils import routing
+
+class TestRouting(StorageTestCase):
+    """Test cases for per-endpoint read routing and causal sessions"""
+    def setUp(self):
+        # A client that never connects: options and sessions are set up locally
+        self.client = pymongo.MongoClient('mongodb://localhost:1', connect=False)
+        self.collection = self.client['myfinance']['expense']
+        routing.last_writes.clear()
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_policies_by_endpoint(self):
+        """It should send list reads to secondaries and keep other endpoints on the primary"""
+        with app.test_request_context('/expense', method='GET'):
+            routed = routing.routed(self.collection)
+            self.assertIsInstance(routed.read_preference, SecondaryPreferred)
+            self.assertEqual(routed.read_preference.max_staleness, routing.READ_MAX_STALENESS_SECONDS)
+            self.assertEqual(routed.read_concern.level, 'majority')
+        with app.test_request_context('/expense', method='POST'):
+            self.assertEqual(routing.routed(self.collection).read_preference, pymongo.ReadPreference.PRIMARY)
+        # Idempotent writes read their claim from the primary
+        with app.test_request_context('/expense/categorize', method='POST'):
+            self.assertEqual(routing.routed(self.collection).read_preference, pymongo.ReadPreference.PRIMARY)
+        # Scripts run without a request and keep the defaults
+        self.assertIs(routing.routed(self.collection), self.collection)
+
+    def test_session_reads_after_last_write(self):
+        """It should start one causal session per request, advanced to the client's last write"""
+        with app.test_request_context('/expense', headers={routing.READ_AFTER_HEADER: '1700000000.7'}):
+            kwargs = routing.with_session(self.collection, 'find', {})
+            session = kwargs["session"]
+            self.assertTrue(session.options.causal_consistency)
+            self.assertEqual(session.operation_time, Timestamp(1700000000, 7))
+            self.assertIs(routing.with_session(self.collection, 'aggregate', {})["session"], session)
+            # Methods without a session argument are left alone
+            self.assertEqual(routing.with_session(self.collection, 'with_options', {}), {})
+            routing.end_session()
+
+    def test_write_time_is_returned(self):
+        """It should return the operation time of a write and remember it for the user"""
+        with app.test_request_context('/expense', method='POST'):
+            session = routing.with_session(self.collection, 'insert_one', {})["session"]
+            session.advance_operation_time(Timestamp(1700000001, 3))
+            response = routing.record_read_after(app.response_class())
+            routing.end_session()
+        self.assertEqual(response.headers[routing.READ_AFTER_HEADER], '1700000001.3')
+        with app.test_request_context('/expense'):
+            session = routing.with_session(self.collection, 'find', {})["session"]
+            self.assertEqual(session.operation_time, Timestamp(1700000001, 3))
+            routing.end_session()
+
+    def test_malformed_header_is_ignored(self):
+        """It should ignore an X-Read-After header it cannot parse"""
+        self.assertIsNone(routing.parse_timestamp('soon'))
+        self.assertIsNone(routing.parse_timestamp(None))
+        with patch('utils.routing.READ_ROUTING', False), app.test_request_context('/expense'):
+            self.assertEqual(routing.with_session(self.collection, 'find', {}), {})
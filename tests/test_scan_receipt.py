@@ -6,10 +6,11 @@ from flask import Flask
 
 # Add parent directory to Python path
 sys.path.append('../')
+from support import StorageTestCase
 from app import app
 from routes.scanner import scan_receipt
 
-class ScanReceiptTestCase(unittest.TestCase):
+class ScanReceiptTestCase(StorageTestCase):
     def setUp(self):
         # Set up the test client
         self.app = app
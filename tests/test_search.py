@@ -0,0 +1,103 @@
+import unittest
+import sys
+from datetime import datetime
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.search import connect_to_db
+from utils.indexes import ensure_indexes
+from utils.scoping import DEFAULT_USER_ID
+from utils.storage import STORAGE_BACKEND
+
+class TestSearch(StorageTestCase):
+    """Test cases for full-text search and autocomplete"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_expense = self.db['expense']
+        self.collection_income = self.db['income']
+        self.collection_wallet = self.db['wallet']
+        ensure_indexes(self.db)
+        self.wallet_id = str(ObjectId())
+        self.collection_wallet.insert_one({"wallet_id": self.wallet_id, "user_id": DEFAULT_USER_ID, "balance": 1000.00})
+        self.collection_expense.insert_many([
+            {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": 12.50, "date": datetime(2026, 1, 3),
+             "category": "Dining", "description": "Lunch at McDonald's"},
+            {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": 9.00, "date": datetime(2026, 1, 2),
+             "category": "Dining", "description": "Lunch at McDonald's"},
+            {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": 40.00, "date": datetime(2026, 1, 1),
+             "category": "Transport", "description": "Paid Gas"},
+            {"user_id": "someone-else", "wallet_id": "B1", "amount": 5.00, "date": datetime(2026, 1, 1),
+             "category": "Dining", "description": "Lunch at Subway"},
+        ])
+        self.collection_income.insert_one(
+            {"user_id": DEFAULT_USER_ID, "wallet_id": self.wallet_id, "amount": 3000.00, "date": datetime(2026, 1, 1),
+             "source": "Salary", "description": "Lunch allowance"})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_expense.delete_many({})
+        self.collection_income.delete_many({})
+        self.collection_wallet.delete_many({})
+
+    @unittest.skipIf(STORAGE_BACKEND == 'memory', 'the in-memory backend has no text search')
+    def test_search(self):
+        """It should return the user's matching incomes and expenses, paginated"""
+        response = self.app.get('/search?q=lunch&per_page=2')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(len(body["results"]), 2)
+        self.assertTrue(body["has_more"])
+        response = self.app.get('/search?q=lunch&per_page=2&page=2')
+        body = response.get_json()
+        self.assertEqual(len(body["results"]), 1)
+        self.assertFalse(body["has_more"])
+        # Other users' documents are never returned
+        response = self.app.get('/search?q=subway')
+        self.assertEqual(response.get_json()["results"], [])
+
+    def test_search_bad_arguments(self):
+        """It should reject an empty query and out-of-range pages"""
+        self.assertEqual(self.app.get('/search').status_code, 400)
+        self.assertEqual(self.app.get('/search?q=lunch&page=0').status_code, 400)
+        self.assertEqual(self.app.get('/search?q=lunch&per_page=1000').status_code, 400)
+
+    def test_autocomplete(self):
+        """It should suggest the user's most used descriptions for a prefix"""
+        response = self.app.get('/search/autocomplete?prefix=lu')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["suggestions"], ["Lunch at McDonald's", "Lunch allowance"])
+        # A new expense is suggested without reloading the index
+        response = self.app.post('/expense', json={"amount": 3.00, "date": "2026-01-04", "category": "Dining",
+                                                   "description": "Lunch box", "wallet_id": self.wallet_id})
+        self.assertEqual(response.status_code, 201)
+        response = self.app.get('/search/autocomplete?prefix=LUNCH%20B')
+        self.assertEqual(response.get_json()["suggestions"], ["Lunch box"])
+
+    def test_autocomplete_follows_edits(self):
+        """It should count a description once per transaction, however often it is edited"""
+        self.assertEqual(self.app.get('/search/autocomplete?prefix=lu').get_json()["suggestions"],
+                         ["Lunch at McDonald's", "Lunch allowance"])
+        income_id = str(self.collection_income.find_one()["_id"])
+        for amount in (3100.00, 3200.00):
+            response = self.app.put(f'/income/{income_id}', json={"wallet_id": self.wallet_id, "amount": amount,
+                                    "date": "2026-01-01", "source": "Salary", "description": "Lunch allowance"})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/search/autocomplete?prefix=lu').get_json()["suggestions"],
+                         ["Lunch at McDonald's", "Lunch allowance"])
+        # Renaming both uses of a description drops it
+        for expense in self.collection_expense.find({"description": "Lunch at McDonald's"}):
+            response = self.app.put(f'/expense/{expense["_id"]}', json={"wallet_id": self.wallet_id,
+                                    "amount": expense["amount"], "date": "2026-01-03", "category": "Dining",
+                                    "description": "Lunch at Burger King"})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.get('/search/autocomplete?prefix=lu').get_json()["suggestions"],
+                         ["Lunch at Burger King", "Lunch allowance"])
+        # A deleted transaction no longer counts
+        self.app.delete(f'/income/{income_id}')
+        self.assertEqual(self.app.get('/search/autocomplete?prefix=lunch%20al').get_json()["suggestions"], [])
@@ -0,0 +1,128 @@
+import unittest
+import sys
+from datetime import datetime, timedelta
+from unittest import mock
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes import sync as sync_route
+from routes.sync import connect_to_db
+from utils.sync import make_token, parse_token, modified_now
+from utils.archive import archive_collection
+
+class TestSync(StorageTestCase):
+    """Test cases for the delta sync"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.budget_id = ObjectId()
+        self.wallet_id = ObjectId()
+        self.db['budget'].insert_one({"_id": self.budget_id, "name": "Home", "user_id": "alice", "modified_at": modified_now()})
+        self.db['wallet'].insert_one({"_id": self.wallet_id, "wallet_id": str(self.wallet_id), "budget_id": str(self.budget_id),
+                                      "balance": 500.00, "user_id": "alice", "modified_at": modified_now()})
+        self.db['wallet'].insert_one({"wallet_id": "other", "balance": 1.00, "user_id": "bob", "modified_at": modified_now()})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+        self.headers = {"X-User-Id": "alice"}
+
+    def sync(self, token=None):
+        response = self.app.get('/sync', query_string={"since": token} if token else {}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def post_income(self, amount, date=None):
+        response = self.app.post('/income', headers=self.headers,
+                                 json={"wallet_id": str(self.wallet_id), "amount": amount, "source": "Salary",
+                                       "description": "Pay", "date": (date or datetime.now()).isoformat()})
+        self.assertEqual(response.status_code, 201)
+
+    def test_token_round_trip(self):
+        """It should encode a moment in an opaque token and reject anything else"""
+        moment = modified_now()
+        self.assertEqual(parse_token(make_token(moment)), moment)
+        for token in ('garbage', 'djE6YWJj', 'djI6MTIz'):
+            with self.assertRaises(ValueError):
+                parse_token(token)
+
+    def test_initial_sync(self):
+        """It should return a full snapshot of the user's documents without a token"""
+        self.post_income(10.00)
+        result = self.sync()
+        self.assertTrue(result["reset"])
+        self.assertEqual([budget["_id"] for budget in result["changes"]["budget"]], [str(self.budget_id)])
+        self.assertEqual([wallet["_id"] for wallet in result["changes"]["wallet"]], [str(self.wallet_id)])
+        self.assertEqual([income["amount"] for income in result["changes"]["income"]], [10.00])
+        self.assertNotIn("user_id", result["changes"]["wallet"][0])
+
+    def test_changes_since_token(self):
+        """It should only return what changed after the token"""
+        # Move the documents of setUp out of the overlap window
+        self.db['budget'].update_many({}, {"$set": {"modified_at": modified_now() - timedelta(minutes=1)}})
+        self.db['wallet'].update_many({}, {"$set": {"modified_at": modified_now() - timedelta(minutes=1)}})
+        token = self.sync()["token"]
+        self.post_income(25.00)
+        result = self.sync(token)
+        self.assertFalse(result["reset"])
+        self.assertEqual(result["changes"]["budget"], [])
+        self.assertEqual([income["amount"] for income in result["changes"]["income"]], [25.00])
+        # Posting an income moves the wallet's balance
+        self.assertEqual([wallet["balance"] for wallet in result["changes"]["wallet"]], [525.00])
+
+    def test_deleted_income_leaves_tombstone(self):
+        """It should report a deleted income by its id"""
+        self.post_income(10.00)
+        income_id = self.sync()["changes"]["income"][0]["_id"]
+        token = make_token(modified_now() - timedelta(seconds=1))
+        response = self.app.delete(f'/income/{income_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        result = self.sync(token)
+        self.assertEqual(result["deleted"]["income"], [income_id])
+
+    def test_cascade_delete_leaves_tombstones(self):
+        """It should report the wallets, incomes and expenses deleted with a budget"""
+        self.post_income(10.00)
+        income_id = self.sync()["changes"]["income"][0]["_id"]
+        token = make_token(modified_now() - timedelta(seconds=1))
+        response = self.app.delete(f'/budget/{self.budget_id}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["wallets_deleted"], 1)
+        deleted = self.sync(token)["deleted"]
+        self.assertEqual(deleted["budget"], [str(self.budget_id)])
+        self.assertEqual(deleted["wallet"], [str(self.wallet_id)])
+        self.assertEqual(deleted["income"], [income_id])
+
+    def test_expired_token_resets(self):
+        """It should send a full snapshot when the tombstones of a token have expired"""
+        result = self.sync(make_token(modified_now() - timedelta(days=365)))
+        self.assertTrue(result["reset"])
+        self.assertEqual(len(result["changes"]["wallet"]), 1)
+
+    def test_snapshot_includes_archive(self):
+        """It should include archived transactions in a full snapshot"""
+        self.post_income(10.00, datetime(2024, 1, 15))
+        self.post_income(20.00)
+        archive_collection(self.db, 'income', datetime(2025, 1, 1))
+        self.assertEqual(sorted(income["amount"] for income in self.sync()["changes"]["income"]), [10.00, 20.00])
+
+    def test_too_many_changes_resets(self):
+        """It should send a full snapshot instead of more than SYNC_MAX_CHANGES changes"""
+        token = make_token(modified_now() - timedelta(seconds=1))
+        self.post_income(10.00)
+        self.post_income(20.00)
+        with mock.patch.object(sync_route, 'SYNC_MAX_CHANGES', 1):
+            result = self.sync(token)
+        self.assertTrue(result["reset"])
+        self.assertEqual(len(result["changes"]["income"]), 2)
+        with mock.patch.object(sync_route, 'SYNC_MAX_CHANGES', 2):
+            self.assertFalse(self.sync(token)["reset"])
+
+    def test_invalid_token(self):
+        """It should reject a token it did not issue"""
+        response = self.app.get('/sync?since=not-a-token', headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+from flask import Flask, jsonify
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+import utils.tracing
+from utils.tracing import configure_tracing, init_tracing
+
+class TestTracing(StorageTestCase):
+    """Test cases for request tracing and on-demand profiling"""
+    def setUp(self):
+        # Collect the spans in memory instead of exporting them
+        self.exporter = InMemorySpanExporter()
+        self.provider = configure_tracing(self.exporter)
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        utils.tracing.tracer = None
+
+    def test_request_spans(self):
+        """It should trace a request with a child span for JSON encoding"""
+        response = self.app.get('/expense')
+        self.assertEqual(response.status_code, 200)
+        self.provider.force_flush()
+        spans = {span.name: span for span in self.exporter.get_finished_spans()}
+        self.assertIn('GET /expense', spans)
+        self.assertEqual(spans['GET /expense'].attributes["http.status_code"], 200)
+        # JSON encoding is a child of the request span
+        self.assertEqual(spans['json.encode'].parent.span_id, spans['GET /expense'].context.span_id)
+
+    def test_profile_on_demand(self):
+        """It should profile only the requests that send the profiling token"""
+        profile_dir = tempfile.mkdtemp()
+        with mock.patch.object(utils.tracing, 'PROFILE_TOKEN', 'secret'), \
+                mock.patch.object(utils.tracing, 'PROFILE_DIR', profile_dir):
+            profiled_app = Flask(__name__)
+            init_tracing(profiled_app)
+            profiled_app.add_url_rule('/ping', 'ping', lambda: jsonify({"pong": True}))
+            client = profiled_app.test_client()
+            self.assertNotIn('X-Profile-Path', client.get('/ping').headers)
+            self.assertNotIn('X-Profile-Path', client.get('/ping', headers={'X-Profile': 'wrong'}).headers)
+            response = client.get('/ping', headers={'X-Profile': 'secret'})
+        self.assertTrue(os.path.exists(response.headers['X-Profile-Path']))
@@ -0,0 +1,85 @@
+import unittest
+import sys
+from datetime import datetime
+from unittest import mock
+from bson import ObjectId
+
+# Add parent directory to Python path
+sys.path.append('../')
+from support import StorageTestCase
+from app import app
+from routes.transfer import connect_to_db
+from routes import transfer
+from utils import storage
+from utils.routing import TransactionsUnavailable
+from utils.idempotency import response_cache, IDEMPOTENCY_COLLECTION
+
+class TestTransfer(StorageTestCase):
+    """Test cases for transfers between wallets"""
+    def setUp(self):
+        # Create a connection to MongoDB Atlas
+        self.client, self.db = connect_to_db()
+        self.collection_wallet = self.db['wallet']
+        self.collection_expense = self.db['expense']
+        self.collection_income = self.db['income']
+        self.from_wallet_id = str(ObjectId())
+        self.to_wallet_id = str(ObjectId())
+        for wallet_id, balance in ((self.from_wallet_id, 500.00), (self.to_wallet_id, 100.00)):
+            self.collection_wallet.insert_one({"wallet_id": wallet_id, "balance": balance,
+                                               "created_at": datetime.now(), "updated_at": datetime.now(),
+                                               "type": "Savings", "target": 1000.00})
+        # Initialize test client to simulate requests to Flask App
+        self.app = app.test_client()
+
+    def tearDown(self):
+        # Clean up all resources in database
+        self.collection_wallet.delete_many({})
+        self.collection_expense.delete_many({})
+        self.collection_income.delete_many({})
+        self.db[IDEMPOTENCY_COLLECTION].delete_many({})
+        response_cache.clear()
+
+    def test_transfer(self):
+        """It should move the amount, record both legs and return both balances"""
+        response = self.app.post('/transfer', json={"from_wallet_id": self.from_wallet_id, "to_wallet_id": self.to_wallet_id,
+                                                    "amount": 150.00, "date": "2026-10-01", "description": "Savings"})
+        self.assertEqual(response.status_code, 201)
+        body = response.get_json()
+        self.assertEqual(body["balances"], {self.from_wallet_id: 350.00, self.to_wallet_id: 250.00})
+        expense = self.collection_expense.find_one({"_id": ObjectId(body["expense_id"])})
+        income = self.collection_income.find_one({"_id": ObjectId(body["income_id"])})
+        self.assertEqual((expense["wallet_id"], expense["amount"], expense["category"]), (self.from_wallet_id, 150.00, "Transfer"))
+        self.assertEqual((income["wallet_id"], income["amount"], income["source"]), (self.to_wallet_id, 150.00, "Transfer"))
+        self.assertEqual(expense["transfer_id"], income["transfer_id"])
+        self.assertEqual(expense["date"], datetime(2026, 10, 1))
+
+    def test_transfer_to_missing_wallet(self):
+        """It should write nothing when a wallet does not exist"""
+        response = self.app.post('/transfer', json={"from_wallet_id": self.from_wallet_id, "to_wallet_id": str(ObjectId()),
+                                                    "amount": 10.00})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.collection_wallet.find_one({"wallet_id": self.from_wallet_id})["balance"], 500.00)
+        self.assertEqual(self.collection_expense.count_documents({}), 0)
+        self.assertEqual(self.collection_income.count_documents({}), 0)
+
+    def test_fallback_records_legs_first(self):
+        """It should have recorded both legs when the balance update of the fallback fails"""
+        # Force the fallback, as on a standalone server
+        with mock.patch.object(transfer, 'in_transaction', side_effect=TransactionsUnavailable()), \
+                mock.patch.object(storage, 'update_each', side_effect=RuntimeError('connection lost')), \
+                mock.patch.dict(app.config, {"PROPAGATE_EXCEPTIONS": True}):
+            with self.assertRaises(RuntimeError):
+                self.app.post('/transfer', json={"from_wallet_id": self.from_wallet_id,
+                                                 "to_wallet_id": self.to_wallet_id, "amount": 10.00})
+        # reconcile_balances can recompute the balances from the legs
+        self.assertEqual(self.collection_expense.count_documents({"wallet_id": self.from_wallet_id}), 1)
+        self.assertEqual(self.collection_income.count_documents({"wallet_id": self.to_wallet_id}), 1)
+
+    def test_invalid_transfer(self):
+        """It should reject a transfer to the same wallet or of a non-positive amount"""
+        response = self.app.post('/transfer', json={"from_wallet_id": self.from_wallet_id, "to_wallet_id": self.from_wallet_id,
+                                                    "amount": 10.00})
+        self.assertEqual(response.status_code, 400)
+        response = self.app.post('/transfer', json={"from_wallet_id": self.from_wallet_id, "to_wallet_id": self.to_wallet_id,
+                                                    "amount": 0})
+        self.assertEqual(response.status_code, 400)
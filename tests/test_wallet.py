@@ -8,10 +8,11 @@ from datetime import datetime, timedelta
 
 # Add parent directory to Python path
 sys.path.append('../')
+from support import StorageTestCase
 from app import app
 from routes.wallet import connect_to_db, add_wallet, list_wallets, update_wallet, delete_wallet
 
-class TestWallet(unittest.TestCase):
+class TestWallet(StorageTestCase):
     """Test case for handling wallet"""
     def setUp(self):
         # Create a connection to MongoDB atlas
@@ -67,8 +68,9 @@ class TestWallet(unittest.TestCase):
         self.assertIsNotNone(wallet_from_database)
         # Assert that the details are accurate
         self.assertEqual(wallet_from_database["balance"], test_wallet["balance"])
-        self.assertAlmostEqual(wallet_from_database["created_at"], test_wallet["created_at"], delta=timedelta(seconds=1))
-        self.assertAlmostEqual(wallet_from_database["updated_at"], test_wallet["updated_at"], delta=timedelta(seconds=1))
+        # Dates are stored as BSON dates, not as the ISO strings that were sent
+        self.assertAlmostEqual(wallet_from_database["created_at"], datetime.fromisoformat(test_wallet["created_at"]), delta=timedelta(seconds=1))
+        self.assertAlmostEqual(wallet_from_database["updated_at"], datetime.fromisoformat(test_wallet["updated_at"]), delta=timedelta(seconds=1))
         self.assertEqual(wallet_from_database["type"], test_wallet["type"])
         self.assertEqual(wallet_from_database["target"], test_wallet["target"])
     
@@ -159,11 +161,47 @@ class TestWallet(unittest.TestCase):
             # Assert that the balance is accurately updated
             self.assertEqual(updated_wallet["balance"], update_wallet["balance"])
             # Assert that the modification date of wallet is updated
-            self.assertAlmostEqual(updated_wallet["updated_at"], update_wallet["updated_at"], delta=timedelta(seconds=1))
+            self.assertAlmostEqual(updated_wallet["updated_at"], datetime.fromisoformat(update_wallet["updated_at"]), delta=timedelta(seconds=1))
         else:
             # Raise an error if wallet was not inserted
             self.fail("Failed to insert wallet into database")
             
+    def test_delete_added_wallet(self):
+        """It should delete a wallet added through POST /wallet, with its incomes and expenses"""
+        test_wallet = {
+            "name": "Account 2",
+            "balance": 100.00,
+            "budget_id": str(self.budget_id),
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+            "type": "Savings",
+            "target": 1000.00
+        }
+        self.assertEqual(self.app.post('/wallet', json=test_wallet).status_code, 201)
+        wallet_id = self.collection_wallet.find_one({"name": "Account 2"})["wallet_id"]
+        self.db['income'].insert_one({"wallet_id": wallet_id, "amount": 5.00})
+        # Delete the wallet by the id clients get from GET /wallet
+        response = self.app.delete(f'/wallet/{wallet_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["incomes_deleted"], 1)
+        self.assertIsNone(self.collection_wallet.find_one({"wallet_id": wallet_id}))
+
+    def test_add_wallet_rejects_server_fields(self):
+        """It should not let a client choose the wallet_id or opening_balance of a new wallet"""
+        test_wallet = {
+            "name": "Account 3",
+            "balance": 100.00,
+            "budget_id": str(self.budget_id),
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+            "type": "Savings",
+            "target": 1000.00
+        }
+        for field, value in (("wallet_id", "A1"), ("opening_balance", 1000000.00)):
+            response = self.app.post('/wallet', json={**test_wallet, field: value})
+            self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.collection_wallet.find_one({"name": "Account 3"}))
+
     def test_delete_wallet(self):
         """It should delete a wallet"""
         test_wallet = {
@@ -0,0 +1,160 @@
+"""Admission control and load shedding.
+
+Every request is sorted into a route class: cheap reads, writes, and expensive
+operations such as `/scan-receipt` and cascade deletes. Before any MongoDB work starts:
+
+- each client (the scoped user, else the X-API-Key header, else its address) draws from
+  its own token bucket for that class, and gets a fast 429 with Retry-After once the bucket is empty;
+- each class has a maximum number of requests in flight, and gets a fast 503 once the
+  worker pool is saturated, so queues and tail latency stay bounded under overload.
+
+Rates, bursts and concurrency limits can be tuned per class with environment variables,
+e.g. ADMISSION_READ_RATE=20 ADMISSION_READ_BURST=40 ADMISSION_READ_CONCURRENCY=32.
+"""
+from flask import request, g, jsonify
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+from utils.scoping import USER_HEADER
+
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') == '1'
+API_KEY_HEADER = 'X-API-Key'
+# Buckets of clients that have been idle the longest are forgotten beyond this many
+MAX_TRACKED_CLIENTS = int(os.getenv('ADMISSION_MAX_CLIENTS', '100000'))
+
+# Endpoints that call Document AI or delete a whole tree of documents
+EXPENSIVE_ENDPOINTS = {
+    'scanner.scan_receipt',
+    'budget.update_budget',
+    'budget.delete_budget',
+    'wallet.delete_wallet',
+}
+# Long-lived streams hold a worker on purpose and are not counted as in flight
+STREAMING_ENDPOINTS = {'events.stream_events'}
+# Probes must keep answering under load, or the orchestrator restarts a busy worker.
+# A batch is admitted sub-request by sub-request instead.
+EXEMPT_ENDPOINTS = {'health.healthz', 'health.readyz', 'batch.run_batch'}
+
+def class_limits(route_class, rate, burst, concurrency):
+    prefix = f'ADMISSION_{route_class.upper()}_'
+    return {
+        "rate": float(os.getenv(prefix + 'RATE', rate)),
+        "burst": float(os.getenv(prefix + 'BURST', burst)),
+        "concurrency": int(os.getenv(prefix + 'CONCURRENCY', concurrency)),
+    }
+
+LIMITS = {
+    "read": class_limits('read', 20, 40, 32),
+    "write": class_limits('write', 5, 10, 16),
+    "expensive": class_limits('expensive', 0.5, 2, 4),
+}
+
+class TokenBucket:
+    """Allow `rate` requests per second on average with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self):
+        """Take a token; return 0 on success or the seconds to wait until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class AdmissionController:
+    """Token buckets per (client, route class) and in-flight counters per route class"""
+
+    def __init__(self, limits=LIMITS, max_clients=MAX_TRACKED_CLIENTS):
+        self.limits = limits
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self.in_flight = {route_class: 0 for route_class in limits}
+        self.rejected = {route_class: {"throttled": 0, "shed": 0} for route_class in limits}
+
+    def acquire(self, client, route_class, count_in_flight=True):
+        """Admit a request; return None, or (status code, seconds to retry after) to reject it"""
+        limits = self.limits[route_class]
+        with self._lock:
+            key = (client, route_class)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(limits["rate"], limits["burst"])
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take()
+            if wait:
+                self.rejected[route_class]["throttled"] += 1
+                return 429, wait
+            if count_in_flight:
+                if self.in_flight[route_class] >= limits["concurrency"]:
+                    # Give the token back: the client was not at fault
+                    bucket.tokens += 1
+                    self.rejected[route_class]["shed"] += 1
+                    return 503, 1
+                self.in_flight[route_class] += 1
+        return None
+
+    def release(self, route_class):
+        with self._lock:
+            self.in_flight[route_class] -= 1
+
+controller = AdmissionController()
+
+def route_class_of(endpoint, method):
+    """Sort a request into the read, write or expensive route class"""
+    if endpoint in EXPENSIVE_ENDPOINTS:
+        return "expensive"
+    if method in ('GET', 'HEAD'):
+        return "read"
+    return "write"
+
+def client_of():
+    """Identify the client by its scoped user, then its API key, falling back to its address"""
+    # Behind the gateway every request comes from the gateway's address
+    if request.headers.get(USER_HEADER):
+        return f'user:{request.headers[USER_HEADER]}'
+    if request.headers.get(API_KEY_HEADER):
+        return f'key:{request.headers[API_KEY_HEADER]}'
+    return f'address:{request.remote_addr}'
+
+def admit_request():
+    """before_request hook: reject the request early when its client or class is over budget"""
+    if request.method == 'OPTIONS' or request.endpoint is None or request.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    route_class = route_class_of(request.endpoint, request.method)
+    counted = request.endpoint not in STREAMING_ENDPOINTS
+    rejection = controller.acquire(client_of(), route_class, counted)
+    if rejection is not None:
+        status, wait = rejection
+        message = "Too many requests, please slow down" if status == 429 else "Server is busy, please retry"
+        response = jsonify({"error": message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+        return response
+    if counted:
+        g.admitted_class = route_class
+    return None
+
+def release_request(exception=None):
+    """teardown_request hook: free the in-flight slot of an admitted request"""
+    route_class = g.pop('admitted_class', None)
+    if route_class is not None:
+        controller.release(route_class)
+
+def init_admission(app):
+    """Install admission control on the app"""
+    if ADMISSION_ENABLED:
+        app.before_request(admit_request)
+        app.teardown_request(release_request)
@@ -0,0 +1,172 @@
+"""Cold-data archive of incomes and expenses.
+
+Transactions older than ARCHIVE_AFTER_DAYS are moved out of the hot `expense`/`income`
+collections into `expense_archive`/`income_archive`, with one document per user, wallet
+and month. Each archive document holds the month's transactions as zlib-compressed
+BSON, next to uncompressed rollups (count, total, and totals per category or source).
+Reports can read the rollups without decompressing anything.
+
+Moving a month is idempotent. Transactions are merged into the archive document by
+`_id` before they are deleted from the hot collection, so a run that is interrupted
+between the two steps can simply be run again.
+
+List endpoints reach into the archive only when they are asked for a date range:
+`find_transactions` merges hot and archived transactions for that range. Reports such as
+the forecast and the dashboard read the rollups of the archived months instead, with
+`archived_rollups`. Archived
+transactions are read-only: an archive document lists the `transaction_ids` it holds,
+so the single-transaction handlers can answer 410 for them. Deleting a wallet or budget
+deletes its archive documents too.
+"""
+import bson
+import datetime
+import os
+import zlib
+from bson.binary import Binary
+from utils.scoping import scoped
+from utils.dates import utc_now
+from utils.buckets import transactions as transaction_collection
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_COLLECTIONS = {"expense": "expense_archive", "income": "income_archive"}
+# The field each collection is broken down by in the rollups
+ROLLUP_FIELDS = {"expense": "category", "income": "source"}
+
+def month_start(date):
+    return datetime.datetime(date.year, date.month, 1)
+
+def next_month(month):
+    return datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def compress(transactions):
+    return Binary(zlib.compress(bson.encode({"transactions": transactions}), 6))
+
+def decompress(data):
+    return bson.decode(zlib.decompress(data))["transactions"]
+
+def bucket_id(user_id, wallet_id, month):
+    return f'{user_id}:{wallet_id}:{month:%Y-%m}'
+
+def rollups(name, transactions):
+    """Count and total the transactions of a bucket, overall and per category or source.
+
+    Transfer legs count in the overall total, but not in the breakdown: they are
+    counted apart, so reports that leave transfers out can subtract them.
+    """
+    field = ROLLUP_FIELDS[name]
+    breakdown = {}
+    total = 0
+    transfers = {"count": 0, "total": 0}
+    for transaction in transactions:
+        amount = transaction.get("amount") or 0
+        total += amount
+        if transaction.get("transfer_id") is not None:
+            transfers["count"] += 1
+            transfers["total"] = round(transfers["total"] + amount, 2)
+            continue
+        key = str(transaction.get(field) or 'Uncategorized').replace('.', '_').lstrip('$')
+        breakdown[key] = breakdown.get(key, 0) + amount
+    return {"count": len(transactions), "total": round(total, 2), f'by_{field}': breakdown, "transfers": transfers}
+
+def archive_bucket(db, name, user_id, wallet_id, month, cutoff):
+    """Move the transactions of one user, wallet and month older than cutoff; return how many moved"""
+    hot = transaction_collection(db, name)
+    archive = db[ARCHIVE_COLLECTIONS[name]]
+    query = {"user_id": user_id, "wallet_id": wallet_id,
+             "date": {"$gte": month, "$lt": min(next_month(month), cutoff)}}
+    moving = list(hot.find(query))
+    if not moving:
+        return 0
+    _id = bucket_id(user_id, wallet_id, month)
+    existing = archive.find_one({"user_id": user_id, "_id": _id}, {"data": 1})
+    merged = {transaction["_id"]: transaction for transaction in (decompress(existing["data"]) if existing else [])}
+    merged.update((transaction["_id"], transaction) for transaction in moving)
+    transactions = sorted(merged.values(), key=lambda transaction: transaction["date"])
+    # The owner makes the filter hold the whole shard key, which a sharded upsert needs
+    archive.replace_one({"user_id": user_id, "_id": _id}, {
+        "user_id": user_id,
+        "wallet_id": wallet_id,
+        "month": month,
+        **rollups(name, transactions),
+        "transaction_ids": [transaction["_id"] for transaction in transactions],
+        "data": compress(transactions),
+        "archived_at": utc_now(),
+    }, upsert=True)
+    # Only delete once the archive holds the transactions
+    hot.delete_many({"user_id": user_id, "_id": {"$in": [transaction["_id"] for transaction in moving]}})
+    return len(moving)
+
+def archive_collection(db, name, cutoff, dry_run=False, progress=None):
+    """Archive every transaction of a collection dated before cutoff; return a summary"""
+    pipeline = [
+        {"$match": {"date": {"$lt": cutoff}}},
+        {"$group": {"_id": {"user_id": "$user_id", "wallet_id": "$wallet_id",
+                            "year": {"$year": "$date"}, "month": {"$month": "$date"}},
+                    "count": {"$sum": 1}}},
+    ]
+    summary = {"buckets": 0, "moved": 0}
+    for row in transaction_collection(db, name).aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        month = datetime.datetime(key["year"], key["month"], 1)
+        if dry_run:
+            moved = row["count"]
+        else:
+            moved = archive_bucket(db, name, key.get("user_id"), key.get("wallet_id"), month, cutoff)
+        summary["buckets"] += 1
+        summary["moved"] += moved
+        if progress is not None:
+            progress(name, key, month, moved)
+    return summary
+
+def is_archived(db, name, _id):
+    """Return whether a transaction of the current user has been moved to the archive"""
+    return db[ARCHIVE_COLLECTIONS[name]].count_documents(scoped({"transaction_ids": _id}), limit=1) > 0
+
+def delete_archived(db, name, query):
+    """Delete the archive documents matching an owner and wallet query; return the ids of their transactions"""
+    archive = db[ARCHIVE_COLLECTIONS[name]]
+    ids = []
+    for bucket in archive.find(query, {"data": 1}):
+        # Only count a document this call deleted, in case two deletes race
+        if archive.delete_one({**query, "_id": bucket["_id"]}).deleted_count:
+            ids.extend(transaction["_id"] for transaction in decompress(bucket["data"]))
+    return ids
+
+def archived_rollups(db, name, user_id, start, end, query=None):
+    """Return the rollups of a user's archive documents for the months in [start, end), without decompressing anything"""
+    bucket_query = scoped({**(query or {}), "month": {"$gte": month_start(start), "$lt": end}}, user_id)
+    projection = {"wallet_id": 1, "month": 1, "count": 1, "total": 1, f'by_{ROLLUP_FIELDS[name]}': 1, "transfers": 1}
+    return list(db[ARCHIVE_COLLECTIONS[name]].find(bucket_query, projection))
+
+def archived_transactions(db, name, start=None, end=None, query=None):
+    """Yield the archived transactions of the current user dated in [start, end)"""
+    months = {}
+    if start is not None:
+        months["$gte"] = month_start(start)
+    if end is not None:
+        months["$lt"] = end
+    bucket_query = scoped(dict(query or {}))
+    if months:
+        bucket_query["month"] = months
+    for bucket in db[ARCHIVE_COLLECTIONS[name]].find(bucket_query, {"data": 1}):
+        for transaction in decompress(bucket["data"]):
+            date = transaction.get("date")
+            if (start is None or date >= start) and (end is None or date < end):
+                yield transaction
+
+def find_transactions(db, name, start=None, end=None, query=None):
+    """Return the hot and archived transactions of the current user dated in [start, end)"""
+    hot_query = scoped(dict(query or {}))
+    dates = {}
+    if start is not None:
+        dates["$gte"] = start
+    if end is not None:
+        dates["$lt"] = end
+    if dates:
+        hot_query["date"] = dates
+    transactions = list(transaction_collection(db, name).find(hot_query))
+    seen = {transaction["_id"] for transaction in transactions}
+    # A transaction caught between the two steps of a move is in both places
+    transactions.extend(transaction for transaction in archived_transactions(db, name, start, end, query)
+                        if transaction["_id"] not in seen)
+    return transactions
@@ -0,0 +1,113 @@
+"""Prefix autocomplete over the descriptions of each user's incomes and expenses.
+
+The first lookup for a user loads their distinct descriptions, with how often each is
+used, into a sorted in-memory list. A prefix is then a binary search plus a short scan,
+well under a millisecond. The counts follow the `expense.*`/`income.*` events the
+handlers publish: a new transaction adds a use of its description, a deleted one removes
+it, and an edited description moves the use from the old text to the new. Indexes expire after AUTOCOMPLETE_TTL_SECONDS, so changes
+made by other workers are picked up too.
+"""
+from bisect import bisect_left, insort
+from utils.cache import TTLCache
+from utils.events import hub
+from utils.scoping import scoped
+from utils.buckets import transactions
+import os
+import threading
+
+AUTOCOMPLETE_MAX_USERS = int(os.getenv('AUTOCOMPLETE_MAX_USERS', '10000'))
+AUTOCOMPLETE_TTL_SECONDS = int(os.getenv('AUTOCOMPLETE_TTL_SECONDS', '600'))
+# Only the most used descriptions of a user are kept
+AUTOCOMPLETE_MAX_ENTRIES = int(os.getenv('AUTOCOMPLETE_MAX_ENTRIES', '5000'))
+AUTOCOMPLETE_COLLECTIONS = ['expense', 'income']
+
+class PrefixIndex:
+    """Distinct strings sorted by their case-folded form, with a use count each"""
+
+    def __init__(self, counts):
+        self._lock = threading.Lock()
+        self.counts = dict(counts)
+        self.keys = sorted((text.casefold(), text) for text in self.counts)
+
+    def add(self, text):
+        with self._lock:
+            if text in self.counts:
+                self.counts[text] += 1
+                return
+            if len(self.counts) >= AUTOCOMPLETE_MAX_ENTRIES:
+                return
+            self.counts[text] = 1
+            insort(self.keys, (text.casefold(), text))
+
+    def remove(self, text):
+        with self._lock:
+            if text not in self.counts:
+                return
+            self.counts[text] -= 1
+            if self.counts[text] <= 0:
+                del self.counts[text]
+                self.keys.pop(bisect_left(self.keys, (text.casefold(), text)))
+
+    def complete(self, prefix, limit=10):
+        """Return the most used strings starting with prefix, ignoring case"""
+        prefix = prefix.casefold()
+        with self._lock:
+            matches = []
+            for key, text in self.keys[bisect_left(self.keys, (prefix,)):]:
+                if not key.startswith(prefix):
+                    break
+                matches.append(text)
+            return sorted(matches, key=lambda text: (-self.counts[text], text.casefold()))[:limit]
+
+indexes = TTLCache(maxsize=AUTOCOMPLETE_MAX_USERS, ttl=AUTOCOMPLETE_TTL_SECONDS)
+
+def load_counts(db, user_id):
+    """Count the uses of every description of a user, most used first"""
+    counts = {}
+    for name in AUTOCOMPLETE_COLLECTIONS:
+        pipeline = [
+            {"$match": scoped({"description": {"$type": "string", "$ne": ""}}, user_id)},
+            {"$group": {"_id": "$description", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$limit": AUTOCOMPLETE_MAX_ENTRIES},
+        ]
+        for row in transactions(db, name).aggregate(pipeline):
+            counts[row["_id"]] = counts.get(row["_id"], 0) + row["count"]
+    most_used = sorted(counts.items(), key=lambda item: -item[1])[:AUTOCOMPLETE_MAX_ENTRIES]
+    return dict(most_used)
+
+def index_for(db, user_id):
+    index = indexes.get(user_id)
+    if index is None:
+        index = PrefixIndex(load_counts(db, user_id))
+        indexes.set(user_id, index)
+    return index
+
+def complete(db, user_id, prefix, limit=10):
+    return index_for(db, user_id).complete(prefix, limit)
+
+def is_description(value):
+    return isinstance(value, str) and value != ""
+
+def on_event(event):
+    """Count the description of a new, edited or deleted transaction in its owner's index, if loaded"""
+    collection, _, action = event["type"].partition('.')
+    index = indexes.get(event["user_id"])
+    if collection not in AUTOCOMPLETE_COLLECTIONS or index is None:
+        return
+    description = event["data"].get("description")
+    if action == 'created' and is_description(description):
+        index.add(description)
+    elif action == 'deleted' and is_description(description):
+        index.remove(description)
+    elif action == 'updated':
+        # Change stream events do not carry the previous version; the index catches up when it expires
+        previous = (event["data"].get("previous") or {}).get("description")
+        if "previous" not in event["data"] or previous == description:
+            return
+        if is_description(previous):
+            index.remove(previous)
+        if is_description(description):
+            index.add(description)
+
+hub.listen(on_event)
@@ -0,0 +1,145 @@
+"""Coalesced write-behind balance updates for hot wallets.
+
+With BALANCE_WRITE_BEHIND=1, `add_expense`/`add_income` no longer update the wallet
+document themselves. Their balance deltas are summed per wallet in memory, and every
+BALANCE_FLUSH_INTERVAL_MS a background thread applies them as one unordered
+`bulk_write` with a single `$inc` per wallet. Bursts on a shared wallet then cost one
+write instead of one per transaction.
+
+A flush first writes the deltas to the `balance_journal` collection, each under its own
+`_id`, and then applies them. The update of a wallet only matches while the wallet has not
+recorded that `_id` in `applied_journal` yet. A flush that fails halfway, even after the
+server applied some updates, leaves its entries in the journal. They are replayed on the
+next flush and when the app starts, and every delta is still applied exactly once. Pending
+deltas are also flushed when the process exits. A hard crash can lose at most one
+interval of deltas; `scripts/reconcile_balances.py` recomputes those balances.
+"""
+from utils.scoping import scoped, current_user_id
+from utils.events import hub, EVENTS_SOURCE
+from utils.sync import modified_now
+from utils.dates import utc_now
+from utils import storage
+from bson import ObjectId
+import atexit
+import os
+import signal
+import sys
+import threading
+
+BALANCE_WRITE_BEHIND = os.getenv('BALANCE_WRITE_BEHIND', '0') == '1'
+BALANCE_FLUSH_INTERVAL_MS = int(os.getenv('BALANCE_FLUSH_INTERVAL_MS', '200'))
+JOURNAL_COLLECTION = 'balance_journal'
+# Wallet documents remember the last journal entries they applied so a replay is idempotent
+APPLIED_JOURNAL_HISTORY = 100
+
+class BalanceBuffer:
+    """Sum balance deltas per wallet and flush them in bulk"""
+
+    def __init__(self, interval_ms=BALANCE_FLUSH_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.db = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._journal_dirty = True
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, db):
+        """Start the background flusher; pending journal entries are replayed first"""
+        self.db = db
+        self._thread = threading.Thread(target=self._run, name='balance-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        # Docker stops the container with SIGTERM; turn it into a normal exit so atexit runs
+        if threading.current_thread() is threading.main_thread() and \
+                signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    def stop(self):
+        """Stop the flusher and write out everything that is still pending"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 5)
+        self.flush()
+
+    def add(self, wallet_id, delta, user_id=None):
+        """Queue a balance change for a wallet of the current user"""
+        key = (user_id or current_user_id(), wallet_id)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + delta
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'ERROR: Balance flush failed: {e}')
+
+    def flush(self):
+        """Apply all pending deltas with one $inc per wallet and return how many wallets changed"""
+        if self.db is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            pending = {key: delta for key, delta in pending.items() if delta != 0}
+            entries = self._journal(pending) if pending else []
+            if entries is None:
+                return 0
+            try:
+                if self._journal_dirty:
+                    # Entries left by an earlier flush (or another process) go first; this read includes the new ones
+                    entries = list(self.db[JOURNAL_COLLECTION].find({}).sort("_id", 1))
+                self._apply(entries)
+                self._journal_dirty = False
+            except Exception as e:
+                print(f'ERROR: Balance flush failed, its deltas stay in the journal: {e}')
+                self._journal_dirty = True
+                return 0
+            # Outside the try: the balances are already written and must not be journaled again
+            self._publish_balances(pending)
+            return len(pending)
+
+    def _apply(self, entries):
+        """Apply journal entries to their wallets exactly once each, then remove them from the journal"""
+        if not entries:
+            return
+        now = utc_now()
+        updates = [
+            (scoped({"wallet_id": entry["wallet_id"], "applied_journal": {"$ne": entry["_id"]}}, entry["user_id"]),
+             {"$inc": {"balance": entry["delta"]},
+              "$set": {"updated_at": now, "modified_at": modified_now()},
+              "$push": {"applied_journal": {"$each": [entry["_id"]], "$slice": -APPLIED_JOURNAL_HISTORY}}})
+            for entry in entries
+        ]
+        storage.update_each(self.db['wallet'], updates, ordered=False)
+        self.db[JOURNAL_COLLECTION].delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+
+    def _publish_balances(self, pending):
+        # The flusher runs outside any request, so the events carry their owner explicitly
+        if EVENTS_SOURCE != 'handlers':
+            return
+        wallet_ids = list({wallet_id for _, wallet_id in pending})
+        for wallet in self.db['wallet'].find({"wallet_id": {"$in": wallet_ids}},
+                                             {"wallet_id": 1, "balance": 1, "user_id": 1}):
+            hub.publish('balance', {"wallet_id": wallet["wallet_id"], "balance": wallet["balance"]},
+                        wallet.get("user_id"))
+
+    def _journal(self, pending):
+        """Persist deltas before they are applied and return the entries; if even that fails,
+        keep them in memory and return None"""
+        entries = [{"_id": ObjectId(), "user_id": user_id, "wallet_id": wallet_id, "delta": delta,
+                    "created_at": utc_now()}
+                   for (user_id, wallet_id), delta in pending.items()]
+        try:
+            self.db[JOURNAL_COLLECTION].insert_many(entries, ordered=False)
+        except Exception as e:
+            print(f'ERROR: Balance journal unavailable, keeping deltas in memory: {e}')
+            with self._lock:
+                for key, delta in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + delta
+            return None
+        return entries
+
+balance_buffer = BalanceBuffer()
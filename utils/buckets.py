@@ -0,0 +1,276 @@
+"""Bucket-pattern storage of incomes and expenses.
+
+With TRANSACTION_LAYOUT=bucket, transactions are not stored one document each in
+`expense`/`income`. They are packed into `expense_buckets`/`income_buckets` instead:
+one document per user, wallet and month, holding an embedded `transactions` array plus
+its pre-computed `count` and `total`. A bucket holds at most BUCKET_MAX_TRANSACTIONS
+transactions; a busy month simply gets a second bucket. A range scan then reads a few
+buckets instead of thousands of documents, and the indexes hold one entry per bucket
+rather than one per transaction.
+
+`transactions(db, name)` returns the collection to use for a transaction type. In the
+default document layout that is the plain collection. In the bucket layout it is a
+BucketCollection, which offers the subset of the pymongo Collection API the handlers use
+(insert_one, find, find_one, find_one_and_update, find_one_and_delete, delete_many,
+count_documents, aggregate) and returns flat transactions, so the routes and their
+responses are the same in both layouts. Aggregations run over an unwound view of the
+buckets; the owner, wallet and date conditions of a leading $match are applied to the
+buckets first, so they still use the bucket indexes. Every bucket also carries the
+latest `modified_at` of its transactions, so the changes read by /sync skip untouched buckets.
+
+Move existing transactions into buckets with `python -m scripts.bucket_transactions`.
+"""
+import datetime
+import itertools
+import os
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.results import DeleteResult, InsertOneResult
+from utils.dates import utc_now
+
+TRANSACTION_LAYOUT = os.getenv('TRANSACTION_LAYOUT', 'document')
+BUCKET_MAX_TRANSACTIONS = int(os.getenv('BUCKET_MAX_TRANSACTIONS', '200'))
+BUCKET_COLLECTIONS = {"expense": "expense_buckets", "income": "income_buckets"}
+# Kept on the bucket rather than repeated in every embedded transaction
+BUCKET_FIELDS = ("user_id", "wallet_id")
+
+def month_start(date):
+    return datetime.datetime(date.year, date.month, 1)
+
+def flatten_stages(carry=()):
+    """Aggregation stages that turn buckets into one document per transaction, keeping `carry` bucket fields"""
+    return [
+        {"$unwind": "$transactions"},
+        {"$addFields": {f'transactions.{field}': f'${field}' for field in BUCKET_FIELDS + tuple(carry)}},
+        {"$replaceRoot": {"newRoot": "$transactions"}},
+    ]
+
+def bucket_filter(query):
+    """Translate the owner, wallet, _id, date and modified_at conditions of a transaction query to buckets"""
+    lifted = {}
+    for field, condition in (query or {}).items():
+        if field in BUCKET_FIELDS:
+            lifted[field] = condition
+        elif field == "_id":
+            lifted["transactions._id"] = condition
+        elif field == "date":
+            months = {}
+            if not isinstance(condition, dict):
+                condition = {"$gte": condition, "$lte": condition}
+            for operator, value in condition.items():
+                if operator in ("$gt", "$gte") and isinstance(value, datetime.datetime):
+                    months["$gte"] = month_start(value)
+                elif operator in ("$lt", "$lte") and isinstance(value, datetime.datetime):
+                    months[operator] = value
+            if months:
+                lifted["month"] = months
+        elif field == "modified_at" and isinstance(condition, dict):
+            # A bucket is modified at least as late as any of its transactions
+            since = {operator: value for operator, value in condition.items() if operator in ("$gt", "$gte")}
+            if since:
+                lifted["modified_at"] = since
+    return lifted
+
+def matches(document, query):
+    """Evaluate the simple equality/comparison queries of the handlers against one transaction"""
+    for field, condition in (query or {}).items():
+        value = document.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        for operator, operand in condition.items():
+            if operator == "$in":
+                ok = value in operand
+            elif operator == "$nin":
+                ok = value not in operand
+            elif operator == "$ne":
+                ok = value != operand
+            elif operator == "$exists":
+                ok = (field in document) == bool(operand)
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                try:
+                    ok = {"$gt": value > operand, "$gte": value >= operand,
+                          "$lt": value < operand, "$lte": value <= operand}[operator] if value is not None else False
+                except TypeError:
+                    ok = False
+            else:
+                raise ValueError(f'Unsupported operator in a bucketed query: {operator}')
+            if not ok:
+                return False
+    return True
+
+class BucketCollection:
+    """A transaction collection stored as per-wallet, per-month buckets"""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.bucket_name = BUCKET_COLLECTIONS[name]
+
+    @property
+    def buckets(self):
+        # Looked up on every call so the storage namespace of the current test is followed
+        return self.db[self.bucket_name]
+
+    def _flat(self, bucket):
+        for transaction in bucket.get("transactions", []):
+            yield {**transaction, **{field: bucket.get(field) for field in BUCKET_FIELDS}}
+
+    def _matching(self, query):
+        """Yield (bucket _id, transaction) for every transaction matching query"""
+        for bucket in self.buckets.find(bucket_filter(query)).sort([("month", 1), ("_id", 1)]):
+            for transaction in self._flat(bucket):
+                if matches(transaction, query):
+                    yield bucket["_id"], transaction
+
+    def _push(self, transaction):
+        embedded = {field: value for field, value in transaction.items() if field not in BUCKET_FIELDS}
+        update = {"$push": {"transactions": embedded},
+                  "$inc": {"count": 1, "total": transaction.get("amount") or 0}}
+        if transaction.get("modified_at") is not None:
+            update["$max"] = {"modified_at": transaction["modified_at"]}
+        # Fills the open bucket of the month, or starts a new one when it is full
+        self.buckets.update_one(
+            {"user_id": transaction.get("user_id"), "wallet_id": transaction.get("wallet_id"),
+             "month": month_start(transaction["date"]), "count": {"$lt": BUCKET_MAX_TRANSACTIONS}},
+            update, upsert=True)
+
+    def _pull(self, bucket_id, transactions):
+        """Remove transactions from a bucket; return how many were still there"""
+        ids = [transaction["_id"] for transaction in transactions]
+        result = self.buckets.update_one(
+            {"_id": bucket_id, "transactions._id": {"$all": ids}},
+            {"$pull": {"transactions": {"_id": {"$in": ids}}},
+             "$inc": {"count": - len(ids), "total": - sum(transaction.get("amount") or 0 for transaction in transactions)}})
+        self.buckets.delete_one({"_id": bucket_id, "count": {"$lte": 0}})
+        return len(ids) if result.modified_count else 0
+
+    def latest(self, query, limit):
+        """Return the `limit` most recent transactions matching query, reading the newest buckets first"""
+        found = []
+        month = None
+        for bucket in self.buckets.find(bucket_filter(query)).sort([("month", -1), ("_id", -1)]):
+            # Every bucket of a month may hold one of its latest transactions
+            if len(found) >= limit and bucket["month"] != month:
+                break
+            month = bucket["month"]
+            found.extend(transaction for transaction in self._flat(bucket) if matches(transaction, query))
+        return sorted(found, key=lambda transaction: transaction["date"], reverse=True)[:limit]
+
+    def insert_one(self, document):
+        document.setdefault("_id", ObjectId())
+        # The month of a bucket comes from the date; undated transactions go to the month they are added
+        document.setdefault("date", utc_now())
+        self._push(document)
+        return InsertOneResult(document["_id"], acknowledged=True)
+
+    def insert_many(self, documents):
+        """Insert transactions as new full buckets, one insert for the whole batch"""
+        groups = {}
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            document.setdefault("date", utc_now())
+            key = (document.get("user_id"), document.get("wallet_id"), month_start(document["date"]))
+            groups.setdefault(key, []).append(document)
+        new_buckets = []
+        for (user_id, wallet_id, month), group in groups.items():
+            for i in range(0, len(group), BUCKET_MAX_TRANSACTIONS):
+                chunk = group[i:i + BUCKET_MAX_TRANSACTIONS]
+                bucket = {
+                    "user_id": user_id,
+                    "wallet_id": wallet_id,
+                    "month": month,
+                    "count": len(chunk),
+                    "total": sum(document.get("amount") or 0 for document in chunk),
+                    "transactions": [{field: value for field, value in document.items() if field not in BUCKET_FIELDS}
+                                     for document in chunk],
+                }
+                modified = [document["modified_at"] for document in chunk if document.get("modified_at") is not None]
+                if modified:
+                    bucket["modified_at"] = max(modified)
+                new_buckets.append(bucket)
+        if new_buckets:
+            self.buckets.insert_many(new_buckets)
+        return [document["_id"] for document in documents]
+
+    def find(self, query=None, projection=None, limit=0):
+        # Projections are not applied; the handlers only ever read the fields they need
+        return [transaction for _, transaction in itertools.islice(self._matching(query), limit or None)]
+
+    def find_one(self, query=None, projection=None):
+        return next((transaction for _, transaction in self._matching(query)), None)
+
+    def count_documents(self, query=None):
+        return sum(1 for _ in self._matching(query))
+
+    def find_one_and_update(self, query, update, projection=None, return_document=ReturnDocument.BEFORE, **kwargs):
+        if set(update) != {"$set"}:
+            raise ValueError('Bucketed transactions only support $set updates')
+        found = next(self._matching(query), None)
+        if found is None:
+            return None
+        bucket_id, transaction = found
+        changes = update["$set"]
+        updated = {**transaction, **changes}
+        if (updated.get("wallet_id") != transaction.get("wallet_id")
+                or month_start(updated["date"]) != month_start(transaction["date"])):
+            # The transaction belongs to another bucket now
+            if not self._pull(bucket_id, [transaction]):
+                return None
+            self._push(updated)
+        else:
+            positional = {"$set": {f'transactions.$.{field}': value for field, value in changes.items()
+                                   if field not in BUCKET_FIELDS},
+                          "$inc": {"total": (updated.get("amount") or 0) - (transaction.get("amount") or 0)}}
+            if changes.get("modified_at") is not None:
+                positional["$max"] = {"modified_at": changes["modified_at"]}
+            result = self.buckets.update_one(
+                {"_id": bucket_id, "transactions._id": transaction["_id"]}, positional)
+            if not result.modified_count:
+                return None
+        return updated if return_document == ReturnDocument.AFTER else transaction
+
+    def find_one_and_delete(self, query, projection=None, **kwargs):
+        found = next(self._matching(query), None)
+        if found is None:
+            return None
+        bucket_id, transaction = found
+        return transaction if self._pull(bucket_id, [transaction]) else None
+
+    def delete_many(self, query):
+        if set(query) <= set(BUCKET_FIELDS):
+            # Whole buckets go at once, e.g. when a wallet is deleted
+            deleted = sum(bucket.get("count", 0) for bucket in self.buckets.find(query, {"count": 1}))
+            self.buckets.delete_many(query)
+            return DeleteResult({"n": deleted}, acknowledged=True)
+        by_bucket = {}
+        for bucket_id, transaction in self._matching(query):
+            by_bucket.setdefault(bucket_id, []).append(transaction)
+        deleted = sum(self._pull(bucket_id, transactions) for bucket_id, transactions in by_bucket.items())
+        return DeleteResult({"n": deleted}, acknowledged=True)
+
+    def aggregate(self, pipeline, **kwargs):
+        """Run a pipeline written for flat transactions over the buckets"""
+        stages = flatten_stages()
+        if pipeline and "$match" in pipeline[0]:
+            # Narrow the buckets with the same conditions before unwinding them
+            stages.insert(0, {"$match": bucket_filter(pipeline[0]["$match"])})
+        return self.buckets.aggregate(stages + list(pipeline), **kwargs)
+
+def collection_name(name, layout=None):
+    """Return the name of the collection that stores the incomes or expenses"""
+    return BUCKET_COLLECTIONS[name] if (layout or TRANSACTION_LAYOUT) == 'bucket' else name
+
+def transactions(db, name, layout=None):
+    """Return the collection holding the incomes or expenses in the configured layout"""
+    if (layout or TRANSACTION_LAYOUT) == 'bucket':
+        return BucketCollection(db, name)
+    return db[name]
+
+def latest_transactions(db, name, query, limit, projection=None):
+    """Return the `limit` most recent incomes or expenses matching query, newest first"""
+    collection = transactions(db, name)
+    if isinstance(collection, BucketCollection):
+        return collection.latest(query, limit)
+    return list(collection.find(query, projection).sort("date", -1).limit(limit))
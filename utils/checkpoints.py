@@ -0,0 +1,20 @@
+from utils.dates import utc_now
+
+# Collection that keeps the progress of long-running jobs so they can resume
+CHECKPOINT_COLLECTION = 'job_checkpoints'
+
+def load_checkpoint(db, job):
+    """Return the saved state of a job, or None if it has not started yet"""
+    checkpoint = db[CHECKPOINT_COLLECTION].find_one({"_id": job})
+    return checkpoint["state"] if checkpoint else None
+
+def save_checkpoint(db, job, state):
+    """Persist the state of a job after a batch has been processed"""
+    db[CHECKPOINT_COLLECTION].update_one(
+        {"_id": job},
+        {"$set": {"state": state, "updated_at": utc_now()}},
+        upsert=True)
+
+def clear_checkpoint(db, job):
+    """Forget the progress of a job so it starts from the beginning next time"""
+    db[CHECKPOINT_COLLECTION].delete_one({"_id": job})
@@ -0,0 +1,171 @@
+"""Local expense category classifier, trained on each user's own expenses.
+
+A multinomial naive Bayes model maps a description (the supplier of a scanned receipt)
+to a category. Words and character trigrams are hashed into CLASSIFIER_FEATURES
+buckets. A user's descriptions only ever touch a few hundred of those buckets, so the
+counts are kept sparse, one {bucket: count} dict per category, and a model costs memory
+in proportion to what the user has written rather than categories × CLASSIFIER_FEATURES.
+It is trained with a single $group over the user's expenses on first use. It is then
+updated incrementally from `expense.*` events, and retrained from scratch when it expires
+from the cache. An edited expense moves its example from the old category to the new
+one, and a deleted expense removes it.
+
+Prediction is vectorized: the counts of the buckets a batch uses are gathered into one
+small (categories, buckets) matrix, and the whole batch is scored with one scatter-add.
+"""
+from utils.cache import TTLCache
+from utils.events import hub
+from utils.scoping import scoped
+from utils.buckets import transactions
+import numpy as np
+import os
+import re
+import threading
+import zlib
+
+CLASSIFIER_FEATURES = int(os.getenv('CLASSIFIER_FEATURES', str(2 ** 12)))
+CLASSIFIER_MAX_USERS = int(os.getenv('CLASSIFIER_MAX_USERS', '1000'))
+CLASSIFIER_TTL_SECONDS = int(os.getenv('CLASSIFIER_TTL_SECONDS', '3600'))
+# Predictions less likely than this are returned without a category
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv('CLASSIFIER_MIN_CONFIDENCE', '0.4'))
+# Laplace smoothing of the feature counts
+ALPHA = 0.1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def features(text, n_features=CLASSIFIER_FEATURES):
+    """Hashed bucket indices of the words and character trigrams of a description"""
+    tokens = TOKEN_PATTERN.findall(text.lower().replace("'", ""))
+    grams = list(tokens)
+    for token in tokens:
+        padded = f' {token} '
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    # crc32 rather than hash(): buckets must be the same in every worker process
+    return [zlib.crc32(gram.encode()) % n_features for gram in grams]
+
+class CategoryModel:
+    """Multinomial naive Bayes over hashed description features"""
+
+    def __init__(self, n_features=CLASSIFIER_FEATURES):
+        self.n_features = n_features
+        self.categories = []
+        self.category_index = {}
+        # One {feature: count} dict per category
+        self.feature_counts = []
+        self.feature_totals = np.zeros(0)
+        self.category_counts = np.zeros(0)
+        self._lock = threading.Lock()
+
+    def _category(self, category):
+        index = self.category_index.get(category)
+        if index is None:
+            index = self.category_index[category] = len(self.categories)
+            self.categories.append(category)
+            self.feature_counts.append({})
+            self.feature_totals = np.append(self.feature_totals, 0.0)
+            self.category_counts = np.append(self.category_counts, 0.0)
+        return index
+
+    def learn(self, description, category, weight=1):
+        """Add `weight` examples of description → category; a negative weight removes them"""
+        indices = features(description, self.n_features)
+        if not indices:
+            return
+        with self._lock:
+            if weight < 0 and category not in self.category_index:
+                return
+            row = self._category(category)
+            counts = self.feature_counts[row]
+            for index in indices:
+                count = counts.get(index, 0) + weight
+                if count > 0:
+                    counts[index] = count
+                else:
+                    counts.pop(index, None)
+            self.feature_totals[row] = sum(counts.values())
+            self.category_counts[row] = max(0, self.category_counts[row] + weight)
+
+    def predict(self, descriptions):
+        """Return a (category or None, confidence) pair for every description"""
+        if not descriptions:
+            return []
+        hashed = [features(description, self.n_features) for description in descriptions]
+        rows = np.repeat(np.arange(len(hashed)), [len(indices) for indices in hashed])
+        # The distinct features of the batch, and each feature's position among them
+        columns, positions = np.unique(
+            np.fromiter((index for indices in hashed for index in indices), dtype=np.int64, count=len(rows)),
+            return_inverse=True)
+        with self._lock:
+            if not self.category_counts.sum():
+                return [(None, 0.0)] * len(descriptions)
+            counts = np.array([[category.get(column, 0) for column in columns.tolist()]
+                               for category in self.feature_counts], dtype=np.float64).reshape(-1, len(columns))
+            totals = self.feature_totals.copy()
+            category_counts = self.category_counts.copy()
+            categories = list(self.categories)
+        # Laplace smoothing over all n_features buckets, as if the counts were dense
+        log_likelihood = np.log(counts + ALPHA) - np.log(totals + ALPHA * self.n_features)[:, None]
+        # A category whose every example was removed can never be predicted
+        with np.errstate(divide='ignore'):
+            log_prior = np.log(category_counts / category_counts.sum())
+        # scores[i] = log prior + sum of the log likelihoods of the features of description i
+        scores = np.tile(log_prior, (len(hashed), 1))
+        np.add.at(scores, rows, log_likelihood[:, positions].T)
+        scores -= scores.max(axis=1, keepdims=True)
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        results = []
+        for i, indices in enumerate(hashed):
+            confidence = float(probabilities[i, best[i]])
+            if not indices or confidence < CLASSIFIER_MIN_CONFIDENCE:
+                results.append((None, confidence))
+            else:
+                results.append((categories[best[i]], confidence))
+        return results
+
+models = TTLCache(maxsize=CLASSIFIER_MAX_USERS, ttl=CLASSIFIER_TTL_SECONDS)
+
+def train(db, user_id):
+    """Train a model on every categorised expense of a user"""
+    model = CategoryModel()
+    pipeline = [
+        {"$match": scoped({"description": {"$type": "string"}, "category": {"$type": "string"}}, user_id)},
+        {"$group": {"_id": {"description": "$description", "category": "$category"}, "count": {"$sum": 1}}},
+    ]
+    for row in transactions(db, 'expense').aggregate(pipeline):
+        model.learn(row["_id"]["description"], row["_id"]["category"], row["count"])
+    return model
+
+def model_for(db, user_id):
+    model = models.get(user_id)
+    if model is None:
+        model = train(db, user_id)
+        models.set(user_id, model)
+    return model
+
+def predict(db, user_id, descriptions):
+    """Categorise a batch of descriptions with the user's model"""
+    return model_for(db, user_id).predict(descriptions)
+
+def learn_from(model, data, weight):
+    description = data.get("description")
+    category = data.get("category")
+    if isinstance(description, str) and isinstance(category, str):
+        model.learn(description, category, weight)
+
+def on_event(event):
+    """Learn from a new, edited or deleted expense of a user whose model is loaded"""
+    if event["type"] not in ('expense.created', 'expense.updated', 'expense.deleted'):
+        return
+    model = models.get(event["user_id"])
+    if model is None:
+        return
+    if event["type"] == 'expense.deleted':
+        learn_from(model, event["data"], -1)
+        return
+    # An edit is a correction: forget what the expense said before (change stream events do not say)
+    learn_from(model, event["data"].get("previous") or {}, -1)
+    learn_from(model, event["data"], 1)
+
+hub.listen(on_event)
@@ -0,0 +1,46 @@
+from dateutil import parser
+import datetime
+
+# Date fields that clients send as ISO strings, per collection
+DATE_FIELDS = {
+    "expense": ["date"],
+    "income": ["date"],
+    "transfer": ["date"],
+    "budget": ["created_at", "updated_at"],
+    "wallet": ["created_at", "updated_at"],
+}
+
+def utc_now():
+    """The current time as a naive UTC datetime, the way every stored date is kept"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def parse_date(value):
+    """Convert an ISO string (or date) sent by a client into a datetime for BSON storage"""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    if not isinstance(value, str):
+        raise ValueError(f'Unsupported date value: {value!r}')
+    try:
+        parsed = parser.isoparse(value)
+    except ValueError:
+        # Fall back to the lenient parser for non-ISO formats (e.g. "19 Oct 2026")
+        parsed = parser.parse(value)
+    if parsed.tzinfo is not None:
+        # MongoDB stores dates in UTC, so keep every stored value naive UTC
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_date_range(args):
+    """Return the (start, end) datetimes of the `from` and `to` query arguments, either may be None"""
+    start = parse_date(args.get('from')) if args.get('from') else None
+    end = parse_date(args.get('to')) if args.get('to') else None
+    return start, end
+
+def normalize_dates(document, collection_name):
+    """Replace the date fields of a document (in place) with datetime objects"""
+    for field in DATE_FIELDS[collection_name]:
+        if field in document:
+            document[field] = parse_date(document[field])
+    return document
@@ -0,0 +1,8 @@
+from utils import storage
+
+def connect_to_db():
+    return storage.connect()
+
+def get_database():
+    """Return the shared database handle, connecting on first use"""
+    return storage.database
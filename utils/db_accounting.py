@@ -0,0 +1,186 @@
+"""Per-request MongoDB call accounting and slow-request log.
+
+A pymongo command listener adds every command to the request that issued it: command
+name, collection, a redacted shape of its filter or pipeline, and its duration.
+After the request:
+
+- with DB_STATS_HEADER=1 the totals are returned in an `X-DB-Stats` header (and as
+  `Server-Timing`, which browser dev tools display);
+- a request that ran more than DB_SLOW_COMMAND_COUNT commands or spent more than
+  DB_SLOW_REQUEST_MS in MongoDB is logged with its command shapes, which makes N+1
+  loops easy to spot. With DB_SLOW_EXPLAIN=1 the query plans of its finds and
+  aggregations are logged too.
+
+Work a request hands to a thread pool is accounted to it when run through `carry_accounting`.
+"""
+from flask import request, g
+from pymongo import monitoring
+from utils.db import get_database
+import contextvars
+import copy
+import logging
+import os
+import threading
+import time
+
+DB_STATS_HEADER = os.getenv('DB_STATS_HEADER', '0') == '1'
+DB_SLOW_COMMAND_COUNT = int(os.getenv('DB_SLOW_COMMAND_COUNT', '10'))
+DB_SLOW_REQUEST_MS = float(os.getenv('DB_SLOW_REQUEST_MS', '200'))
+DB_SLOW_EXPLAIN = os.getenv('DB_SLOW_EXPLAIN', '0') == '1'
+EXPLAINABLE_COMMANDS = {'find', 'aggregate', 'count', 'distinct'}
+
+logger = logging.getLogger('slow_requests')
+
+class RequestStats:
+    """The MongoDB commands issued while serving one request"""
+
+    def __init__(self, keep_commands=False):
+        self.keep_commands = keep_commands
+        self.started = {}
+        self.commands = []
+        self.total_micros = 0
+        # Commands of one request can finish on several threads (see carry_accounting)
+        self.lock = threading.Lock()
+
+    @property
+    def count(self):
+        return len(self.commands)
+
+    @property
+    def total_ms(self):
+        return self.total_micros / 1000
+
+current_stats = contextvars.ContextVar('db_request_stats', default=None)
+
+def redact(value):
+    """Keep the structure of a filter but replace every value with its type"""
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value[:3]] + (['...'] if len(value) > 3 else [])
+    return type(value).__name__
+
+def command_shape(command_name, command):
+    """Return a short, value-free description of a command"""
+    collection = command.get(command_name)
+    shape = {"command": command_name, "collection": collection if isinstance(collection, str) else None}
+    if 'filter' in command:
+        shape["filter"] = redact(command['filter'])
+    elif 'query' in command:
+        shape["filter"] = redact(command['query'])
+    elif 'pipeline' in command:
+        shape["pipeline"] = [next(iter(stage)) for stage in command['pipeline']]
+    elif 'updates' in command:
+        shape["filter"] = [redact(update.get('q')) for update in command['updates'][:3]]
+        shape["batch"] = len(command['updates'])
+    elif 'deletes' in command:
+        shape["filter"] = [redact(delete.get('q')) for delete in command['deletes'][:3]]
+        shape["batch"] = len(command['deletes'])
+    elif 'documents' in command:
+        shape["batch"] = len(command['documents'])
+    return shape
+
+class CommandAccounting(monitoring.CommandListener):
+    """Add each command to the RequestStats of the request that issued it"""
+
+    def started(self, event):
+        stats = current_stats.get()
+        if stats is not None:
+            raw = copy.deepcopy(event.command) if stats.keep_commands else None
+            stats.started[event.request_id] = (command_shape(event.command_name, event.command),
+                                               event.database_name, raw)
+
+    def _finished(self, event, outcome):
+        stats = current_stats.get()
+        if stats is None:
+            return
+        shape, database_name, raw = stats.started.pop(event.request_id, (None, None, None))
+        if shape is None:
+            return
+        with stats.lock:
+            stats.total_micros += event.duration_micros
+            stats.commands.append({**shape, "ms": event.duration_micros / 1000, "outcome": outcome,
+                                   "database": database_name, "raw": raw})
+
+    def succeeded(self, event):
+        self._finished(event, 'succeeded')
+
+    def failed(self, event):
+        self._finished(event, 'failed')
+
+monitoring.register(CommandAccounting())
+
+def carry_accounting(function):
+    """Wrap function so that its commands count towards the current request on any thread.
+
+    Only the accounting is carried over. A copy of the whole context would also carry the
+    Flask request, and with it the request's MongoDB session, which is not thread-safe.
+    """
+    stats = current_stats.get()
+
+    def run(*args, **kwargs):
+        def accounted():
+            current_stats.set(stats)
+            return function(*args, **kwargs)
+        # A fresh context per call, so a pooled thread does not keep this request's stats
+        return contextvars.Context().run(accounted)
+    return run
+
+############################################################################################
+#####                         REQUEST HOOKS                                           ######
+############################################################################################
+
+def start_accounting():
+    stats = RequestStats(keep_commands=DB_SLOW_EXPLAIN)
+    g.db_stats_token = current_stats.set(stats)
+    g.db_stats_started_at = time.perf_counter()
+
+def explain(command):
+    """Return the winning plan of a find/aggregate command, or the error that prevented it"""
+    raw = {key: value for key, value in command["raw"].items()
+           if key not in ('$db', 'lsid', '$clusterTime', '$readPreference', 'txnNumber')}
+    try:
+        result = get_database().client[command["database"]].command(
+            'explain', raw, verbosity='queryPlanner')
+        return result.get('queryPlanner', {}).get('winningPlan', result)
+    except Exception as e:
+        return f'explain failed: {e}'
+
+def log_slow_request(stats, elapsed_ms):
+    shapes = [{key: value for key, value in command.items() if key not in ('raw', 'database')}
+              for command in stats.commands]
+    logger.warning('Slow request %s %s: %d MongoDB commands, %.1f ms in MongoDB, %.1f ms total; commands: %s',
+                   request.method, request.path, stats.count, stats.total_ms, elapsed_ms, shapes)
+    if DB_SLOW_EXPLAIN:
+        # Explain commands run outside of the accounting of this request
+        current_stats.set(None)
+        for command in stats.commands:
+            if command["command"] in EXPLAINABLE_COMMANDS and command["raw"] is not None:
+                logger.warning('Plan of %s on %s: %s', command["command"], command["collection"], explain(command))
+
+def finish_accounting(response):
+    stats = current_stats.get()
+    if stats is None:
+        return response
+    elapsed_ms = (time.perf_counter() - g.db_stats_started_at) * 1000
+    if DB_STATS_HEADER:
+        response.headers['X-DB-Stats'] = f'commands={stats.count}; time_ms={stats.total_ms:.1f}'
+        response.headers['Server-Timing'] = f'db;dur={stats.total_ms:.1f};desc="{stats.count} commands"'
+    if stats.count > DB_SLOW_COMMAND_COUNT or stats.total_ms > DB_SLOW_REQUEST_MS:
+        log_slow_request(stats, elapsed_ms)
+    return response
+
+def stop_accounting(exception=None):
+    token = g.pop('db_stats_token', None)
+    if token is not None:
+        try:
+            current_stats.reset(token)
+        except ValueError:
+            # Streamed responses finish in another context, which never saw the stats
+            pass
+
+def init_db_accounting(app):
+    """Install the per-request accounting hooks on the app"""
+    app.before_request(start_accounting)
+    app.after_request(finish_accounting)
+    app.teardown_request(stop_accounting)
@@ -0,0 +1,145 @@
+"""In-process publish/subscribe hub that feeds the `GET /events` Server-Sent Events stream.
+
+By default the write handlers publish their own changes. With EVENTS_SOURCE=change_streams
+(replica set or Atlas only) a background thread turns MongoDB change streams into events
+instead, so changes made by other workers or scripts are streamed as well.
+"""
+from collections import deque
+import itertools
+import os
+import queue
+import threading
+import time
+from utils.scoping import current_user_id, DEFAULT_USER_ID
+
+EVENTS_SOURCE = os.getenv('EVENTS_SOURCE', 'handlers')
+# Number of recent events kept so a reconnecting client can catch up with Last-Event-ID
+EVENTS_REPLAY_SIZE = int(os.getenv('EVENTS_REPLAY_SIZE', '500'))
+# Events buffered for a single client before it is considered too slow and disconnected
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '1000'))
+
+class Subscription:
+    """A queue of events for one connected client (None user_id receives every user's events)"""
+
+    def __init__(self, maxsize, user_id=None):
+        self.queue = queue.Queue(maxsize)
+        self.user_id = user_id
+        self.overflowed = False
+
+    def wants(self, event):
+        return self.user_id is None or self.user_id == event["user_id"]
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+class EventHub:
+    """Fan out published events to every subscribed client"""
+
+    def __init__(self, replay_size=EVENTS_REPLAY_SIZE, queue_size=EVENTS_QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._recent = deque(maxlen=replay_size)
+        self._ids = itertools.count(1)
+        self._queue_size = queue_size
+        self._listeners = []
+
+    def listen(self, callback):
+        """Call callback(event) for every published event; it must be quick and must not block"""
+        self._listeners.append(callback)
+
+    def subscribe(self, last_event_id=None, user_id=None):
+        """Register a client, pre-filled with the events it missed since last_event_id"""
+        subscription = Subscription(self._queue_size, user_id)
+        with self._lock:
+            if last_event_id is not None:
+                missed = [event for event in self._recent
+                          if event["id"] > last_event_id and subscription.wants(event)]
+                for event in missed[-self._queue_size:]:
+                    subscription.queue.put_nowait(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event_type, data, user_id=None):
+        """Send an event to the subscribers of its owner without ever blocking the publisher"""
+        with self._lock:
+            event = {"id": next(self._ids), "type": event_type, "data": data, "user_id": user_id}
+            self._recent.append(event)
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(event)]
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                # Drop a client that cannot keep up; EventSource reconnects and catches up
+                subscription.overflowed = True
+                self.unsubscribe(subscription)
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f'ERROR: Event listener failed: {e}')
+        return event
+
+hub = EventHub()
+
+def publish(event_type, data):
+    """Publish a change from a write handler (skipped when change streams are the source)"""
+    if EVENTS_SOURCE == 'handlers':
+        hub.publish(event_type, data, current_user_id())
+
+def publish_balance(wallet):
+    """Publish the new balance of a wallet document returned by find_one_and_update"""
+    if wallet is not None:
+        publish('balance', {"wallet_id": wallet.get("wallet_id") or str(wallet["_id"]),
+                            "balance": wallet.get("balance")})
+
+############################################################################################
+#####                         CHANGE STREAM SOURCE                                    ######
+############################################################################################
+
+CHANGE_STREAM_COLLECTIONS = ['expense', 'income', 'wallet', 'budget']
+OPERATION_NAMES = {'insert': 'created', 'update': 'updated', 'replace': 'updated', 'delete': 'deleted'}
+
+def change_to_events(change):
+    """Translate a change stream document into (type, data, user_id) hub events"""
+    collection = change["ns"]["coll"]
+    document = change.get("fullDocument") or {}
+    # On a sharded collection documentKey also holds the shard key, so deletes keep their owner
+    user_id = document.get("user_id") or change["documentKey"].get("user_id") or DEFAULT_USER_ID
+    data = {"_id": str(change["documentKey"]["_id"])}
+    for field in ("wallet_id", "amount", "budget_id", "description", "category"):
+        if field in document:
+            data[field] = document[field]
+    events = [(f'{collection}.{OPERATION_NAMES[change["operationType"]]}', data, user_id)]
+    if collection == 'wallet' and "balance" in document:
+        events.append(('balance', {"wallet_id": document.get("wallet_id") or data["_id"],
+                                   "balance": document["balance"]}, user_id))
+    return events
+
+def watch_changes(db):
+    """Publish every change to the tracked collections; resumes after transient errors"""
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": CHANGE_STREAM_COLLECTIONS},
+        "operationType": {"$in": list(OPERATION_NAMES)}}}]
+    resume_token = None
+    while True:
+        try:
+            with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                for change in stream:
+                    resume_token = stream.resume_token
+                    for event_type, data, user_id in change_to_events(change):
+                        hub.publish(event_type, data, user_id)
+        except Exception as e:
+            print(f'ERROR: Change stream interrupted, resuming: {e}')
+            time.sleep(1)
+
+def start_change_stream_source(db):
+    """Start watching MongoDB change streams in the background if they are the configured source"""
+    if EVENTS_SOURCE != 'change_streams':
+        return None
+    thread = threading.Thread(target=watch_changes, args=(db,), name='change-streams', daemon=True)
+    thread.start()
+    return thread
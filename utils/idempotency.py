@@ -0,0 +1,113 @@
+"""Idempotency keys for POST endpoints.
+
+A client that retries a POST sends the same Idempotency-Key header. The first response
+for a key is stored in the TTL-indexed `idempotency_keys` collection, with an
+in-memory cache in front of it. A retry gets that stored response back without running
+the handler, so a ledger write and its balance update happen only once.
+
+While the handler runs, the key is claimed for IDEMPOTENCY_LEASE_SECONDS. A retry during
+the lease gets a 409. A retry after it, e.g. because the worker that held the claim
+crashed, takes the claim over and runs the handler. Keep the lease longer than the
+request timeout, or a slow request and its retry can both run.
+"""
+from flask import request, make_response, jsonify
+from functools import wraps
+from pymongo.errors import DuplicateKeyError
+from utils.cache import TTLCache
+from utils.db import get_database
+from utils.scoping import current_user_id
+from utils.dates import utc_now
+from bson import ObjectId
+import datetime
+import hashlib
+import os
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_COLLECTION = 'idempotency_keys'
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60)))
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv('IDEMPOTENCY_LEASE_SECONDS', '60'))
+# Keys longer than this are rejected rather than stored
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# Completed responses, keyed like the stored documents
+response_cache = TTLCache(maxsize=10000, ttl=min(IDEMPOTENCY_TTL_SECONDS, 15 * 60))
+# Names of the databases whose TTL index exists; every namespace is a database of its own
+_indexed_databases = set()
+
+def get_collection():
+    """Return the idempotency collection, creating its TTL index on first use in each database"""
+    database = get_database()
+    collection = database[IDEMPOTENCY_COLLECTION]
+    if database.name not in _indexed_databases:
+        collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS)
+        _indexed_databases.add(database.name)
+    return collection
+
+def stored_response(record):
+    """Rebuild the Flask response of a completed request"""
+    response = make_response(record["body"], record["status"])
+    response.mimetype = record["mimetype"]
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(handler):
+    """Run a POST handler at most once per Idempotency-Key and replay its response on retries"""
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return jsonify({"error": f'{IDEMPOTENCY_HEADER} is longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}), 400
+        # Keys are private to a user and an endpoint
+        record_id = f'{current_user_id()}:{request.method}:{request.path}:{key}'
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        record = response_cache.get(record_id)
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                return jsonify({"error": f'{IDEMPOTENCY_HEADER} was already used with a different request'}), 422
+            return stored_response(record)
+
+        collection = get_collection()
+        # Identifies this claim, so a request whose lease was taken over leaves the record alone
+        claim = {"_id": record_id, "claim": ObjectId()}
+        now = utc_now()
+        lease_until = now + datetime.timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        try:
+            # Claim the key before doing any work so a concurrent retry cannot run twice
+            collection.insert_one({**claim, "state": "in_progress", "lease_until": lease_until,
+                                   "fingerprint": fingerprint, "created_at": now})
+        except DuplicateKeyError:
+            record = collection.find_one({"_id": record_id})
+            if record is None:
+                # The claim expired in the meantime; let the client retry
+                return jsonify({"error": "Please retry the request"}), 409
+            if record["fingerprint"] != fingerprint:
+                return jsonify({"error": f'{IDEMPOTENCY_HEADER} was already used with a different request'}), 422
+            if record["state"] != "completed":
+                # The lease of a claim whose worker died runs out; the retry then takes it over
+                taken_over = collection.find_one_and_update(
+                    {"_id": record_id, "state": "in_progress", "lease_until": {"$lt": now}},
+                    {"$set": {"claim": claim["claim"], "lease_until": lease_until}})
+                if taken_over is None:
+                    return jsonify({"error": "A request with this Idempotency-Key is still in progress"}), 409
+            else:
+                response_cache.set(record_id, record)
+                return stored_response(record)
+
+        try:
+            response = make_response(handler(*args, **kwargs))
+        except Exception:
+            # Release the key so that the retry can run the handler again
+            collection.delete_one(claim)
+            raise
+        if response.status_code >= 500:
+            collection.delete_one(claim)
+            return response
+        record = {"state": "completed", "fingerprint": fingerprint, "status": response.status_code,
+                  "body": response.get_data(as_text=True), "mimetype": response.mimetype}
+        collection.update_one(claim, {"$set": record, "$unset": {"lease_until": ""}})
+        response_cache.set(record_id, record)
+        return response
+    return wrapper
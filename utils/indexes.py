@@ -0,0 +1,108 @@
+"""Indexes of the myfinance collections.
+
+Every index leads with the `user_id` owner key, so the per-user queries of the handlers
+stay index-only and, on a sharded cluster, are routed to the shards holding that user's
+chunks. The shard keys lead with the hashed user_id followed by `_id` (owner, wallet and
+month for the buckets), so a large user can still be split over several chunks. That includes
+the text indexes behind /search, which are compound {user_id: 1, <fields>: "text"}, so a
+search only reads the caller's index entries. A text index prefix needs an equality match,
+so /search only finds documents that have an owner (see scripts/backfill_owner.py).
+"""
+import pymongo
+
+SCOPED_COLLECTIONS = ['budget', 'wallet', 'income', 'expense', 'income_archive', 'expense_archive',
+                      'income_buckets', 'expense_buckets', 'tombstones']
+
+# Shard key: hashing user_id spreads users evenly over the shards, and a query of one user
+# only reaches the chunks of that user. The second field lets a heavy user (a shared
+# household) be split over several chunks instead of growing one jumbo chunk that cannot
+# move. The wallet balance updates find their wallet by user_id and wallet_id, not by the
+# whole shard key, which needs MongoDB 7.1 or later on a sharded cluster.
+SHARD_KEY = [("user_id", pymongo.HASHED), ("_id", pymongo.ASCENDING)]
+# Buckets are upserted by owner, wallet and month, so an upsert always holds their whole shard key
+BUCKET_SHARD_KEY = [("user_id", pymongo.HASHED), ("wallet_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)]
+SHARD_KEYS = {"income_buckets": BUCKET_SHARD_KEY, "expense_buckets": BUCKET_SHARD_KEY}
+
+INDEXES = {
+    "budget": [
+        [("user_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    "wallet": [
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("budget_id", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    "income": [
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("date", pymongo.DESCENDING)],
+        [("user_id", pymongo.ASCENDING), ("date", pymongo.DESCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    "expense": [
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("date", pymongo.DESCENDING)],
+        [("user_id", pymongo.ASCENDING), ("date", pymongo.DESCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    "income_archive": [
+        [("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("transaction_ids", pymongo.ASCENDING)],
+    ],
+    "expense_archive": [
+        [("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("transaction_ids", pymongo.ASCENDING)],
+    ],
+    # The open bucket of a wallet and month is found through the first index,
+    # a single transaction through the multikey index on its embedded _id
+    "income_buckets": [
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING), ("count", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("transactions._id", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    "expense_buckets": [
+        [("user_id", pymongo.ASCENDING), ("wallet_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING), ("count", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("month", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("transactions._id", pymongo.ASCENDING)],
+        [("user_id", pymongo.ASCENDING), ("modified_at", pymongo.ASCENDING)],
+    ],
+    # What /sync reads; the TTL index on deleted_at is created by utils/sync.py
+    "tombstones": [
+        [("user_id", pymongo.ASCENDING), ("deleted_at", pymongo.ASCENDING)],
+    ],
+}
+
+# One text index per collection (MongoDB allows no more); matches in descriptions rank highest
+TEXT_INDEXES = {
+    "expense": ([("user_id", pymongo.ASCENDING), ("description", pymongo.TEXT), ("category", pymongo.TEXT)],
+                {"name": "expense_user_text", "weights": {"description": 3, "category": 1}}),
+    "income": ([("user_id", pymongo.ASCENDING), ("description", pymongo.TEXT), ("source", pymongo.TEXT)],
+               {"name": "income_user_text", "weights": {"description": 3, "source": 2}}),
+    "expense_buckets": ([("user_id", pymongo.ASCENDING), ("transactions.description", pymongo.TEXT),
+                         ("transactions.category", pymongo.TEXT)],
+                        {"name": "expense_buckets_user_text"}),
+    "income_buckets": ([("user_id", pymongo.ASCENDING), ("transactions.description", pymongo.TEXT),
+                        ("transactions.source", pymongo.TEXT)],
+                       {"name": "income_buckets_user_text"}),
+}
+
+def ensure_indexes(db):
+    """Create the user-scoped and text indexes (a no-op for indexes that already exist)"""
+    for name, indexes in INDEXES.items():
+        for keys in indexes:
+            db[name].create_index(keys)
+    for name, (keys, options) in TEXT_INDEXES.items():
+        # Replace a text index of an earlier version, which would block creating this one
+        for index_name, index in db[name].index_information().items():
+            if index_name != options["name"] and any(kind == pymongo.TEXT for _, kind in index["key"]):
+                db[name].drop_index(index_name)
+        db[name].create_index(keys, **options)
+
+def shard_collections(client, db):
+    """Shard every scoped collection on its shard key (the cluster must be a sharded cluster)"""
+    client.admin.command('enableSharding', db.name)
+    for name in SCOPED_COLLECTIONS:
+        key = SHARD_KEYS.get(name, SHARD_KEY)
+        db[name].create_index(key)
+        client.admin.command('shardCollection', f'{db.name}.{name}', key=dict(key))
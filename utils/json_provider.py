@@ -0,0 +1,17 @@
+from flask.json.provider import DefaultJSONProvider
+from utils.tracing import span
+import datetime
+
+class JSONProvider(DefaultJSONProvider):
+    """Serialize datetimes as ISO strings so BSON dates go back to the front-end unchanged"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        # Traced on its own so encoding time is not mistaken for handler time
+        with span('json.encode'):
+            return super().dumps(obj, **kwargs)
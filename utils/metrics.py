@@ -0,0 +1,152 @@
+"""Prometheus metrics for the API, MongoDB and Document AI.
+
+The pymongo listeners are registered globally when this module is imported, so it must
+be imported before the blueprints create their MongoDB clients (routes/__init__.py
+does this). Request metrics are recorded by the hooks that init_metrics installs on the app.
+"""
+from flask import request, g
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, REGISTRY
+from pymongo import monitoring
+import threading
+import time
+
+# Buckets from 1ms to 10s, wide enough for both Mongo commands and receipt scans
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Latency of HTTP requests per route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served per route',
+    ['method', 'route'])
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'Latency of MongoDB commands',
+    ['command', 'outcome'], buckets=LATENCY_BUCKETS)
+MONGO_POOL_CHECKOUT_WAIT = Histogram(
+    'mongodb_pool_checkout_wait_seconds', 'Time spent waiting for a pooled MongoDB connection',
+    ['outcome'], buckets=LATENCY_BUCKETS)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    'mongodb_pool_connections_checked_out', 'MongoDB connections currently checked out')
+MONGO_POOL_CONNECTIONS = Gauge(
+    'mongodb_pool_connections', 'Open MongoDB connections')
+DOCUMENT_AI_LATENCY = Histogram(
+    'document_ai_request_duration_seconds', 'Latency of Document AI process_document calls',
+    buckets=LATENCY_BUCKETS)
+DOCUMENT_AI_ERRORS = Counter(
+    'document_ai_errors_total', 'Document AI process_document calls that failed')
+
+############################################################################################
+#####                         PYMONGO MONITORING                                      ######
+############################################################################################
+
+class CommandMetrics(monitoring.CommandListener):
+    """Record the duration of every MongoDB command"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name, 'succeeded').observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.labels(event.command_name, 'failed').observe(event.duration_micros / 1e6)
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Record connection pool checkout waits and connection counts"""
+
+    def __init__(self):
+        # Checkout events carry no correlation id, but start and end happen on the same thread
+        self._checkout_started = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._checkout_started.at = time.perf_counter()
+
+    def _observe_checkout(self, outcome):
+        started_at = getattr(self._checkout_started, 'at', None)
+        if started_at is not None:
+            MONGO_POOL_CHECKOUT_WAIT.labels(outcome).observe(time.perf_counter() - started_at)
+            self._checkout_started.at = None
+
+    def connection_checked_out(self, event):
+        self._observe_checkout('succeeded')
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_check_out_failed(self, event):
+        self._observe_checkout('failed')
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+monitoring.register(CommandMetrics())
+monitoring.register(PoolMetrics())
+
+class AdmissionCollector:
+    """Expose the in-flight counters and rejections of the admission controller"""
+
+    def collect(self):
+        from utils.admission import controller
+        in_flight = GaugeMetricFamily('admission_in_flight', 'Admitted requests in flight per route class',
+                                      labels=['route_class'])
+        rejected = CounterMetricFamily('admission_rejected', 'Requests rejected by admission control',
+                                       labels=['route_class', 'reason'])
+        for route_class, count in controller.in_flight.items():
+            in_flight.add_metric([route_class], count)
+            for reason, total in controller.rejected[route_class].items():
+                rejected.add_metric([route_class, reason], total)
+        yield in_flight
+        yield rejected
+
+REGISTRY.register(AdmissionCollector())
+
+############################################################################################
+#####                         REQUEST HOOKS                                           ######
+############################################################################################
+
+def route_of():
+    # Use the route pattern rather than the URL so ids do not explode the label cardinality
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def start_request():
+    g.metrics_route = route_of()
+    g.metrics_started_at = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(request.method, g.metrics_route).inc()
+
+def record_response(response):
+    started_at = g.get('metrics_started_at')
+    if started_at is not None:
+        REQUEST_LATENCY.labels(request.method, g.metrics_route, response.status_code).observe(
+            time.perf_counter() - started_at)
+    return response
+
+def finish_request(exception=None):
+    route = g.pop('metrics_route', None)
+    if route is not None:
+        REQUESTS_IN_FLIGHT.labels(request.method, route).dec()
+
+def init_metrics(app):
+    """Install the request metric hooks; call it before other before_request hooks"""
+    app.before_request(start_request)
+    app.after_request(record_response)
+    app.teardown_request(finish_request)
@@ -0,0 +1,157 @@
+"""Typed request bodies for budgets, wallets, incomes and expenses.
+
+Bodies are decoded and validated from the raw bytes in a single pass by msgspec, before
+any MongoDB work. Missing or mistyped fields, unknown fields, out-of-range numbers and
+oversized strings or bodies are rejected with a 4xx. Creating a document needs the
+fields the list endpoints read back. Updates are partial, except that a transaction
+update always carries its wallet and amount. Dates stay strings here and are converted
+by utils/dates.py, which also accepts the plain `yyyy-mm-dd` dates from /scan-receipt.
+"""
+from flask import request
+from typing import Annotated, Dict, List, Literal, Union
+import msgspec
+from msgspec import Meta, Struct, UNSET, UnsetType
+import os
+
+# Every model body is small; anything bigger is rejected before it is parsed
+REQUEST_MAX_BYTES = int(os.getenv('REQUEST_MAX_BYTES', str(16 * 1024)))
+
+Name = Annotated[str, Meta(min_length=1, max_length=200)]
+Text = Annotated[str, Meta(max_length=1000)]
+DateString = Annotated[str, Meta(min_length=1, max_length=64)]
+ObjectIdString = Annotated[str, Meta(pattern='^[0-9a-fA-F]{24}$')]
+WalletId = Annotated[str, Meta(min_length=1, max_length=64)]
+Amount = Annotated[float, Meta(ge=0, le=1e12)]
+Balance = Annotated[float, Meta(ge=-1e12, le=1e12)]
+Allocations = Annotated[Dict[Name, Amount], Meta(max_length=50)]
+
+class Model(Struct, forbid_unknown_fields=True, omit_defaults=True):
+    """Base of the request models: unknown fields are an error"""
+
+class Categories(Model):
+    needs: Allocations = {}
+    wants: Allocations = {}
+    bills: Allocations = {}
+
+class Budget(Model):
+    created_at: DateString
+    updated_at: DateString
+    categories: Categories
+    name: Union[Name, UnsetType] = UNSET
+    wallet_id: Union[WalletId, UnsetType] = UNSET
+
+class BudgetUpdate(Model):
+    created_at: Union[DateString, UnsetType] = UNSET
+    updated_at: Union[DateString, UnsetType] = UNSET
+    categories: Union[Categories, UnsetType] = UNSET
+    name: Union[Name, UnsetType] = UNSET
+    wallet_id: Union[WalletId, UnsetType] = UNSET
+
+class Wallet(Model):
+    # wallet_id and opening_balance are set by the server
+    budget_id: ObjectIdString
+    balance: Balance
+    created_at: DateString
+    updated_at: DateString
+    type: Name
+    target: Amount
+    name: Union[Name, UnsetType] = UNSET
+
+class WalletUpdate(Model):
+    budget_id: Union[ObjectIdString, UnsetType] = UNSET
+    balance: Union[Balance, UnsetType] = UNSET
+    created_at: Union[DateString, UnsetType] = UNSET
+    updated_at: Union[DateString, UnsetType] = UNSET
+    type: Union[Name, UnsetType] = UNSET
+    target: Union[Amount, UnsetType] = UNSET
+    name: Union[Name, UnsetType] = UNSET
+
+class Expense(Model):
+    wallet_id: WalletId
+    amount: Amount
+    date: DateString
+    category: Name
+    description: Text
+
+class ExpenseUpdate(Model):
+    # The balance of the wallet is moved, so the wallet and amount are always needed
+    wallet_id: WalletId
+    amount: Amount
+    date: Union[DateString, UnsetType] = UNSET
+    category: Union[Name, UnsetType] = UNSET
+    description: Union[Text, UnsetType] = UNSET
+
+class Income(Model):
+    wallet_id: WalletId
+    amount: Amount
+    date: DateString
+    source: Name
+    description: Text
+
+class IncomeUpdate(Model):
+    # The balance of the wallet is moved, so the wallet and amount are always needed
+    wallet_id: WalletId
+    amount: Amount
+    date: Union[DateString, UnsetType] = UNSET
+    source: Union[Name, UnsetType] = UNSET
+    description: Union[Text, UnsetType] = UNSET
+
+class Transfer(Model):
+    from_wallet_id: WalletId
+    to_wallet_id: WalletId
+    amount: Annotated[float, Meta(gt=0, le=1e12)]
+    date: Union[DateString, UnsetType] = UNSET
+    description: Union[Text, UnsetType] = UNSET
+
+class SubRequest(Model):
+    method: Literal['GET', 'POST', 'PUT', 'DELETE']
+    path: Annotated[str, Meta(pattern='^/[^/]', max_length=2000)]
+    # Passed through untouched; the endpoint validates it against its own model
+    body: Union[msgspec.Raw, UnsetType] = UNSET
+    id: Union[Name, UnsetType] = UNSET
+    idempotency_key: Union[Annotated[str, Meta(min_length=1, max_length=255)], UnsetType] = UNSET
+
+class BatchRequest(Model):
+    requests: Annotated[List[SubRequest], Meta(min_length=1, max_length=int(os.getenv('BATCH_MAX_REQUESTS', '20')))]
+
+class CategorizeRequest(Model):
+    descriptions: Annotated[List[Text], Meta(min_length=1, max_length=1000)]
+
+# Decoders are built once per model; building one compiles its validation
+DECODERS = {model: msgspec.json.Decoder(model) for model in
+            (Budget, BudgetUpdate, Wallet, WalletUpdate, Expense, ExpenseUpdate, Income, IncomeUpdate,
+             Transfer, BatchRequest, CategorizeRequest)}
+
+class InvalidBody(Exception):
+    """The request body does not match its model"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def to_document(struct):
+    """Convert a decoded model to the dict stored in MongoDB, leaving out unset fields"""
+    document = {}
+    for field in struct.__struct_fields__:
+        value = getattr(struct, field)
+        if value is UNSET:
+            continue
+        if isinstance(value, list):
+            document[field] = [to_document(item) if isinstance(item, Struct) else item for item in value]
+        else:
+            document[field] = to_document(value) if isinstance(value, Struct) else value
+    return document
+
+def decode_body(model, max_bytes=REQUEST_MAX_BYTES):
+    """Decode and validate the request body against `model` and return it as a document"""
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise InvalidBody(f'Request body is larger than {max_bytes} bytes', 413)
+    body = request.get_data()
+    if len(body) > max_bytes:
+        raise InvalidBody(f'Request body is larger than {max_bytes} bytes', 413)
+    try:
+        return to_document(DECODERS[model].decode(body))
+    except msgspec.DecodeError as e:
+        # ValidationError is a DecodeError too; its message names the offending field
+        raise InvalidBody(str(e))
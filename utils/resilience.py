@@ -0,0 +1,188 @@
+"""Retry with jittered backoff and a circuit breaker for MongoDB calls.
+
+Reads that fail with a connection error are retried up to DB_RETRY_ATTEMPTS times, with
+"full jitter" exponential backoff so that workers do not retry in lockstep. Server
+selection timeouts are not retried: each one already waited the full timeout. Writes are
+not retried here; pymongo already retries them once with retryable writes.
+
+After DB_BREAKER_FAILURES consecutive connection errors the circuit opens. Every call
+then fails at once with DatabaseUnavailable (a 503) instead of waiting for a server
+selection timeout. After DB_BREAKER_RESET_SECONDS one trial call is let through: if it
+succeeds the circuit closes again, otherwise it stays open for another period. A cursor
+reports its outcome when it is first iterated; a trial that never reports one is replaced
+after another DB_BREAKER_RESET_SECONDS.
+"""
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import os
+import random
+import threading
+import time
+
+DB_RETRY_ATTEMPTS = int(os.getenv('DB_RETRY_ATTEMPTS', '3'))
+DB_RETRY_BASE_SECONDS = float(os.getenv('DB_RETRY_BASE_SECONDS', '0.05'))
+DB_RETRY_MAX_SECONDS = float(os.getenv('DB_RETRY_MAX_SECONDS', '1'))
+DB_BREAKER_FAILURES = int(os.getenv('DB_BREAKER_FAILURES', '5'))
+DB_BREAKER_RESET_SECONDS = float(os.getenv('DB_BREAKER_RESET_SECONDS', '10'))
+
+# Collection methods that only read and run their command when called
+RETRYABLE_METHODS = {'find_one', 'count_documents', 'estimated_document_count', 'distinct', 'aggregate'}
+# Methods that return a cursor without running anything; their errors surface on iteration
+LAZY_METHODS = {'find', 'find_raw_batches', 'aggregate_raw_batches', 'list_indexes', 'watch'}
+
+class DatabaseUnavailable(Exception):
+    """The circuit is open: MongoDB is failing and calls are not attempted"""
+
+    def __init__(self, retry_after):
+        super().__init__('Database is unavailable')
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Open after `failures` consecutive failures, then let one trial call through every `reset_seconds`"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failures=DB_BREAKER_FAILURES, reset_seconds=DB_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise DatabaseUnavailable unless a call may be attempted now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            # While half open, opened_at is when the trial started
+            waited = time.monotonic() - self.opened_at
+            if waited >= self.reset_seconds:
+                # Let this call through as the trial (again, if the last trial never reported back)
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return
+            raise DatabaseUnavailable(max(0, self.reset_seconds - waited))
+
+    def release_trial(self):
+        """Give back a trial that sent nothing, so the next call can be the trial"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic() - self.reset_seconds
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+breaker = CircuitBreaker()
+
+def backoff(attempt, base=DB_RETRY_BASE_SECONDS, cap=DB_RETRY_MAX_SECONDS):
+    """Seconds to sleep before retry number `attempt` (1-based), with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+def record_failure(error, circuit=breaker):
+    """Count a connection error once, however many handlers see it"""
+    if not getattr(error, 'breaker_recorded', False):
+        error.breaker_recorded = True
+        circuit.record_failure()
+
+class GuardedCursor:
+    """A cursor that reports the outcome of its first batch to the circuit breaker"""
+
+    def __init__(self, cursor, circuit):
+        self._cursor = cursor
+        self._circuit = circuit
+        self._reported = False
+
+    def _report(self, error=None):
+        if self._reported:
+            return
+        self._reported = True
+        if error is None:
+            self._circuit.record_success()
+        else:
+            record_failure(error, self._circuit)
+
+    def _fetch(self, fetch):
+        try:
+            document = fetch()
+        except StopIteration:
+            self._report()
+            raise
+        except ConnectionFailure as e:
+            self._report(e)
+            raise
+        self._report()
+        return document
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._fetch(lambda: next(self._cursor))
+
+    next = __next__
+
+    def try_next(self):
+        return self._fetch(self._cursor.try_next)
+
+    def close(self):
+        if not self._reported:
+            # Nothing was sent: neither a success nor a failure
+            self._reported = True
+            self._circuit.release_trial()
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, index):
+        return self._cursor[index]
+
+    def __getattr__(self, attribute):
+        value = getattr(self._cursor, attribute)
+        if not callable(value):
+            return value
+
+        def chained(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # sort(), limit(), ... return the cursor itself; keep it guarded
+            return self if result is self._cursor else result
+        return chained
+
+def call(method, args, kwargs, retryable, circuit=breaker, attempts=DB_RETRY_ATTEMPTS, lazy=False):
+    """Run a MongoDB call behind the circuit breaker, retrying connection errors if it only reads"""
+    if lazy:
+        # Nothing is sent yet; the cursor reports the outcome once it is iterated
+        circuit.before_call()
+        try:
+            return GuardedCursor(method(*args, **kwargs), circuit)
+        except ConnectionFailure as e:
+            record_failure(e, circuit)
+            raise
+    attempt = 1
+    while True:
+        circuit.before_call()
+        try:
+            result = method(*args, **kwargs)
+        except ConnectionFailure as e:
+            record_failure(e, circuit)
+            # A server selection timeout has already waited serverSelectionTimeoutMS
+            if not retryable or attempt >= attempts or isinstance(e, ServerSelectionTimeoutError):
+                raise
+            time.sleep(backoff(attempt))
+            attempt += 1
+            continue
+        circuit.record_success()
+        return result
@@ -0,0 +1,163 @@
+"""Per-endpoint read routing and causally consistent sessions.
+
+Every endpoint runs under a policy, which decides its read preference and read concern:
+
+- `primary` (the default): reads and writes on the primary, as before;
+- `analytics`: list, search and report reads go to a secondary, provided it lags the
+  primary by at most READ_MAX_STALENESS_SECONDS, and fall back to the primary otherwise.
+
+Only GET requests are routed. Anything else writes, and its reads (the idempotency claim
+of an @idempotent endpoint, for one) must see the primary's latest state.
+
+All the MongoDB calls of a request share one causally consistent session. A client still
+reads its own writes from a secondary: every response that wrote returns the operation
+time in an X-Read-After header. The client sends that header back on its next request,
+and the session passes it to the server, which then only answers from a secondary that
+has caught up with that write. The last write time of each user is also kept in memory,
+so clients that ignore the header are covered within one worker.
+"""
+from flask import g, has_request_context, request
+from bson.timestamp import Timestamp
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
+from utils.cache import TTLCache
+from utils.scoping import current_user_id
+import os
+
+READ_ROUTING = os.getenv('READ_ROUTING', '1') == '1'
+# MongoDB does not accept a max staleness below 90 seconds
+READ_MAX_STALENESS_SECONDS = max(90, int(os.getenv('READ_MAX_STALENESS_SECONDS', '120')))
+READ_AFTER_HEADER = 'X-Read-After'
+READ_AFTER_TTL_SECONDS = int(os.getenv('READ_AFTER_TTL_SECONDS', '300'))
+
+POLICIES = {
+    "primary": {},
+    "analytics": {
+        "read_preference": SecondaryPreferred(max_staleness=READ_MAX_STALENESS_SECONDS),
+        # Causal guarantees hold for majority reads of majority writes
+        "read_concern": ReadConcern('majority'),
+    },
+}
+
+# GET endpoints whose reads may be served by a secondary
+ENDPOINT_POLICIES = {
+    'expense.get_expenses': 'analytics',
+    'income.get_incomes': 'analytics',
+    'search.search': 'analytics',
+    'search.search_autocomplete': 'analytics',
+    'wallet.forecast_wallets': 'analytics',
+}
+
+# Collection methods that accept a session=
+SESSION_METHODS = {
+    'find', 'find_one', 'count_documents', 'distinct', 'aggregate',
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+    'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'bulk_write',
+}
+WRITE_METHODS = {
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+    'find_one_and_update', 'find_one_and_replace', 'find_one_and_delete', 'bulk_write',
+}
+
+# The operation time of the last write of each user in this worker
+last_writes = TTLCache(maxsize=100000, ttl=READ_AFTER_TTL_SECONDS)
+
+class TransactionsUnavailable(Exception):
+    """The deployment does not support multi-document transactions"""
+
+class WalletNotFound(Exception):
+    """The wallet a write moves the balance of does not exist; raised in in_transaction, it undoes the write"""
+
+def format_timestamp(timestamp):
+    return f'{timestamp.time}.{timestamp.inc}'
+
+def parse_timestamp(value):
+    """Parse an X-Read-After value; return None if it is missing or malformed"""
+    try:
+        time, inc = value.split('.')
+        return Timestamp(int(time), int(inc))
+    except (AttributeError, ValueError, TypeError):
+        return None
+
+def current_policy():
+    if not has_request_context() or request.method != 'GET':
+        return "primary"
+    return ENDPOINT_POLICIES.get(request.endpoint, "primary")
+
+def routed(collection):
+    """Return the collection with the options of the current endpoint's policy"""
+    # Only real MongoDB collections are routed; the memory backend has no replicas
+    if not READ_ROUTING or not has_request_context() or not isinstance(collection, Collection):
+        return collection
+    options = POLICIES[current_policy()]
+    return collection.with_options(**options) if options else collection
+
+def request_session(client):
+    """Return the causally consistent session of the current request, starting it on first use"""
+    session = g.get('db_session')
+    if session is None:
+        session = g.db_session = client.start_session(causal_consistency=True)
+        # Read after this client's last write, whichever worker served it
+        for read_after in (parse_timestamp(request.headers.get(READ_AFTER_HEADER)),
+                           last_writes.get(current_user_id())):
+            if read_after is not None:
+                session.advance_operation_time(read_after)
+    return session
+
+def with_session(collection, method, kwargs):
+    """Add the request's session to the arguments of a collection call"""
+    if (not has_request_context() or not isinstance(collection, Collection)
+            or method not in SESSION_METHODS or 'session' in kwargs):
+        return kwargs
+    session = g.get('db_session')
+    if session is None:
+        # A session started for a transaction is used even with routing turned off
+        if not READ_ROUTING:
+            return kwargs
+        session = request_session(collection.database.client)
+    if method in WRITE_METHODS:
+        g.db_wrote = True
+    return {**kwargs, "session": session}
+
+def in_transaction(client, callback):
+    """Run callback() in a transaction of the request's session and return its result.
+
+    Every proxied collection call made by callback joins the transaction. Raises
+    TransactionsUnavailable when the deployment has no transactions (a standalone server
+    or the memory backend).
+    """
+    try:
+        session = request_session(client)
+    except NotImplementedError:
+        raise TransactionsUnavailable()
+    try:
+        return session.with_transaction(lambda session: callback())
+    except OperationFailure as e:
+        # IllegalOperation: transactions need a replica set or a sharded cluster
+        if e.code == 20:
+            raise TransactionsUnavailable()
+        raise
+
+############################################################################################
+#####                         REQUEST HOOKS                                           ######
+############################################################################################
+
+def record_read_after(response):
+    """Hand the operation time of a write back to the client and remember it for its user"""
+    session = g.get('db_session')
+    if session is not None and g.get('db_wrote') and session.operation_time is not None:
+        response.headers[READ_AFTER_HEADER] = format_timestamp(session.operation_time)
+        last_writes.set(current_user_id(), session.operation_time)
+    return response
+
+def end_session(exception=None):
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.end_session()
+
+def init_routing(app):
+    """Route each request's reads by endpoint and give it a causally consistent session"""
+    app.after_request(record_read_after)
+    app.teardown_request(end_session)
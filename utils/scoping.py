@@ -0,0 +1,45 @@
+"""Per-user data scoping.
+
+Every budget, wallet, income and expense carries a `user_id` owner key. The owner of a
+request is read from the X-User-Id header, which the authenticating gateway in front of
+the API is expected to set. Requests without it belong to DEFAULT_USER_ID, so a
+single-household deployment keeps working unchanged.
+
+`user_id` is also the leading field of every index and of the shard key, so each
+query is routed to the shard that holds that user's data.
+"""
+from flask import request, has_request_context
+import os
+
+USER_HEADER = 'X-User-Id'
+DEFAULT_USER_ID = os.getenv('DEFAULT_USER_ID', 'default')
+# Documents written before scoping have no owner; they belong to the default user until
+# scripts/backfill_owner.py has stamped them (then set SCOPE_INCLUDE_UNOWNED=0)
+SCOPE_INCLUDE_UNOWNED = os.getenv('SCOPE_INCLUDE_UNOWNED', '1') == '1'
+
+def current_user_id():
+    """Return the owner of the current request"""
+    if has_request_context():
+        return request.headers.get(USER_HEADER) or DEFAULT_USER_ID
+    return DEFAULT_USER_ID
+
+def owner_filter(user_id=None):
+    """Return the query condition on user_id that matches the documents of a user"""
+    user_id = user_id or current_user_id()
+    if user_id == DEFAULT_USER_ID and SCOPE_INCLUDE_UNOWNED:
+        return {"$in": [user_id, None]}
+    return user_id
+
+def scoped(query=None, user_id=None):
+    """Add the owner condition to a MongoDB query"""
+    return {"user_id": owner_filter(user_id), **(query or {})}
+
+def owned(document, user_id=None):
+    """Stamp a new document with the owner of the current request"""
+    document["user_id"] = user_id or current_user_id()
+    return document
+
+def strip_owner(update):
+    """Prevent a client from moving a document to another user through an update body"""
+    update.pop("user_id", None)
+    return update
@@ -0,0 +1,167 @@
+"""Storage backend shared by the route handlers, scripts and utilities.
+
+STORAGE_BACKEND selects where the collections live:
+
+- `mongodb` (default): the cluster at MONGODB_URI;
+- `memory`: an in-process mongomock database, with no network and no setup, used by the
+  test suite.
+
+Handlers bind collections once at import time, so `database` and the collections taken
+from it are proxies that resolve the current namespace on every call. Their methods run
+behind the retry and circuit breaker of utils/resilience.py, with the read preference
+and session of the current request (utils/routing.py). Connecting does not block:
+the app starts while MongoDB is unreachable and /readyz reports when it is usable. A namespace is a
+separate database (`myfinance_<name>`), which lets every test run against its own empty
+data while the suite runs in parallel (pytest -n auto).
+"""
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils import resilience
+from utils import routing
+import pymongo
+import hashlib
+import threading
+import os
+
+# Load config from .env file
+load_dotenv()
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mongodb')
+DATABASE_NAME = 'myfinance'
+DB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('DB_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+
+_lock = threading.Lock()
+_client = None
+_database_name = DATABASE_NAME
+
+def create_client():
+    """Create a client for the configured backend"""
+    if STORAGE_BACKEND == 'memory':
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError('STORAGE_BACKEND=memory needs the mongomock package')
+        return mongomock.MongoClient()
+    # Set up a connection to MongoDB cluster; pymongo connects in the background
+    client = pymongo.MongoClient(os.environ['MONGODB_URI'], serverSelectionTimeoutMS=DB_SERVER_SELECTION_TIMEOUT_MS)
+    # Report the outcome of the first connection without holding up the import
+    threading.Thread(target=log_connection, args=(client,), daemon=True).start()
+    return client
+
+def ping(client, timeout=None):
+    """Return None if the server answers a ping, or the error that prevented it"""
+    try:
+        if timeout is None:
+            client.admin.command('ping')
+        else:
+            with pymongo.timeout(timeout):
+                client.admin.command('ping')
+    except Exception as e:
+        return e
+    return None
+
+def log_connection(client):
+    error = ping(client)
+    if error is None:
+        print('SUCCESS: MongoDB is connected!')
+    elif isinstance(error, pymongo.errors.ServerSelectionTimeoutError):
+        print('ERROR: MongoDB connection timed out!')
+    else:
+        print(f'ERROR: An unexpected error occurred: {error}')
+
+def get_client():
+    """Return the shared client, creating it on first use"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = create_client()
+        return _client
+
+def current_database():
+    """Return the real database of the current namespace"""
+    return get_client()[_database_name]
+
+class CollectionProxy:
+    """A collection of whichever database is current when it is used"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attribute):
+        collection = routing.routed(current_database()[self.name])
+        value = getattr(collection, attribute)
+        if not callable(value):
+            return value
+        retryable = attribute in resilience.RETRYABLE_METHODS
+        lazy = attribute in resilience.LAZY_METHODS
+
+        def guarded(*args, **kwargs):
+            return resilience.call(value, args, routing.with_session(collection, attribute, kwargs), retryable, lazy=lazy)
+        return guarded
+
+    def __repr__(self):
+        return f'CollectionProxy({self.name!r})'
+
+class DatabaseProxy:
+    """The database of the current namespace"""
+
+    def __getitem__(self, name):
+        return CollectionProxy(name)
+
+    def __getattr__(self, attribute):
+        return getattr(current_database(), attribute)
+
+    def __repr__(self):
+        return 'DatabaseProxy()'
+
+database = DatabaseProxy()
+
+def connect():
+    """Return (client, database) like the connect_to_db() of the route modules"""
+    return get_client(), database
+
+def update_each(collection, updates, ordered=True):
+    """Apply (filter, update) pairs in one bulk write; return how many documents were modified.
+
+    mongomock cannot run the UpdateOne operations of pymongo 4.9+, so the memory backend
+    applies them one update_one at a time instead.
+    """
+    if not updates:
+        return 0
+    if STORAGE_BACKEND == 'memory':
+        return sum(collection.update_one(query, update).modified_count for query, update in updates)
+    return collection.bulk_write([pymongo.UpdateOne(query, update) for query, update in updates],
+                                 ordered=ordered).modified_count
+
+############################################################################################
+#####                         NAMESPACES                                              ######
+############################################################################################
+
+def namespace_database_name(namespace):
+    if not namespace:
+        return DATABASE_NAME
+    # Database names cannot contain these characters and are limited to 64 bytes
+    safe = ''.join(c if c.isalnum() or c in '_-' else '_' for c in namespace)
+    digest = hashlib.sha1(namespace.encode()).hexdigest()[:10]
+    return f'{DATABASE_NAME}_{safe[-40:]}_{digest}'
+
+def use_namespace(namespace=None):
+    """Switch every handler to the database of `namespace`; return the previous database name"""
+    global _database_name
+    previous = _database_name
+    _database_name = namespace_database_name(namespace)
+    return previous
+
+def drop_namespace(namespace):
+    if namespace:
+        get_client().drop_database(namespace_database_name(namespace))
+
+@contextmanager
+def isolated(namespace):
+    """Run a block against an empty namespace and drop it afterwards"""
+    global _database_name
+    previous = use_namespace(namespace)
+    try:
+        yield database
+    finally:
+        drop_namespace(namespace)
+        _database_name = previous
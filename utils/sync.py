@@ -0,0 +1,96 @@
+"""Change tracking for delta sync.
+
+Every write handler stamps the documents it creates or changes with `modified_at`,
+a server time in naive UTC. `updated_at` cannot serve here: clients send it themselves.
+Every delete, including the cascades from wallets and budgets, leaves a tombstone in
+the TTL-indexed `tombstones` collection. `GET /sync?since=<token>` can then return only
+what changed since the token.
+
+Sync tokens are opaque. A token stands for a point in time SYNC_OVERLAP_SECONDS before
+the sync that issued it. A write that was stamped before a sync but committed after it
+is therefore still picked up by the next sync. A client may receive a document twice,
+so it should apply changes by `_id`.
+"""
+from utils.db import get_database
+from utils.scoping import current_user_id
+from utils.archive import delete_archived
+from utils.buckets import transactions
+from utils.dates import utc_now
+import base64
+import datetime
+import os
+
+SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '5'))
+# Tokens older than this cannot be answered with tombstones; the client gets a full snapshot
+SYNC_TOMBSTONE_DAYS = int(os.getenv('SYNC_TOMBSTONE_DAYS', '30'))
+TOMBSTONE_COLLECTION = 'tombstones'
+TOKEN_PREFIX = 'v1:'
+
+# Names of the databases whose TTL index exists; every namespace is a database of its own
+_indexed_databases = set()
+
+def modified_now():
+    """The current time as stored in modified_at: naive UTC, truncated to BSON's milliseconds"""
+    now = utc_now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def stamped(document):
+    """Stamp a new document with its modification time"""
+    document["modified_at"] = modified_now()
+    return document
+
+def make_token(moment):
+    milliseconds = int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    return base64.urlsafe_b64encode(f'{TOKEN_PREFIX}{milliseconds}'.encode()).decode().rstrip('=')
+
+def parse_token(token):
+    """Return the moment a sync token stands for, or raise ValueError"""
+    try:
+        decoded = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid sync token: {token!r}')
+    if not decoded.startswith(TOKEN_PREFIX) or not decoded[len(TOKEN_PREFIX):].isdigit():
+        raise ValueError(f'Invalid sync token: {token!r}')
+    milliseconds = int(decoded[len(TOKEN_PREFIX):])
+    return datetime.datetime.fromtimestamp(milliseconds / 1000, datetime.timezone.utc).replace(tzinfo=None)
+
+def get_collection():
+    """Return the tombstone collection, creating its TTL index on first use in each database"""
+    database = get_database()
+    collection = database[TOMBSTONE_COLLECTION]
+    if database.name not in _indexed_databases:
+        collection.create_index("deleted_at", expireAfterSeconds=SYNC_TOMBSTONE_DAYS * 24 * 60 * 60)
+        _indexed_databases.add(database.name)
+    return collection
+
+def record_tombstones(collection_name, ids, user_id=None):
+    """Remember that documents of a collection were deleted"""
+    if not ids:
+        return
+    deleted_at = modified_now()
+    user_id = user_id or current_user_id()
+    get_collection().insert_many([{"collection": collection_name, "doc_id": str(_id),
+                                   "user_id": user_id, "deleted_at": deleted_at} for _id in ids])
+
+def delete_with_tombstones(collection, collection_name, query, user_id=None):
+    """delete_many that leaves a tombstone for every document it deletes; return how many it deleted"""
+    deleted = 0
+    while True:
+        ids = [document["_id"] for document in collection.find(query, {"_id": 1})]
+        if not ids:
+            return deleted
+        # Delete exactly the documents found, so every deletion has its tombstone;
+        # the next pass picks up documents added in the meantime
+        result = collection.delete_many({**query, "_id": {"$in": ids}})
+        record_tombstones(collection_name, ids, user_id)
+        if not result.deleted_count:
+            # Someone else deleted them first (and left their own tombstones)
+            return deleted
+        deleted += result.deleted_count
+
+def delete_transactions_with_tombstones(db, name, query):
+    """Delete the incomes or expenses matching a wallet query, live and archived, with tombstones; return how many"""
+    deleted = delete_with_tombstones(transactions(db, name), name, query)
+    archived = delete_archived(db, name, query)
+    record_tombstones(name, archived)
+    return deleted + len(archived)
@@ -0,0 +1,197 @@
+"""Request tracing and on-demand profiling.
+
+With TRACING_EXPORTER=file (spans as JSON lines in TRACING_FILE) or TRACING_EXPORTER=otlp
+(to the collector at OTEL_EXPORTER_OTLP_ENDPOINT), every request produces an
+OpenTelemetry trace. It has a span for the route, one per MongoDB command, one for JSON
+encoding and one for the Document AI call, so the time of a slow request can be split
+between them.
+
+Profiling is off unless PROFILE_TOKEN is set. A request that sends the same value in
+an `X-Profile` header is then run under the pyinstrument sampling profiler. The report
+(HTML, or a speedscope flamegraph with PROFILE_FORMAT=speedscope) is written to
+PROFILE_DIR and its path is returned in an `X-Profile-Path` header. Only one request is
+profiled at a time.
+"""
+from flask import request, g
+from contextlib import nullcontext
+from opentelemetry import trace, context
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from pymongo import monitoring
+from utils.db_accounting import command_shape
+import datetime
+import hmac
+import json
+import os
+import threading
+
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'wallet-manager-api')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'html')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.001'))
+
+tracer = None
+
+def configure_tracing(exporter):
+    """Send spans to `exporter` from now on"""
+    global tracer
+    provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    tracer = provider.get_tracer(__name__)
+    return provider
+
+def create_exporter(name):
+    if name == 'file':
+        return ConsoleSpanExporter(out=open(TRACING_FILE, 'a'),
+                                   formatter=lambda span: span.to_json(indent=None) + '\n')
+    if name == 'otlp':
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    raise ValueError(f'Unknown TRACING_EXPORTER: {name}')
+
+def span(name, **attributes):
+    """Context manager for a child span of the current request, or nothing when tracing is off"""
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+class CommandTracing(monitoring.CommandListener):
+    """Record every MongoDB command as a child span of the request that issued it"""
+
+    def __init__(self):
+        self._spans = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if tracer is None:
+            return
+        shape = command_shape(event.command_name, event.command)
+        command_span = tracer.start_span(f'mongodb.{event.command_name}', kind=SpanKind.CLIENT, attributes={
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.mongodb.collection": shape["collection"] or '',
+            "db.statement": json.dumps(shape, default=str),
+        })
+        with self._lock:
+            self._spans[(event.connection_id, event.request_id)] = command_span
+
+    def _finished(self, event, error=None):
+        with self._lock:
+            command_span = self._spans.pop((event.connection_id, event.request_id), None)
+        if command_span is None:
+            return
+        if error is not None:
+            command_span.set_status(Status(StatusCode.ERROR, error))
+        command_span.end()
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event, str(event.failure))
+
+monitoring.register(CommandTracing())
+
+############################################################################################
+#####                         REQUEST HOOKS                                           ######
+############################################################################################
+
+def start_trace():
+    if tracer is None:
+        return
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_span = tracer.start_span(f'{request.method} {route}', kind=SpanKind.SERVER, attributes={
+        "http.method": request.method,
+        "http.route": route,
+        "http.target": request.path,
+    })
+    g.trace_span = request_span
+    g.trace_token = context.attach(trace.set_span_in_context(request_span))
+
+def record_trace(response):
+    request_span = g.get('trace_span')
+    if request_span is not None:
+        request_span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            request_span.set_status(Status(StatusCode.ERROR))
+    return response
+
+def finish_trace(exception=None):
+    request_span = g.pop('trace_span', None)
+    if request_span is None:
+        return
+    if exception is not None:
+        request_span.record_exception(exception)
+        request_span.set_status(Status(StatusCode.ERROR, str(exception)))
+    request_span.end()
+    try:
+        context.detach(g.pop('trace_token'))
+    except ValueError:
+        # Streamed responses finish in another context
+        pass
+
+_profile_lock = threading.Lock()
+
+def start_profile():
+    token = request.headers.get(PROFILE_HEADER)
+    if not PROFILE_TOKEN or token is None or not hmac.compare_digest(token, PROFILE_TOKEN):
+        return
+    # Profiling is expensive: skip rather than wait while another request is profiled
+    if not _profile_lock.acquire(blocking=False):
+        return
+    from pyinstrument import Profiler
+    g.profiler = Profiler(interval=PROFILE_INTERVAL)
+    g.profiler.start()
+
+def write_profile(profiler):
+    """Write the report of a finished profile and return its path"""
+    from pyinstrument.renderers import SpeedscopeRenderer
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    name = f'{stamp}-{request.method}-{request.endpoint or "unmatched"}'
+    if PROFILE_FORMAT == 'speedscope':
+        path = os.path.join(PROFILE_DIR, name + '.speedscope.json')
+        report = profiler.output(renderer=SpeedscopeRenderer())
+    else:
+        path = os.path.join(PROFILE_DIR, name + '.html')
+        report = profiler.output_html()
+    with open(path, 'w') as report_file:
+        report_file.write(report)
+    return path
+
+def finish_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    try:
+        profiler.stop()
+        response.headers['X-Profile-Path'] = write_profile(profiler)
+    finally:
+        _profile_lock.release()
+    return response
+
+def abandon_profile(exception=None):
+    # The request failed before after_request: stop the profiler and free the slot
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        _profile_lock.release()
+
+def init_tracing(app):
+    """Configure the exporter and install the tracing and profiling hooks; call it first"""
+    if TRACING_EXPORTER != 'none':
+        configure_tracing(create_exporter(TRACING_EXPORTER))
+    app.before_request(start_trace)
+    app.after_request(record_trace)
+    app.teardown_request(finish_trace)
+    if PROFILE_TOKEN:
+        app.before_request(start_profile)
+        app.after_request(finish_profile)
+        app.teardown_request(abandon_profile)